@@ -0,0 +1,6 @@
+"""
+Benchmark suite for wgup.
+
+Run with `python3 -m bench run` from the repository root. Results are written
+as JSON so that runs can be compared with `python3 -m bench compare`.
+"""
@@ -0,0 +1,89 @@
+import argparse
+import sys
+
+from bench import memory, suite
+
+
+def _print_regressions(regressions, threshold: float):
+    if not regressions:
+        print(f"[i] No regressions above {threshold:.0%}.")
+        return 0
+    print(f"[!] {len(regressions)} regression(s) above {threshold:.0%}:")
+    for name, size, base, current in regressions:
+        print(
+            f"{name:26} {size:>8} : {base * 1000:10.3f} ms -> {current * 1000:10.3f} ms"
+            f" ({current / base - 1:+.0%})"
+        )
+    return 1
+
+
+def _run(args: argparse.Namespace):
+    results = suite.run(args.sizes, args.only, args.max_seconds)
+    if args.output:
+        suite.save_results(args.output, results)
+        print(f'[i] Wrote "{args.output}"')
+    if args.baseline:
+        baseline = suite.load_results(args.baseline)
+        return _print_regressions(
+            suite.compare(baseline, results, args.threshold), args.threshold
+        )
+    return 0
+
+
+def _compare(args: argparse.Namespace):
+    baseline = suite.load_results(args.baseline)
+    current = suite.load_results(args.current)
+    return _print_regressions(
+        suite.compare(baseline, current, args.threshold), args.threshold
+    )
+
+
+def _memory(args: argparse.Namespace):
+    results = memory.run(args.size_mb, max_peers=args.peers)
+    if args.output:
+        suite.save_results(args.output, {"memory": results})
+        print(f'[i] Wrote "{args.output}"')
+    return 0
+
+
+def get_parser():
+    root = argparse.ArgumentParser("bench")
+    root_sub = root.add_subparsers(title="subcommands", required=True)
+
+    # run
+    run = root_sub.add_parser("run", help="Run benchmarks")
+    run.set_defaults(func=_run)
+    run.add_argument("--sizes", type=int, nargs="+", default=suite.SIZES)
+    run.add_argument("--only", type=str, nargs="+", help="Benchmark names to run")
+    run.add_argument(
+        "--max-seconds",
+        type=float,
+        default=suite.MAX_SECONDS,
+        help="Skip larger sizes once a single run takes longer than this",
+    )
+    run.add_argument("-o", "--output", type=str, help="Write results to a JSON file")
+    run.add_argument("--baseline", type=str, help="Results to check against")
+    run.add_argument("--threshold", type=float, default=0.1)
+
+    # compare
+    compare = root_sub.add_parser("compare", help="Compare two result files")
+    compare.set_defaults(func=_compare)
+    compare.add_argument("baseline", type=str)
+    compare.add_argument("current", type=str)
+    compare.add_argument("--threshold", type=float, default=0.1)
+
+    # memory
+    mem = root_sub.add_parser(
+        "memory", help="Compare cold-load time and peak RSS of config loaders"
+    )
+    mem.set_defaults(func=_memory)
+    mem.add_argument("--size-mb", type=int, default=500)
+    mem.add_argument("--peers", type=int, help="Stop at this many peers")
+    mem.add_argument("-o", "--output", type=str, help="Write results to a JSON file")
+
+    return root
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args(sys.argv[1:])
+    sys.exit(args.func(args))
@@ -0,0 +1,69 @@
+"""
+Synthetic fleet generators.
+
+Key generation is stubbed out so that fleets of any size can be built without
+calling `wg` once per key.
+"""
+
+import base64
+import contextlib
+import ipaddress
+import os
+from unittest import mock
+
+from wgup import wireguard
+
+FLEET_CIDR4 = "10.0.0.0/8"
+FLEET_CIDR6 = "fd00:0:0:1::/64"
+
+
+def fake_key() -> str:
+    return base64.b64encode(os.urandom(32)).decode("ascii")
+
+
+@contextlib.contextmanager
+def stub_keys():
+    """
+    Replaces wireguard.CommandLine key generation with random bytes.
+    """
+    with mock.patch.multiple(
+        wireguard.CommandLine,
+        generate_private_key=staticmethod(fake_key),
+        generate_public_key=staticmethod(lambda _: fake_key()),
+        generate_preshared_key=staticmethod(fake_key),
+        generate_keys=staticmethod(lambda: (fake_key(), fake_key(), fake_key())),
+    ):
+        yield
+
+
+def peer_cidrs(count: int, cidr4: str = FLEET_CIDR4, cidr6: str = FLEET_CIDR6):
+    """
+    Yields (cidr4, cidr6) pairs for `count` peers, skipping the network and
+    server addresses just like the allocator does.
+    """
+    net4 = ipaddress.IPv4Network(cidr4)
+    net6 = ipaddress.IPv6Network(cidr6)
+    for i in range(2, count + 2):
+        yield f"{net4[i]}/32", f"{net6[i]}/128"
+
+
+def make_interface(
+    peers: int, vpn_iface: str = "wg0", port: int = 51820
+) -> wireguard.Interface:
+    with stub_keys():
+        iface = wireguard.Interface.create(
+            vpn_iface=vpn_iface,
+            vpn_cidr4=FLEET_CIDR4,
+            vpn_cidr6=FLEET_CIDR6,
+            host="vpn.example.com",
+            port=port,
+        )
+        iface.nat_iface = "eth0"
+        iface.nat_cidr4 = ["0.0.0.0/0"]
+        iface.nat_cidr6 = ["::/0"]
+        for i, (cidr4, cidr6) in enumerate(peer_cidrs(peers)):
+            name = f"peer{i}"
+            iface.peers[name] = wireguard.Peer.create(
+                name=name, cidr4=cidr4, cidr6=cidr6
+            )
+    return iface
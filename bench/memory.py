@@ -0,0 +1,100 @@
+"""
+Cold-load time and peak RSS of loading a large interfaces.json with the plain
+JSON loader, the incremental loader and the snapshot. "rebuild" is the first
+load after interfaces.json changed, which also writes the snapshot that
+"snapshot" then reads. Each loader runs in a fresh child process, since peak
+RSS cannot be reset within a process.
+"""
+
+import contextlib
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench import fleet
+
+MODES = ["json", "incremental", "rebuild", "snapshot"]
+
+
+def write_config(filename: str, size_mb: int, log=print, max_peers: int | None = None):
+    """
+    Streams a config of roughly `size_mb` megabytes (or with `max_peers`
+    peers, if that is reached first) with a single interface to `filename`,
+    without building it in memory.
+    """
+    from wgup import defaults
+
+    iface = fleet.make_interface(0).to_json()
+    del iface["peers"]
+    limit = size_mb * 1024 * 1024
+    peers = 0
+    with open(filename, "w") as f:
+        f.write(f'{{"version": {defaults.CONFIG_VERSION}, "interfaces": [')
+        f.write(json.dumps(iface)[:-1] + ', "peers": [')
+        for i, (cidr4, cidr6) in enumerate(fleet.peer_cidrs(1 << 24)):
+            if f.tell() >= limit or i == max_peers:
+                break
+            peer = {
+                "name": f"peer{i}",
+                "private_key": fleet.fake_key(),
+                "public_key": fleet.fake_key(),
+                "preshared_key": fleet.fake_key(),
+                "cidr4": cidr4,
+                "cidr6": cidr6,
+            }
+            f.write(("," if i else "") + json.dumps(peer, indent=4))
+            peers += 1
+        f.write("]}]}")
+    log(f"[i] Wrote {peers} peers ({os.path.getsize(filename) >> 20} MiB).")
+    return peers
+
+
+def child(mode: str, config_dir: str):
+    from bench.suite import isolated_config, without_snapshot
+    from wgup import config
+    from wgup.config import Config
+
+    if mode == "json":
+        config.INCREMENTAL_LOAD_SIZE = 1 << 62
+    elif mode == "incremental":
+        config.INCREMENTAL_LOAD_SIZE = 0
+    snapshot = mode in ("rebuild", "snapshot")
+    with isolated_config(config_dir):
+        with contextlib.nullcontext() if snapshot else without_snapshot():
+            start = time.perf_counter()
+            c = Config()
+            seconds = time.perf_counter() - start
+        peers = sum(len(i.peers) for i in c.interfaces.values())
+    peak_kib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(
+        json.dumps(
+            {"mode": mode, "peers": peers, "seconds": seconds, "peak_kib": peak_kib}
+        )
+    )
+
+
+def run(size_mb: int, log=print, max_peers: int | None = None):
+    results = {}
+    with tempfile.TemporaryDirectory() as config_dir:
+        write_config(f"{config_dir}/interfaces.json", size_mb, log, max_peers)
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, "-m", "bench.memory", mode, config_dir],
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            result = json.loads(output)
+            results[mode] = result
+            log(
+                f"{mode:12} : {result['seconds']:8.2f} s"
+                f" : peak RSS {result['peak_kib'] / 1024:8.1f} MiB"
+            )
+    return results
+
+
+if __name__ == "__main__":
+    child(sys.argv[1], sys.argv[2])
@@ -0,0 +1,263 @@
+"""
+Benchmarks for the hot paths of wgup at fleet scale.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from typing import Any, Callable
+from unittest import mock
+
+from bench import fleet
+from wgup import config, defaults
+from wgup.config import Config
+from wgup.importer import Importer
+from wgup.mesh import Mesh
+from wgup.snapshot import Snapshot
+from wgup.util import IP
+
+SIZES = [10, 1_000, 10_000, 100_000]
+RESULTS_VERSION = 1
+
+# Stop repeating a benchmark once it has used this many seconds in total.
+_TIME_BUDGET = 1.0
+_MAX_REPEAT = 5
+# Skip larger sizes once a single run of a benchmark takes longer than this.
+MAX_SECONDS = 30.0
+
+
+@contextlib.contextmanager
+def isolated_config(config_dir: str):
+    """
+    Points the Config singleton at `config_dir` for the duration of the block.
+    """
+    with (
+        mock.patch.object(defaults, "CONFIG_DIR", config_dir),
+        mock.patch.object(
+            config, "_CONFIG_INTERFACES", f"{config_dir}/interfaces.json"
+        ),
+    ):
+        Config._instance = None
+        try:
+            yield
+        finally:
+            Config._instance = None
+
+
+class Benchmark:
+    def __init__(
+        self,
+        name: str,
+        setup: Callable[[int, str], Any],
+        run: Callable[[Any], Any],
+    ):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+
+def _setup_saved(peers: int, config_dir: str):
+    iface = fleet.make_interface(peers)
+    Config._instance = None
+    c = Config()
+    c.interfaces[iface.vpn_iface] = iface
+    c.save()
+    return c
+
+
+@contextlib.contextmanager
+def without_snapshot():
+    """
+    Makes Config read interfaces.json without using or writing a snapshot.
+    """
+    with (
+        mock.patch.object(Snapshot, "load", return_value=None),
+        mock.patch.object(Snapshot, "key", return_value=None),
+    ):
+        yield
+
+
+def _run_load(_):
+    Config._instance = None
+    with without_snapshot():
+        return Config()
+
+
+def _run_load_incremental(_):
+    with mock.patch.object(config, "INCREMENTAL_LOAD_SIZE", 0):
+        return _run_load(None)
+
+
+def _run_load_snapshot(_):
+    Config._instance = None
+    return Config()
+
+
+def _run_save(c: Config):
+    c.save()
+
+
+def _setup_alloc4(peers: int, _: str):
+    return list(cidr4 for cidr4, _ in fleet.peer_cidrs(peers))
+
+
+def _setup_alloc6(peers: int, _: str):
+    return list(cidr6 for _, cidr6 in fleet.peer_cidrs(peers))
+
+
+def _setup_iface(peers: int, _: str):
+    return fleet.make_interface(peers)
+
+
+def _run_peer_configs(iface):
+    for peer in iface.peers.values():
+        peer.get_config(
+            vpn_cidr4=iface.vpn_cidr4,
+            vpn_cidr6=iface.vpn_cidr6,
+            nat_cidr4=iface.nat_cidr4,
+            nat_cidr6=iface.nat_cidr6,
+            endpoint_public_key=iface.public_key,
+            endpoint_host=iface.host,
+            endpoint_port=iface.port,
+        )
+
+
+def _setup_mesh(peers: int, _: str):
+    iface = fleet.make_interface(peers)
+    for i, peer in enumerate(iface.peers.values()):
+        peer.mesh = True
+        peer.endpoint = f"198.51.100.{i % 250 + 1}:{51820 + i // 250}"
+    return iface
+
+
+def _run_mesh(iface):
+    mesh = Mesh(iface)
+    for peer in iface.peers.values():
+        mesh.peer_config(peer)
+
+
+def _setup_import(peers: int, config_dir: str):
+    iface = fleet.make_interface(peers)
+    filename = f"{config_dir}/{iface.vpn_iface}.conf"
+    with open(filename, "w") as f:
+        f.write(iface.get_config())
+    return filename
+
+
+def _run_import(filename: str):
+    with fleet.stub_keys():
+        Importer.from_file(filename, "wg0", "vpn.example.com")
+
+
+BENCHMARKS = [
+    Benchmark("Config.load", _setup_saved, _run_load),
+    Benchmark("Config.load (incremental)", _setup_saved, _run_load_incremental),
+    Benchmark("Config.load (snapshot)", _setup_saved, _run_load_snapshot),
+    Benchmark("Config.save", _setup_saved, _run_save),
+    Benchmark(
+        "IP.next_addr4",
+        _setup_alloc4,
+        lambda existing: IP.next_addr4(fleet.FLEET_CIDR4, existing),
+    ),
+    Benchmark(
+        "IP.next_addr6",
+        _setup_alloc6,
+        lambda existing: IP.next_addr6(fleet.FLEET_CIDR6, existing),
+    ),
+    Benchmark(
+        "IP.allocate_many_dual",
+        lambda peers, _: list(zip(*fleet.peer_cidrs(peers))),
+        lambda existing: IP.allocate_many_dual(
+            fleet.FLEET_CIDR4,
+            existing[0],
+            fleet.FLEET_CIDR6,
+            existing[1],
+            len(existing[0]),
+        ),
+    ),
+    Benchmark("Interface.get_config", _setup_iface, lambda i: i.get_config()),
+    Benchmark("Peer.get_config", _setup_iface, _run_peer_configs),
+    Benchmark("Importer.from_file", _setup_import, _run_import),
+    Benchmark("Mesh.peer_config (all)", _setup_mesh, _run_mesh),
+]
+
+
+def _measure(run: Callable[[Any], Any], state: Any):
+    times: list[float] = []
+    while len(times) < _MAX_REPEAT and sum(times) < _TIME_BUDGET:
+        start = time.perf_counter()
+        run(state)
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "repeat": len(times),
+    }
+
+
+def run(
+    sizes: list[int],
+    only: list[str] | None = None,
+    max_seconds: float = MAX_SECONDS,
+    log=print,
+):
+    results: dict[str, dict[str, dict]] = {}
+    for benchmark in BENCHMARKS:
+        if only and benchmark.name not in only:
+            continue
+        results[benchmark.name] = {}
+        too_slow = False
+        for size in sizes:
+            if too_slow:
+                results[benchmark.name][str(size)] = {"skipped": True}
+                log(f"{benchmark.name:26} {size:>8} : {'skipped':>13}")
+                continue
+            with tempfile.TemporaryDirectory() as config_dir:
+                with isolated_config(config_dir):
+                    state = benchmark.setup(size, config_dir)
+                    result = _measure(benchmark.run, state)
+            results[benchmark.name][str(size)] = result
+            too_slow = result["min"] > max_seconds
+            log(f"{benchmark.name:26} {size:>8} : {result['min'] * 1000:10.3f} ms")
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "wgup": defaults.VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": int(time.time()),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float):
+    """
+    Returns a list of (benchmark, size, baseline, current) for every benchmark
+    that got slower by more than `threshold` (0.1 = 10%). Minimum times are
+    compared since they are the least noisy.
+    """
+    regressions = []
+    for name, sizes in current["results"].items():
+        for size, result in sizes.items():
+            base = baseline["results"].get(name, {}).get(size)
+            if base is None or base.get("skipped") or result.get("skipped"):
+                continue
+            if result["min"] > base["min"] * (1 + threshold):
+                regressions.append((name, size, base["min"], result["min"]))
+    return regressions
+
+
+def load_results(filename: str):
+    with open(filename, "r") as f:
+        return json.load(f)
+
+
+def save_results(filename: str, results: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, "w") as f:
+        f.write(json.dumps(results, indent=4))
@@ -0,0 +1,91 @@
+import ipaddress
+from unittest import TestCase
+
+from wgup import wireguard
+from wgup.capacity import GROWTH_WINDOW, Capacity
+from wgup.util import IP
+
+NOW = 1_700_000_000
+DAY = 86400
+
+
+class TestCapacity(TestCase):
+    def setUp(self):
+        self.iface = wireguard.Interface(
+            private_key="priv",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+        )
+        for i in range(10):
+            name = f"peer{i}"
+            self.iface.peers[name] = wireguard.Peer(
+                name=name,
+                private_key=f"priv{i}",
+                public_key=f"pub{i}",
+                preshared_key=f"psk{i}",
+                cidr4=f"10.0.0.{i + 2}/32",
+                cidr6=f"fd00::{i + 2}/128",
+                created=NOW - i * 10 * DAY,
+            )
+
+    def test_used_ranges(self):
+        network = ipaddress.ip_network("10.0.0.0/24")
+        used = IP.used_ranges(
+            network,
+            ["10.0.0.2/32", "10.0.0.3/32", "10.0.0.16/28", "10.0.0.20/32"]
+            + ["10.0.1.2/32", "fd00::2/128", "10.0.0.128/25", "10.0.0.0/16"],
+        )
+        self.assertEqual(used, [(int(network.network_address), int(network[-1]))])
+        used = IP.used_ranges(
+            network, ["10.0.0.16/28", "10.0.0.2/32", "10.0.0.3/32", "10.0.0.20/32"]
+        )
+        start = int(network.network_address)
+        self.assertEqual(used, [(start, start + 3), (start + 16, start + 31)])
+
+    def test_pool(self):
+        del self.iface.peers["peer3"]
+        row = Capacity.pool(
+            "10.0.0.0/24", list(p.cidr4 for p in self.iface.peers.values())
+        )
+        self.assertEqual(
+            row,
+            {
+                "pool": "10.0.0.0/24",
+                "hosts": 254,
+                "used": 9,
+                "free": 245,
+                "largest": 244,
+            },
+        )
+        row = Capacity.pool("fd00::/64", ["fd00::2/128", "fd00::8000:0:0:0/65"])
+        self.assertEqual(row["used"], 1 + 2**63)
+        self.assertEqual(row["free"], 2**63 - 3)
+        self.assertEqual(row["largest"], 2**63 - 3)
+        self.assertEqual(Capacity.count(row["free"]), "~2^63.0")
+        self.assertEqual(Capacity.pool("10.0.0.0/30", ["10.0.0.2/32"])["free"], 1)
+
+    def test_report(self):
+        v4, v6 = Capacity.report(self.iface, NOW)
+        # peer0 to peer8 were created within GROWTH_WINDOW
+        self.assertAlmostEqual(v4["rate"], 9 / GROWTH_WINDOW)
+        self.assertAlmostEqual(v4["exhausted"], NOW + 244 * GROWTH_WINDOW / 9)
+        self.assertIsNone(v6["exhausted"])
+        self.assertIsNone(
+            Capacity.report(self.iface, NOW + GROWTH_WINDOW)[0]["exhausted"]
+        )
+        self.iface.vpn_cidr4 = "10.0.0.0/28"
+        self.iface.peers["peer10"] = wireguard.Peer(
+            name="peer10",
+            private_key="priv",
+            public_key="pub",
+            preshared_key="psk",
+            cidr4="10.0.0.12/30",
+            cidr6="fd00::12/128",
+        )
+        self.assertEqual(Capacity.report(self.iface, NOW)[0]["exhausted"], NOW)
@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from wgup import defaults, wireguard
+from wgup.cluster import Layout
+from wgup.util import ArgsException, ClusterException
+
+
+class TestLayout(TestCase):
+    def setUp(self):
+        self.counter = 0
+        patchers = [
+            mock.patch.object(
+                wireguard.CommandLine, "generate_private_key", side_effect=self._key
+            ),
+            mock.patch.object(
+                wireguard.CommandLine,
+                "generate_public_key",
+                side_effect=lambda k: k.replace("priv", "pub"),
+            ),
+            mock.patch.object(
+                wireguard.CommandLine,
+                "generate_keys",
+                side_effect=lambda: (self._key(), "pub", "psk"),
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.layout = Layout(
+            iface="wg0", cidr4="10.8.0.0/16", cidr6="fd00:8::/64", shards=4
+        )
+        for name in ("gw1", "gw2", "gw3"):
+            self.layout.add_node(name, f"{name}.example.com", 51820)
+
+    def _key(self):
+        self.counter += 1
+        return f"priv{self.counter}"
+
+    def _join(self, name: str, peers: list[str]) -> wireguard.Interface:
+        """Stands in for running `cluster join` and `peer create` on a node."""
+        iface = self.layout.create_interface(name)
+        for peer, (cidr4, cidr6) in zip(peers, iface.allocate(peers)):
+            iface.peers[peer] = wireguard.Peer.create(
+                name=peer, cidr4=cidr4, cidr6=cidr6
+            )
+        config_dir = f"{self.dir}/nodes/{name}"
+        os.makedirs(config_dir)
+        with open(f"{config_dir}/interfaces.json", "w") as f:
+            data = {"version": defaults.CONFIG_VERSION, "interfaces": [iface.to_json()]}
+            f.write(json.dumps(data))
+        return iface
+
+    def test_shards(self):
+        self.assertEqual(list(n["shard"] for n in self.layout.nodes), [0, 1, 2])
+        self.assertEqual(
+            self.layout.shard("gw2"), ("10.8.64.0/18", "fd00:8:0:0:4000::/66")
+        )
+        self.layout.add_node("gw4", "gw4.example.com", 51820)
+        with self.assertRaises(ClusterException):
+            self.layout.add_node("gw5", "gw5.example.com", 51820)
+        with self.assertRaises(ClusterException):
+            self.layout.node("gw9")
+        with self.assertRaises(ArgsException):
+            Layout(iface="wg0", cidr4="10.0.0.0/30", cidr6="fd00::/64", shards=2)
+
+    def test_roundtrip(self):
+        filename = f"{self.dir}/cluster.json"
+        self.layout.save(filename)
+        layout = Layout.load(filename)
+        self.assertEqual(layout.to_json(), self.layout.to_json())
+
+    def test_render(self):
+        ifaces = dict(
+            (n, self._join(n, ["laptop", "phone"])) for n in ("gw1", "gw2", "gw3")
+        )
+        # nodes allocate from their own shard only
+        self.assertEqual(ifaces["gw3"].peers["phone"].cidr4, "10.8.128.3/32")
+        written = self.layout.render(f"{self.dir}/nodes", f"{self.dir}/out")
+        self.assertEqual(len(written), 9)
+        with open(f"{self.dir}/out/gw2/wg0.conf") as f:
+            conf = f.read()
+        self.assertIn(f"PublicKey = {ifaces['gw1'].public_key}", conf)
+        self.assertIn("AllowedIPs = 10.8.128.0/18\n", conf)
+        self.assertIn("Endpoint = gw3.example.com:51820\n", conf)
+        self.assertNotIn("Endpoint = gw2.example.com", conf)
+        with open(f"{self.dir}/out/gw3/peers/laptop.conf") as f:
+            conf = f.read()
+        self.assertIn("AllowedIPs = 10.8.0.0/16\n", conf)
+        self.assertIn("Endpoint = gw3.example.com:51820\n", conf)
+
+    def test_render_missing_node(self):
+        self._join("gw1", [])
+        with self.assertRaises(ClusterException):
+            self.layout.render(f"{self.dir}/nodes", f"{self.dir}/out")
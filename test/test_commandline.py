@@ -0,0 +1,170 @@
+import os
+import sys
+import tempfile
+import time
+from unittest import TestCase, mock
+
+from wgup import helper, wireguard
+from wgup.util import CommandException
+from wgup.wireguard import AsyncCommandLine
+
+_STUBS = {
+    "wg": """#!/bin/sh
+case "$1" in
+    genkey|genpsk) head -c 32 /dev/urandom | base64 ;;
+    pubkey) echo "pub-$(cat)" ;;
+    *) exit 1 ;;
+esac
+""",
+    "nap": """#!/bin/sh
+sleep "$1"
+""",
+    "fail": """#!/bin/sh
+echo "it broke" >&2
+exit 3
+""",
+    "systemctl": """#!/bin/sh
+case "$2" in
+    *broken*) echo "unit failed" >&2; exit 1 ;;
+esac
+""",
+}
+
+
+class TestAsyncCommandLine(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        for name, script in _STUBS.items():
+            path = f"{self.dir.name}/{name}"
+            with open(path, "w") as f:
+                f.write(script)
+            os.chmod(path, 0o755)
+        path = f'{self.dir.name}{os.pathsep}{os.environ.get("PATH", "")}'
+        for patcher in (
+            mock.patch.dict(os.environ, {"PATH": path}),
+            mock.patch.object(wireguard.KeyPool, "take", return_value=None),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _iface(self, peers: int) -> wireguard.Interface:
+        iface = wireguard.Interface(
+            private_key="priv",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+        )
+        for i in range(peers):
+            iface.peers[f"peer{i}"] = wireguard.Peer(
+                name=f"peer{i}",
+                private_key="old",
+                public_key="old",
+                preshared_key="old",
+                cidr4=f"10.0.0.{i + 2}/32",
+                cidr6=f"fd00::{i + 2}/128",
+            )
+        return iface
+
+    def test_results_in_order(self):
+        commands = AsyncCommandLine()
+        results = commands.gather(commands.run(["echo", str(i)]) for i in range(20))
+        self.assertEqual(results, list(str(i) for i in range(20)))
+
+    def test_concurrency_is_bounded(self):
+        for concurrency, minimum, maximum in ((4, 0.2, 0.39), (2, 0.4, 5.0)):
+            commands = AsyncCommandLine(concurrency)
+            start = time.monotonic()
+            commands.gather(commands.run(["nap", "0.2"]) for _ in range(4))
+            elapsed = time.monotonic() - start
+            self.assertGreaterEqual(elapsed, minimum, concurrency)
+            self.assertLessEqual(elapsed, maximum, concurrency)
+
+    def test_failures_are_aggregated(self):
+        commands = AsyncCommandLine(timeout=0.2)
+        marker = f"{self.dir.name}/marker"
+        start = time.monotonic()
+        with self.assertRaises(CommandException) as cm:
+            commands.gather(
+                [
+                    commands.run(["fail"]),
+                    commands.run(["nap", "10"]),
+                    commands.run(["does-not-exist"]),
+                    commands.run(["touch", marker]),
+                ]
+            )
+        self.assertLess(time.monotonic() - start, 5)
+        # the other commands still ran
+        self.assertTrue(os.path.exists(marker))
+        failures = dict((args[0], reason) for args, reason in cm.exception.failures)
+        self.assertEqual(failures["fail"], "exit status 3: it broke")
+        self.assertEqual(failures["nap"], "timed out after 0.2s")
+        self.assertIn("does-not-exist", failures)
+        self.assertTrue(str(cm.exception).startswith("[!] 3 of 4 commands failed:"))
+
+    def test_interface_rekey(self):
+        iface = self._iface(10)
+        iface.rekey(concurrency=4)
+        self.assertNotEqual(iface.private_key, "priv")
+        self.assertEqual(iface.public_key, f"pub-{iface.private_key}")
+        keys = set()
+        for peer in iface.peers.values():
+            self.assertEqual(peer.public_key, f"pub-{peer.private_key}")
+            self.assertNotEqual(peer.preshared_key, "old")
+            keys.add(peer.private_key)
+        self.assertEqual(len(keys), 10)
+
+    def test_rekey_is_all_or_nothing(self):
+        iface = self._iface(3)
+        with open(f"{self.dir.name}/wg", "w") as f:
+            f.write(_STUBS["fail"])
+        with self.assertRaises(CommandException):
+            iface.rekey()
+        self.assertEqual(iface.private_key, "priv")
+        self.assertEqual(iface.peers["peer0"].private_key, "old")
+
+    def test_create_many(self):
+        addrs = list(
+            (f"peer{i}", f"10.0.0.{i + 2}/32", f"fd00::{i + 2}/128") for i in range(5)
+        )
+        peers = wireguard.Peer.create_many(addrs)
+        self.assertEqual(list(p.name for p in peers), list(a[0] for a in addrs))
+        self.assertEqual(peers[3].cidr4, "10.0.0.5/32")
+        self.assertEqual(peers[3].public_key, f"pub-{peers[3].private_key}")
+
+    def test_helper_services(self):
+        results = helper.run(
+            {
+                "services": [
+                    {"iface": "wg0", "action": "up"},
+                    {"iface": "broken", "action": "reload"},
+                ]
+            }
+        )
+        self.assertEqual(
+            results,
+            [
+                {"iface": "wg0", "step": "up", "ok": True, "error": ""},
+                {
+                    "iface": "broken",
+                    "step": "reload",
+                    "ok": False,
+                    "error": "exit status 1: unit failed",
+                },
+            ],
+        )
+
+    def test_helper_isolated(self):
+        with (
+            mock.patch.object(wireguard.defaults, "CONFIG_DIR", self.dir.name),
+            mock.patch.object(wireguard.CommandLine, "_run", return_value="[]") as run,
+        ):
+            wireguard.CommandLine.run_helper({"services": []})
+        args = run.call_args.args[0]
+        self.assertEqual(args[:2], ["sudo", sys.executable])
+        self.assertLess(args.index("-I"), args.index("-m"))
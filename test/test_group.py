@@ -0,0 +1,122 @@
+from unittest import TestCase, mock
+
+from wgup import wireguard
+from wgup.group import Group
+from wgup.util import ArgsException
+
+
+class TestGroup(TestCase):
+    def setUp(self):
+        patchers = [
+            mock.patch.object(
+                wireguard.CommandLine, "generate_private_key", return_value="priv"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_public_key", return_value="pub"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine,
+                "generate_keys",
+                return_value=("priv", "pub", "psk"),
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.members = Group.create(
+            group="vpn",
+            count=3,
+            port_base=51820,
+            cidr4="10.8.0.0/16",
+            cidr6="fd00:8::/64",
+            host="example.com",
+        )
+        self.interfaces = dict((m.vpn_iface, m) for m in reversed(self.members))
+
+    def _add(self, member: wireguard.Interface, names: list[str]):
+        for name, (cidr4, cidr6) in zip(names, member.allocate(names)):
+            member.peers[name] = wireguard.Peer.create(
+                name=name, cidr4=cidr4, cidr6=cidr6
+            )
+
+    def test_create(self):
+        self.assertEqual(
+            list(m.vpn_iface for m in Group.members(self.interfaces, "vpn")),
+            ["wg-vpn0", "wg-vpn1", "wg-vpn2"],
+        )
+        self.assertEqual(
+            list(m.vpn_cidr4 for m in self.members),
+            ["10.8.0.0/18", "10.8.64.0/18", "10.8.128.0/18"],
+        )
+        self.assertEqual(list(m.port for m in self.members), [51820, 51821, 51822])
+        self.assertEqual(self.members[1].routed_cidr4, "10.8.0.0/16")
+        self.assertEqual(self.members[1].routed_cidr6, "fd00:8::/64")
+        self.assertIn("-i wg-vpn1 -o wg-vpn2 -j ACCEPT", self.members[1].get_config())
+        data = self.members[2].to_json()
+        iface = wireguard.Interface.from_json(data)
+        self.assertEqual((iface.group, iface.net_cidr4), ("vpn", "10.8.0.0/16"))
+        self.assertEqual(iface.group_size, 3)
+        with self.assertRaises(ArgsException):
+            Group.create(
+                group="tiny",
+                count=4,
+                port_base=1,
+                cidr4="10.0.0.0/29",
+                cidr6="fd00::/64",
+                host="example.com",
+            )
+
+    def test_prefix(self):
+        # vpn2's members must not be matched by vpn's forwarding rules
+        other = Group.create(
+            group="vpn2",
+            count=1,
+            port_base=51830,
+            cidr4="10.9.0.0/16",
+            cidr6="fd00:9::/64",
+            host="example.com",
+        )
+        self.assertEqual(other[0].vpn_iface, "wg-vpn20")
+        for member in self.members:
+            rules = list(
+                line.split()
+                for line in member.get_config().splitlines()
+                if "FORWARD" in line
+            )
+            outputs = set(r[r.index("-o") + 1] for r in rules)
+            self.assertEqual(outputs, {"wg-vpn0", "wg-vpn1", "wg-vpn2"})
+            self.assertFalse(any(o.endswith("+") for o in outputs))
+        self.assertNotIn("-o wg-vpn0 ", other[0].get_config())
+
+    def test_place(self):
+        self._add(self.members[0], ["a", "b", "c"])
+        self._add(self.members[2], ["d"])
+        placed = Group.place(self.members, 4)
+        self.assertEqual(
+            list(m.vpn_iface for m in placed),
+            ["wg-vpn1", "wg-vpn1", "wg-vpn2", "wg-vpn1"],
+        )
+
+    def test_rebalance(self):
+        self._add(self.members[0], list(f"peer{i}" for i in range(7)))
+        self.assertEqual(len(Group.rebalance(self.members, dry_run=True)), 4)
+        self.assertEqual(len(self.members[0].peers), 7)
+        moves = Group.rebalance(self.members)
+        self.assertEqual(list(len(m.peers) for m in self.members), [3, 2, 2])
+        self.assertEqual(moves[0], ("peer3", "wg-vpn0", "wg-vpn1"))
+        # moved peers get an address from their new member's sub-pool
+        self.assertEqual(self.members[1].peers["peer3"].cidr4, "10.8.64.2/32")
+        self.assertEqual(Group.rebalance(self.members), [])
+
+    def test_rebalance_name_clash(self):
+        self._add(self.members[0], list(f"peer{i}" for i in range(7)))
+        self._add(self.members[1], ["peer3"])
+        moves = Group.rebalance(self.members)
+        self.assertEqual(list(len(m.peers) for m in self.members), [3, 3, 2])
+        # the same-named peer on the target is kept, another one moves
+        self.assertEqual(
+            moves[:2],
+            [("peer4", "wg-vpn0", "wg-vpn1"), ("peer5", "wg-vpn0", "wg-vpn1")],
+        )
+        self.assertEqual(self.members[1].peers["peer3"].cidr4, "10.8.64.2/32")
+        self.assertEqual(len(set(n for n, _, _ in moves)), len(moves))
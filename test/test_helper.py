@@ -0,0 +1,171 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from wgup import cli, helper, wireguard
+from wgup.util import HelperException
+
+_SYSTEMCTL = """#!/bin/sh
+echo "$@" >> "$(dirname "$0")/calls"
+case "$2" in
+    *broken*) echo "unit failed" >&2; exit 1 ;;
+esac
+"""
+
+
+class TestHelper(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.bin = f"{self.dir.name}/bin"
+        self.etc = f"{self.dir.name}/etc"
+        os.makedirs(self.bin)
+        os.makedirs(self.etc)
+        with open(f"{self.bin}/systemctl", "w") as f:
+            f.write(_SYSTEMCTL)
+        os.chmod(f"{self.bin}/systemctl", 0o755)
+        path = f'{self.bin}{os.pathsep}{os.environ.get("PATH", "")}'
+        for patcher in (
+            mock.patch.dict(os.environ, {"PATH": path}),
+            mock.patch.object(helper, "WIREGUARD_DIR", self.etc),
+            mock.patch.object(helper.os, "chown", side_effect=self._chown),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _chown(self, path: str, uid: int, gid: int):
+        if path.endswith("/locked.conf"):
+            raise PermissionError(1, "Operation not permitted", path)
+
+    def _source(self, iface: str) -> dict:
+        source = f"{self.dir.name}/{iface}.conf"
+        with open(source, "w") as f:
+            f.write(f"# {iface}\n")
+        return {"iface": iface, "source": source}
+
+    def _calls(self) -> list[str]:
+        if not os.path.exists(f"{self.bin}/calls"):
+            return []
+        with open(f"{self.bin}/calls") as f:
+            return f.read().splitlines()
+
+    def _main(self, plan: dict) -> tuple[int, str, str]:
+        plan_file = f"{self.dir.name}/plan.json"
+        with open(plan_file, "w") as f:
+            f.write(json.dumps(plan))
+        out, err = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            status = helper.main([plan_file])
+        return status, out.getvalue(), err.getvalue()
+
+    def test_validate(self):
+        helper.validate(
+            {
+                "install": [self._source("wg0")],
+                "services": [{"iface": "wg0", "action": "apply"}],
+            }
+        )
+        helper.validate({})
+        for plan in (
+            {"install": [{"iface": "wg0", "source": f"{self.dir.name}/missing"}]},
+            {"install": [{"iface": "wg0", "source": self.dir.name}]},
+            {"install": [dict(self._source("wg0"), iface="../../etc/passwd")]},
+            {"services": [{"iface": "wg0; reboot", "action": "up"}]},
+            {"services": [{"iface": "wg-too-long-name0", "action": "up"}]},
+            {"services": [{"action": "up"}]},
+            {"services": [{"iface": "wg0", "action": "restart"}]},
+        ):
+            with self.assertRaises(ValueError, msg=plan):
+                helper.validate(plan)
+
+    def test_rejected(self):
+        entry = self._source("wg0")
+        status, out, err = self._main(
+            {
+                "install": [entry],
+                "services": [
+                    {"iface": "wg0", "action": "up"},
+                    {"iface": "wg1", "action": "rm -rf"},
+                ],
+            }
+        )
+        self.assertEqual(status, 2)
+        self.assertEqual(out, "")
+        self.assertIn('Unknown service action "rm -rf".', err)
+        # nothing in a rejected plan runs
+        self.assertTrue(os.path.exists(entry["source"]))
+        self.assertEqual(os.listdir(self.etc), [])
+        self.assertEqual(self._calls(), [])
+
+    def test_results(self):
+        status, out, _ = self._main(
+            {
+                "install": [self._source("wg0"), self._source("locked")],
+                "services": [
+                    {"iface": "wg0", "action": "up"},
+                    {"iface": "locked", "action": "reload"},
+                    {"iface": "broken", "action": "reload"},
+                ],
+            }
+        )
+        self.assertEqual(status, 1)
+        results = json.loads(out)
+        self.assertEqual(
+            list((r["step"], r["iface"], r["ok"]) for r in results),
+            [
+                ("install", "wg0", True),
+                ("install", "locked", False),
+                ("up", "wg0", True),
+                ("reload", "broken", False),
+            ],
+        )
+        self.assertIn("Operation not permitted", results[1]["error"])
+        self.assertEqual(results[3]["error"], "exit status 1: unit failed")
+        # services of interfaces that failed to install are skipped
+        self.assertEqual(
+            sorted(self._calls()),
+            [
+                "enable wg-quick@wg0",
+                "reload wg-quick@broken",
+                "restart wg-quick@wg0",
+            ],
+        )
+        with open(f"{self.etc}/wg0.conf") as f:
+            self.assertEqual(f.read(), "# wg0\n")
+        self.assertEqual(oct(os.stat(f"{self.etc}/wg0.conf").st_mode & 0o777), "0o600")
+
+    def test_aggregate(self):
+        results = [
+            {"iface": "wg0", "step": "install", "ok": True, "error": ""},
+            {"iface": "wg1", "step": "install", "ok": True, "error": ""},
+            {"iface": "wg0", "step": "reload", "ok": True, "error": ""},
+            {"iface": "wg1", "step": "reload", "ok": False, "error": "unit failed"},
+        ]
+        out = io.StringIO()
+        with (
+            mock.patch.object(
+                wireguard.CommandLine, "run_helper", return_value=results
+            ),
+            contextlib.redirect_stdout(out),
+        ):
+            status, succeeded = cli.Iface._run_helper({})
+        self.assertEqual(status, 1)
+        # an interface only succeeded if all of its steps did
+        self.assertEqual(succeeded, ["wg0"])
+        self.assertIn('[i] install: interface "wg1" OK.', out.getvalue())
+        self.assertIn('[!] reload: interface "wg1" failed: unit failed', out.getvalue())
+        with mock.patch.object(wireguard.CommandLine, "run_helper", return_value=[]):
+            self.assertEqual(cli.Iface._run_helper({}), (0, []))
+
+    def test_no_output(self):
+        with (
+            mock.patch.object(wireguard.defaults, "CONFIG_DIR", self.dir.name),
+            mock.patch.object(wireguard.CommandLine, "_run", return_value=""),
+        ):
+            with self.assertRaises(HelperException):
+                wireguard.CommandLine.run_helper({"services": []})
+        # the plan file is removed either way
+        self.assertFalse(os.path.exists(f"{self.dir.name}/helper_plan.json"))
@@ -0,0 +1,106 @@
+import tempfile
+from unittest import TestCase, mock
+
+from wgup import wireguard
+from wgup.importer import Importer
+from wgup.util import ImportException
+
+
+class TestImporter(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(
+            wireguard.CommandLine, "generate_public_key", return_value="pub"
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.iface = wireguard.Interface(
+            private_key="priv",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+            nat_iface="eth0",
+            nat_cidr4=["0.0.0.0/0"],
+            nat_cidr6=["::/0"],
+        )
+        for i in range(3):
+            name = f"peer{i}"
+            self.iface.peers[name] = wireguard.Peer(
+                name=name,
+                private_key=f"priv{i}",
+                public_key=f"pub{i}",
+                preshared_key=f"psk{i}",
+                cidr4=f"10.0.0.{i + 2}/32",
+                cidr6=f"fd00::{i + 2}/128",
+            )
+
+    def _import(self, conf: str, vpn_iface: str = "wg0"):
+        with tempfile.NamedTemporaryFile("w", suffix=".conf") as f:
+            f.write(conf)
+            f.flush()
+            iface, importer, _ = Importer.from_file(f.name, vpn_iface, "example.com")
+        return iface, importer
+
+    def test_round_trip(self):
+        iface, importer = self._import(self.iface.get_config(), "wg1")
+        self.assertEqual(importer.warnings, [])
+        self.assertEqual(iface.nat_iface, "eth0")
+        self.assertEqual(iface.nat_cidr4, ["0.0.0.0/0"])
+        self.assertEqual(iface.nat_cidr6, ["::/0"])
+        self.assertEqual(iface.port, 51820)
+        self.assertEqual(sorted(iface.peers), ["peer0", "peer1", "peer2"])
+        for name, peer in iface.peers.items():
+            orig = self.iface.peers[name]
+            self.assertEqual(peer.public_key, orig.public_key)
+            self.assertEqual(peer.preshared_key, orig.preshared_key)
+            self.assertEqual((peer.cidr4, peer.cidr6), (orig.cidr4, orig.cidr6))
+        self.assertEqual(
+            iface.get_config().replace("wg1", "wg0"), self.iface.get_config()
+        )
+
+    def test_round_trip_tuning(self):
+        self.iface.tuning = {
+            "mtu": 1420,
+            "fwmark": "0xca6c",
+            "table": "off",
+            "txqueuelen": 1000,
+            "offload": "on",
+            "rps": "ff,ffffffff",
+        }
+        self.iface.shaping = {"total": "1gbit", "classes": {"mobile": "30mbit"}}
+        self.iface.peers["peer0"].rate = "10mbit"
+        self.iface.peers["peer1"].peer_class = "mobile"
+        self.iface.peers["peer2"].peer_class = "mobile"
+        self.iface.peers["peer2"].rate = "5mbit"
+        iface, importer = self._import(self.iface.get_config())
+        self.assertEqual(
+            importer.warnings,
+            ["Dropped 1 shaping class limits (classes are unnamed)."],
+        )
+        self.assertEqual(iface.tuning, self.iface.tuning)
+        self.assertEqual(iface.shaping, {"total": "1gbit"})
+        self.assertEqual(
+            dict((n, p.rate) for n, p in iface.peers.items()),
+            {"peer0": "10mbit", "peer1": "", "peer2": "5mbit"},
+        )
+
+    def test_unnamed_peers(self):
+        conf = (
+            self.iface.get_config()
+            + "\n[Peer]\nPublicKey = x\nAllowedIPs = 10.0.0.9/32\n"
+        )
+        iface, _ = self._import(conf)
+        peer = iface.peers["peer3"]
+        self.assertEqual(peer.cidr4, "10.0.0.9/32")
+        # allocated from the addresses seen while parsing
+        self.assertEqual(peer.cidr6, "fd00::5/128")
+
+    def test_invalid(self):
+        with self.assertRaises(ImportException):
+            self._import("[Peer]\nPublicKey = x\n")
+        with self.assertRaises(ImportException):
+            self._import("PrivateKey = x\n")
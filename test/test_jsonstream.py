@@ -0,0 +1,77 @@
+import json
+import tempfile
+from unittest import TestCase, mock
+
+from wgup import defaults, jsonstream, wireguard
+from wgup.util import ConfigVersionException
+
+
+def _interface(name: str, peers: int):
+    iface = wireguard.Interface(
+        private_key="priv",
+        public_key="pub",
+        vpn_iface=name,
+        vpn_cidr4="10.0.0.0/24",
+        vpn_cidr6="fd00::/64",
+        addr4="10.0.0.1/24",
+        addr6="fd00::1/64",
+        host="example.com",
+        port=51820,
+        nat_cidr4=["0.0.0.0/0"],
+    )
+    for i in range(peers):
+        iface.peers[f"peer{i}"] = wireguard.Peer(
+            name=f"peer{i}",
+            private_key=f"priv{i}",
+            public_key=f"pub{i}",
+            preshared_key=f"psk{i}",
+            cidr4=f"10.0.0.{i + 2}/32",
+            cidr6=f"fd00::{i + 2}/128",
+        )
+    return iface
+
+
+class TestJsonStream(TestCase):
+    def setUp(self):
+        self.ifaces = [
+            _interface("wg0", 20),
+            _interface("wg1", 0),
+            _interface("wg2", 3),
+        ]
+        self.file = tempfile.NamedTemporaryFile("w", suffix=".json")
+        self.addCleanup(self.file.close)
+        self._write(defaults.CONFIG_VERSION)
+
+    def _write(self, version: int):
+        self.file.seek(0)
+        self.file.truncate()
+        self.file.write(
+            json.dumps(
+                {
+                    "version": version,
+                    "interfaces": list(i.to_json() for i in self.ifaces),
+                },
+                indent=4,
+            )
+        )
+        self.file.flush()
+
+    def test_matches_json(self):
+        # small chunks so that values straddle chunk boundaries
+        for chunk in (1, 7, 1 << 20):
+            with mock.patch.object(jsonstream, "_CHUNK", chunk):
+                loaded = list(jsonstream.iter_interfaces(self.file.name))
+            self.assertEqual(
+                list(i.to_json() for i in loaded),
+                list(i.to_json() for i in self.ifaces),
+            )
+
+    def test_only(self):
+        loaded = list(jsonstream.iter_interfaces(self.file.name, {"wg2"}))
+        self.assertEqual(list(i.vpn_iface for i in loaded), ["wg2"])
+        self.assertEqual(len(loaded[0].peers), 3)
+
+    def test_version(self):
+        self._write(defaults.CONFIG_VERSION + 1)
+        with self.assertRaises(ConfigVersionException):
+            list(jsonstream.iter_interfaces(self.file.name))
@@ -0,0 +1,127 @@
+from unittest import TestCase
+
+from wgup import wireguard
+from wgup.keepalive import NAT_KEEPALIVE, Keepalive
+from wgup.mesh import Mesh
+from wgup.util import ArgsException
+
+
+def _dump(endpoints: dict[str, str], handshake: int = 1700000000) -> str:
+    lines = ["privkey\tpubkey\t51820\toff"]
+    for public_key, endpoint in endpoints.items():
+        latest = 0 if endpoint == "(none)" else handshake
+        lines.append(
+            f"{public_key}\tpsk\t{endpoint}\t10.0.0.2/32\t{latest}\t100\t200\toff"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class TestKeepalive(TestCase):
+    def setUp(self):
+        self.iface = wireguard.Interface(
+            private_key="priv",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+        )
+        for i in range(4):
+            name = f"peer{i}"
+            self.iface.peers[name] = wireguard.Peer(
+                name=name,
+                private_key=f"priv{i}",
+                public_key=f"pub{i}",
+                preshared_key=f"psk{i}",
+                cidr4=f"10.0.0.{i + 2}/32",
+                cidr6=f"fd00::{i + 2}/128",
+            )
+        self.peers = self.iface.peers
+
+    def test_policy(self):
+        self.assertEqual(Keepalive.interval(self.iface, self.peers["peer0"]), 10)
+        self.iface.keepalive = {"default": "off", "mobile": "25"}
+        self.peers["peer1"].peer_class = "mobile"
+        self.peers["peer2"].peer_class = "unknown"
+        self.peers["peer3"].peer_class = "mobile"
+        self.peers["peer3"].keepalive = "15"
+        self.assertEqual(
+            list(Keepalive.interval(self.iface, p) for p in self.peers.values()),
+            [None, 25, None, 15],
+        )
+        self.assertEqual(
+            Keepalive.policy(self.iface, self.peers["peer1"]), ("25", "class mobile")
+        )
+        self.assertEqual(Keepalive.parse("020"), "20")
+        with self.assertRaises(ArgsException):
+            Keepalive.parse("0")
+
+    def test_auto(self):
+        self.iface.keepalive = {"default": "auto"}
+        peer0, peer1, peer2 = (self.peers[f"peer{i}"] for i in range(3))
+        # peer0 listens on the port of its endpoint and is not behind a NAT,
+        # peer2 is seen on another port than its own
+        peer0.endpoint = "198.51.100.1:51820"
+        peer2.endpoint = "192.0.2.7:51820"
+        # not observed yet
+        self.assertEqual(Keepalive.interval(self.iface, peer0), NAT_KEEPALIVE)
+        endpoints = {
+            "pub0": "198.51.100.1:51820",
+            "pub1": "203.0.113.9:40005",
+            "pub2": "192.0.2.7:40001",
+            "pub3": "(none)",
+        }
+        # the same handshake is only counted once
+        for _ in range(3):
+            Keepalive.observe(self.iface, _dump(endpoints))
+        self.assertEqual(peer0.observed["samples"], 1)
+        for minutes in (5, 10):
+            count = Keepalive.observe(
+                self.iface, _dump(endpoints, 1700000000 + minutes * 60)
+            )
+            self.assertEqual(count, 3)
+        # three handshakes, but within MIN_SPAN
+        self.assertEqual(peer0.observed["samples"], 3)
+        self.assertEqual(Keepalive.interval(self.iface, peer0), NAT_KEEPALIVE)
+        Keepalive.observe(self.iface, _dump(endpoints, 1700000000 + 20 * 60))
+        self.assertIsNone(Keepalive.interval(self.iface, peer0))
+        # a stable endpoint alone does not show that there is no NAT
+        self.assertEqual(Keepalive.interval(self.iface, peer1), NAT_KEEPALIVE)
+        self.assertEqual(Keepalive.interval(self.iface, peer2), NAT_KEEPALIVE)
+        # any change of endpoint is a NAT rebinding
+        Keepalive.observe(
+            self.iface,
+            _dump(
+                {"pub0": "198.51.100.2:51820", "pub1": "192.0.2.4:40005"}, 1700002000
+            ),
+        )
+        self.assertEqual(peer0.observed["rebinds"], 1)
+        self.assertEqual(peer1.observed["rebinds"], 1)
+        self.assertEqual(Keepalive.interval(self.iface, peer0), NAT_KEEPALIVE)
+        self.assertIsNone(self.peers["peer3"].observed)
+
+    def test_report(self):
+        self.iface.keepalive = {"default": "20"}
+        self.peers["peer0"].keepalive = "off"
+        self.peers["peer1"].keepalive = "5"
+        self.assertEqual(
+            Keepalive.report(self.iface),
+            [
+                ("interface", "20s", 2, 0.1),
+                ("peer", "5s", 1, 0.2),
+                ("peer", "off", 1, 0.0),
+            ],
+        )
+
+    def test_config(self):
+        mesh = Mesh(self.iface)
+        self.assertIn(
+            "PersistentKeepalive = 10  #", mesh.peer_config(self.peers["peer0"])
+        )
+        self.peers["peer0"].keepalive = "off"
+        self.assertNotIn("PersistentKeepalive", mesh.peer_config(self.peers["peer0"]))
+        peer = wireguard.Peer.from_json(self.peers["peer0"].to_json())
+        self.assertEqual(peer.keepalive, "off")
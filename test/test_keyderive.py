@@ -0,0 +1,189 @@
+import base64
+import json
+from unittest import TestCase, mock
+
+from wgup import wireguard
+from wgup.keyderive import KeyDerivation, hkdf, x25519
+from wgup.wireguard import Interface, Peer
+
+_BASE_POINT = (9).to_bytes(32, "little")
+
+
+def _interface(key_mode: str = "derived") -> Interface:
+    iface = Interface(
+        private_key="priv",
+        public_key="pub",
+        vpn_iface="wg0",
+        vpn_cidr4="10.0.0.0/24",
+        vpn_cidr6="fd00::/64",
+        addr4="10.0.0.1/24",
+        addr6="fd00::1/64",
+        host="example.com",
+        port=51820,
+    )
+    iface.set_key_mode(key_mode)
+    return iface
+
+
+class TestPrimitives(TestCase):
+    def test_x25519_rfc7748(self):
+        # RFC 7748, section 6.1
+        alice = bytes.fromhex(
+            "77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a"
+        )
+        bob = bytes.fromhex(
+            "5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb"
+        )
+        alice_public = x25519(alice, _BASE_POINT)
+        bob_public = x25519(bob, _BASE_POINT)
+        self.assertEqual(
+            alice_public.hex(),
+            "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a",
+        )
+        self.assertEqual(
+            bob_public.hex(),
+            "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f",
+        )
+        shared = "4a5d9d5ba4ce2de1728e3bf480350f25e07e21c947d19e3376f09b3c1e161742"
+        self.assertEqual(x25519(alice, bob_public).hex(), shared)
+        self.assertEqual(x25519(bob, alice_public).hex(), shared)
+
+    def test_hkdf_rfc5869(self):
+        # RFC 5869, test case 1
+        okm = hkdf(
+            bytes([0x0B] * 22),
+            bytes(range(0x0D)),
+            bytes(range(0xF0, 0xFA)),
+            42,
+        )
+        self.assertEqual(
+            okm.hex(),
+            "3cb25f25faacd57a90434f64d0362f2a2d2d0a90cf1a5a4c5db02d56ecc4c5bf"
+            "34007208d5b887185865",
+        )
+
+
+class TestKeyDerivation(TestCase):
+    def test_keys(self):
+        seed = KeyDerivation.new_seed()
+        private, preshared = KeyDerivation.keys(seed, "laptop", 0)
+        self.assertEqual(len(base64.b64decode(private)), 32)
+        self.assertEqual(len(base64.b64decode(preshared)), 32)
+        # clamped like `wg genkey` output
+        self.assertEqual(base64.b64decode(private)[0] & 7, 0)
+        self.assertEqual(KeyDerivation.keys(seed, "laptop", 0), (private, preshared))
+        self.assertNotEqual(KeyDerivation.keys(seed, "laptop", 1)[0], private)
+        self.assertNotEqual(KeyDerivation.keys(seed, "phone", 0)[0], private)
+        other = KeyDerivation.new_seed()
+        self.assertNotEqual(KeyDerivation.keys(other, "laptop", 0)[0], private)
+
+    def test_no_seed(self):
+        with self.assertRaises(ValueError):
+            KeyDerivation.keys("", "laptop", 0)
+
+
+class TestDerivedPeers(TestCase):
+    def test_create(self):
+        iface = _interface()
+        peers = iface.create_peers(
+            [("a", "10.0.0.2/32", "fd00::2/128"), ("b", "10.0.0.3/32", "fd00::3/128")]
+        )
+        self.assertEqual(list(p.key_epoch for p in peers), [0, 1])
+        self.assertEqual(iface.key_epoch, 2)
+        for peer in peers:
+            self.assertEqual(
+                peer.public_key, KeyDerivation.public_key(peer.private_key)
+            )
+
+    def test_rekey_is_an_epoch_bump(self):
+        iface = _interface()
+        peer = iface.create_peer("a", "10.0.0.2/32", "fd00::2/128")
+        old = peer.private_key, peer.public_key, peer.preshared_key
+        with mock.patch.object(wireguard.CommandLine, "generate_keys") as keygen:
+            iface.rekey_peer(peer)
+        keygen.assert_not_called()
+        self.assertEqual(peer.key_epoch, 1)
+        new = peer.private_key, peer.public_key, peer.preshared_key
+        self.assertTrue(all(o != n for o, n in zip(old, new)))
+
+    def test_rekey_interface_replaces_seed(self):
+        iface = _interface()
+        peer = iface.create_peer("a", "10.0.0.2/32", "fd00::2/128")
+        iface.peers["a"] = peer
+        seed = iface.key_seed
+
+        async def key_pair(_):
+            return "ipriv", "ipub"
+
+        with mock.patch.object(
+            wireguard.AsyncCommandLine, "generate_key_pair", key_pair
+        ):
+            iface.rekey()
+        self.assertNotEqual(iface.key_seed, seed)
+        self.assertEqual(peer.key_seed, iface.key_seed)
+        self.assertNotEqual(
+            KeyDerivation.keys(seed, "a", peer.key_epoch)[0], peer.private_key
+        )
+        self.assertEqual(peer.public_key, KeyDerivation.public_key(peer.private_key))
+
+    def test_recreated_peer_gets_new_keys(self):
+        iface = _interface()
+        peer = iface.create_peer("a", "10.0.0.2/32", "fd00::2/128")
+        iface.peers["a"] = peer
+        del iface.peers["a"]
+        again = iface.create_peer("a", "10.0.0.2/32", "fd00::2/128")
+        self.assertNotEqual(again.private_key, peer.private_key)
+
+    def test_json(self):
+        iface = _interface()
+        for i in range(10):
+            peer = iface.create_peer(
+                f"p{i}", f"10.0.0.{i + 2}/32", f"fd00::{i + 2}/128"
+            )
+            iface.peers[peer.name] = peer
+        data = iface.to_json()
+        self.assertNotIn("private_key", data["peers"][0])
+        self.assertNotIn("preshared_key", data["peers"][0])
+        loaded = Interface.from_json(json.loads(json.dumps(data)))
+        for name, peer in iface.peers.items():
+            self.assertEqual(loaded.peers[name].private_key, peer.private_key)
+            self.assertEqual(loaded.peers[name].preshared_key, peer.preshared_key)
+        self.assertEqual(loaded.key_epoch, iface.key_epoch)
+        stored = _interface("stored")
+        for peer in iface.peers.values():
+            stored.peers[peer.name] = Peer(
+                name=peer.name,
+                private_key=peer.private_key,
+                public_key=peer.public_key,
+                preshared_key=peer.preshared_key,
+                cidr4=peer.cidr4,
+                cidr6=peer.cidr6,
+                created=peer.created,
+            )
+        saved = len(json.dumps(stored.to_json())) - len(json.dumps(data))
+        self.assertGreater(saved / len(iface.peers), 100)
+
+    def test_switch_to_stored_keeps_keys(self):
+        iface = _interface()
+        peer = iface.create_peer("a", "10.0.0.2/32", "fd00::2/128")
+        iface.peers["a"] = peer
+        keys = peer.private_key, peer.preshared_key
+        iface.set_key_mode("stored")
+        self.assertIsNone(peer.key_epoch)
+        self.assertEqual((peer.private_key, peer.preshared_key), keys)
+        self.assertIn("private_key", peer.to_json())
+
+    def test_rekey_converts_stored_peer(self):
+        iface = _interface("stored")
+        peer = Peer(
+            name="a",
+            private_key="priv",
+            public_key="pub",
+            preshared_key="psk",
+            cidr4="10.0.0.2/32",
+            cidr6="fd00::2/128",
+        )
+        iface.set_key_mode("derived")
+        iface.rekey_peer(peer)
+        self.assertEqual(peer.key_epoch, 0)
+        self.assertNotEqual(peer.private_key, "priv")
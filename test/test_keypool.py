@@ -0,0 +1,52 @@
+import base64
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from unittest import TestCase, mock
+
+from wgup import keypool
+from wgup.keypool import KeyPool
+
+
+def _key():
+    return base64.b64encode(os.urandom(32)).decode("ascii")
+
+
+def _take(path: str):
+    with mock.patch.object(keypool, "_KEYPOOL_FILE", path):
+        return KeyPool.take()
+
+
+class TestKeyPool(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.path = f"{self.dir.name}/keypool"
+        patcher = mock.patch.object(keypool, "_KEYPOOL_FILE", self.path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.dir.cleanup)
+
+    def test_empty(self):
+        self.assertIsNone(KeyPool.take())
+        self.assertEqual(KeyPool.size(), 0)
+
+    def test_take_once(self):
+        keys = list((_key(), _key(), _key()) for _ in range(3))
+        KeyPool.put(keys)
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        self.assertEqual(KeyPool.size(), 3)
+        taken = list(KeyPool.take() for _ in range(4))
+        self.assertEqual(taken[:3], list(reversed(keys)))
+        self.assertIsNone(taken[3])
+
+    def test_take_concurrent(self):
+        KeyPool.put(list((_key(), _key(), _key()) for _ in range(50)))
+        with ProcessPoolExecutor(4) as pool:
+            taken = list(pool.map(_take, [self.path] * 60))
+        taken = list(t for t in taken if t is not None)
+        self.assertEqual(len(taken), 50)
+        self.assertEqual(len(set(taken)), 50)
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            KeyPool.put([("short", _key(), _key())])
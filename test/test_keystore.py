@@ -0,0 +1,174 @@
+import itertools
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock, skipUnless
+
+import wgup
+from wgup import config, keystore, wireguard
+from wgup.config import Config
+from wgup.group import Group
+from wgup.util import KeystoreException
+
+
+class TestKeystore(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.interfaces_file = f"{self.dir.name}/interfaces.json"
+        self.keystore_file = f"{self.dir.name}/{keystore.KEYSTORE_FILE}"
+        counter = itertools.count()
+
+        def generate_keys():
+            n = next(counter)
+            return f"priv{n}", f"pub{n}", f"psk{n}"
+
+        patchers = [
+            mock.patch.object(config, "_CONFIG_INTERFACES", self.interfaces_file),
+            mock.patch.object(Config, "_instance", None),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_private_key", return_value="ipriv"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_public_key", return_value="ipub"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_keys", side_effect=generate_keys
+            ),
+            mock.patch.dict(os.environ, {keystore.PASSPHRASE_ENV: ""}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with wgup.Session() as s:
+            s.create_interface("wg0", host="example.com", port=51820)
+            s.create_peer("wg0", "laptop")
+            s.create_peer("wg0", "phone")
+
+    def _reload(self) -> Config:
+        Config._instance = None
+        return Config()
+
+    def test_split(self):
+        with open(self.interfaces_file) as f:
+            data = json.load(f)
+        self.assertEqual(data["version"], 2)
+        iface = data["interfaces"][0]
+        self.assertNotIn("private_key", iface)
+        self.assertNotIn("private_key", iface["peers"][0])
+        self.assertNotIn("preshared_key", iface["peers"][0])
+        with open(self.keystore_file) as f:
+            keys = json.load(f)
+        self.assertEqual(
+            keys["interfaces"]["wg0"],
+            {
+                "private_key": "ipriv",
+                "peers": {"laptop": ["priv0", "psk0"], "phone": ["priv1", "psk1"]},
+            },
+        )
+        self.assertEqual(os.stat(self.keystore_file).st_mode & 0o777, 0o600)
+
+    def test_lazy(self):
+        c = self._reload()
+        peer = c.interfaces["wg0"].peers["phone"]
+        self.assertEqual(peer.public_key, "pub1")
+        self.assertFalse(c.keystore.loaded)
+        self.assertEqual(peer.private_key, "priv1")
+        self.assertTrue(c.keystore.loaded)
+        self.assertEqual(c.interfaces["wg0"].private_key, "ipriv")
+
+    def test_save_without_keys(self):
+        with mock.patch.object(keystore.Keystore, "_load") as load:
+            with wgup.Session(self._reload()) as s:
+                s.set_peer("wg0", "laptop", "rate", "10mbit")
+        load.assert_not_called()
+        with wgup.Session(self._reload()) as s:
+            s.create_peer("wg0", "tablet")
+            s.remove_peer("wg0", "phone")
+        with open(self.keystore_file) as f:
+            peers = json.load(f)["interfaces"]["wg0"]["peers"]
+        self.assertEqual(sorted(peers), ["laptop", "tablet"])
+
+    def test_remove(self):
+        def stored() -> dict:
+            with open(self.keystore_file) as f:
+                return json.load(f)["interfaces"]
+
+        self._reload()
+        with wgup.Session() as s:
+            s.create_interface("wg1", host="example.com", port=51821)
+        self._reload()
+        with wgup.Session() as s:
+            s.remove_peer("wg0", "laptop")
+        self.assertEqual(list(stored()["wg0"]["peers"]), ["phone"])
+        self._reload()
+        with wgup.Session() as s:
+            s.remove_interface("wg1")
+        self.assertEqual(list(stored()), ["wg0"])
+
+    def test_rebalance(self):
+        with wgup.Session() as s:
+            for m in Group.create(
+                group="vpn",
+                count=2,
+                port_base=51830,
+                cidr4="10.8.0.0/16",
+                cidr6="fd00:8::/64",
+                host="example.com",
+            ):
+                s.config.interfaces[m.vpn_iface] = m
+            s.create_peer("wg-vpn0", "aa")
+            s.create_peer("wg-vpn0", "bb")
+        c = self._reload()
+        moves = Group.rebalance(Group.members(c.interfaces, "vpn"))
+        c.save()
+        self.assertEqual(moves, [("bb", "wg-vpn0", "wg-vpn1")])
+        c = self._reload()
+        self.assertEqual(c.interfaces["wg-vpn1"].peers["bb"].private_key, "priv3")
+
+    def test_version_1(self):
+        c = self._reload()
+        data = {
+            "version": 1,
+            "interfaces": list(i.to_json() for i in c.interfaces.values()),
+        }
+        os.remove(self.keystore_file)
+        with open(self.interfaces_file, "w") as f:
+            json.dump(data, f)
+        c = self._reload()
+        self.assertEqual(c.interfaces["wg0"].peers["laptop"].private_key, "priv0")
+        c.save()
+        c = self._reload()
+        self.assertEqual(c.interfaces["wg0"].peers["laptop"].private_key, "priv0")
+        self.assertTrue(os.path.exists(self.keystore_file))
+
+    def test_derived(self):
+        with wgup.Session(self._reload()) as s:
+            s.set_interface("wg0", "key_mode", "derived")
+            s.create_peer("wg0", "tablet")
+            key = s.peer("wg0", "tablet").private_key
+        with open(self.interfaces_file) as f:
+            self.assertNotIn("key_seed", f.read())
+        c = self._reload()
+        self.assertEqual(c.interfaces["wg0"].key_mode, "derived")
+        self.assertFalse(c.keystore.loaded)
+        self.assertEqual(c.interfaces["wg0"].peers["tablet"].private_key, key)
+
+    @skipUnless(shutil.which("openssl"), "needs openssl")
+    def test_encrypted(self):
+        with mock.patch.dict(os.environ, {keystore.PASSPHRASE_ENV: "secret"}):
+            c = self._reload()
+            c.interfaces["wg0"].peers["laptop"].rekey()
+            c.save()
+            with open(self.keystore_file, "rb") as f:
+                self.assertTrue(f.read().startswith(b"Salted__"))
+            key = self._reload().interfaces["wg0"].peers["laptop"].private_key
+            self.assertEqual(key, "priv2")
+        c = self._reload()
+        self.assertEqual(c.interfaces["wg0"].peers["laptop"].public_key, "pub2")
+        with self.assertRaises(KeystoreException):
+            c.interfaces["wg0"].peers["laptop"].private_key
+        with mock.patch.dict(os.environ, {keystore.PASSPHRASE_ENV: "wrong"}):
+            with self.assertRaises(KeystoreException):
+                self._reload().interfaces["wg0"].private_key
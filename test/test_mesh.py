@@ -0,0 +1,90 @@
+from unittest import TestCase
+
+from wgup import wireguard
+from wgup.mesh import Mesh
+
+
+class TestMesh(TestCase):
+    def setUp(self):
+        self.iface = wireguard.Interface(
+            private_key="cHJpdg==",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+        )
+        for i in range(4):
+            name = f"peer{i}"
+            self.iface.peers[name] = wireguard.Peer(
+                name=name,
+                private_key=f"priv{i}",
+                public_key=f"pub{i}",
+                preshared_key=f"psk{i}",
+                cidr4=f"10.0.0.{i + 2}/32",
+                cidr6=f"fd00::{i + 2}/128",
+                mesh=i < 3,
+                endpoint=f"198.51.100.{i}:5182{i}" if i != 1 else "",
+            )
+        self.peers = self.iface.peers
+
+    def test_psk(self):
+        mesh = Mesh(self.iface)
+        psk = mesh.psk(self.peers["peer0"], self.peers["peer2"])
+        self.assertEqual(psk, mesh.psk(self.peers["peer2"], self.peers["peer0"]))
+        self.assertEqual(
+            psk, Mesh(self.iface).psk(self.peers["peer2"], self.peers["peer0"])
+        )
+        self.assertNotEqual(psk, mesh.psk(self.peers["peer0"], self.peers["peer1"]))
+        self.assertEqual(len(psk), 44)
+
+    def test_config(self):
+        mesh = Mesh(self.iface)
+        conf = mesh.peer_config(self.peers["peer0"])
+        self.assertIn("ListenPort = 51820\n", conf)
+        self.assertIn("Endpoint = example.com:51820\n", conf)
+        self.assertNotIn('Mesh peer "peer0"', conf)
+        self.assertNotIn('Mesh peer "peer3"', conf)
+        self.assertIn(
+            '# Mesh peer "peer2"\n[Peer]\nPublicKey = pub2\n'
+            f"PresharedKey = {mesh.psk(self.peers['peer0'], self.peers['peer2'])}\n"
+            "AllowedIPs = 10.0.0.4/32\nAllowedIPs = fd00::4/128\n"
+            "Endpoint = 198.51.100.2:51822\n",
+            conf,
+        )
+        # peers without an endpoint are reached once they connect
+        peer1 = conf[conf.index('Mesh peer "peer1"') :]
+        peer1 = peer1[: peer1.index("# Mesh peer")]
+        self.assertNotIn("Endpoint", peer1)
+        self.assertNotIn("PersistentKeepalive", peer1)
+        # peer1 has no endpoint, so it does not listen on a fixed port
+        self.assertNotIn("ListenPort", mesh.peer_config(self.peers["peer1"]))
+        # and keep the path to peers with an endpoint open
+        conf = mesh.peer_config(self.peers["peer1"])
+        peer0 = conf[conf.index('Mesh peer "peer0"') :]
+        self.assertIn("PersistentKeepalive = 25\n", peer0[: peer0.index("# Mesh peer")])
+        # peers outside the mesh only talk to the server
+        conf = mesh.peer_config(self.peers["peer3"])
+        self.assertEqual(conf.count("[Peer]"), 1)
+        self.assertNotIn("ListenPort", conf)
+
+    def test_unreachable(self):
+        self.peers["peer0"].endpoint = ""
+        self.peers["peer3"].mesh = True
+        self.peers["peer3"].endpoint = ""
+        mesh = Mesh(self.iface)
+        # two peers without an endpoint cannot reach each other directly
+        conf = mesh.peer_config(self.peers["peer1"])
+        self.assertNotIn('Mesh peer "peer0"', conf)
+        self.assertNotIn('Mesh peer "peer3"', conf)
+        self.assertIn('Mesh peer "peer2"', conf)
+        self.assertEqual(mesh.peer_config(self.peers["peer2"]).count("[Peer]"), 4)
+
+    def test_json(self):
+        peer = wireguard.Peer.from_json(self.peers["peer2"].to_json())
+        self.assertEqual((peer.mesh, peer.endpoint), (True, "198.51.100.2:51822"))
+        data = self.peers["peer3"].to_json()
+        self.assertNotIn("mesh", data)
@@ -0,0 +1,56 @@
+import io
+import json
+from unittest import TestCase
+
+from wgup.output import RowFilter, RowWriter
+from wgup.util import ArgsException
+
+_FIELDS = ("name", "cidr4", "cidr6")
+_ROWS = list(
+    {"name": f"peer{i}", "cidr4": f"10.0.0.{i}/32", "cidr6": f"fd00::{i:x}/128"}
+    for i in range(2, 20)
+)
+
+
+class TestRowFilter(TestCase):
+    def test_glob(self):
+        rows = list(RowFilter("peer1*", ("cidr4", "cidr6")).select(_ROWS))
+        self.assertEqual(
+            list(r["name"] for r in rows), [f"peer{i}" for i in range(10, 20)]
+        )
+
+    def test_cidr(self):
+        rows = list(RowFilter("10.0.0.4/30", ("cidr4", "cidr6")).select(_ROWS))
+        self.assertEqual(
+            list(r["name"] for r in rows), ["peer4", "peer5", "peer6", "peer7"]
+        )
+        rows = list(RowFilter("fd00::10/124", ("cidr4", "cidr6")).select(_ROWS))
+        self.assertEqual(len(rows), 4)
+
+    def test_paging(self):
+        rows = list(RowFilter(None, ()).select(_ROWS, offset=3, limit=2))
+        self.assertEqual(list(r["name"] for r in rows), ["peer5", "peer6"])
+        self.assertEqual(list(RowFilter(None, ()).select(_ROWS, limit=0)), [])
+        with self.assertRaises(ArgsException):
+            RowFilter(None, ()).select(_ROWS, offset=-1)
+
+
+class TestRowWriter(TestCase):
+    def write(self, fmt: str, rows: list) -> str:
+        out = io.StringIO()
+        writer = RowWriter(fmt, _FIELDS, "{name}:{cidr4}", out)
+        for row in rows:
+            writer.write(row)
+        writer.close()
+        return out.getvalue()
+
+    def test_formats(self):
+        self.assertEqual(json.loads(self.write("json", _ROWS)), _ROWS)
+        self.assertEqual(json.loads(self.write("json", [])), [])
+        lines = self.write("ndjson", _ROWS).splitlines()
+        self.assertEqual(list(json.loads(l) for l in lines), _ROWS)
+        csv = self.write("csv", _ROWS[:1])
+        self.assertEqual(csv, "name,cidr4,cidr6\npeer2,10.0.0.2/32,fd00::2/128\n")
+        self.assertEqual(
+            self.write("table", _ROWS[:2]), "peer2:10.0.0.2/32\npeer3:10.0.0.3/32\n"
+        )
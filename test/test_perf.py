@@ -0,0 +1,107 @@
+import contextlib
+import io
+import os
+import pstats
+import sys
+import tempfile
+from unittest import TestCase, mock
+
+from wgup import cli, perf
+from wgup.perf import Profile
+
+
+class TestProfile(TestCase):
+    def setUp(self):
+        self.addCleanup(self._stop)
+        patcher = mock.patch.dict(os.environ)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        os.environ.pop(perf._ENV_PROFILE, None)
+        os.environ.pop(perf._ENV_PROFILE_OUT, None)
+
+    def _stop(self):
+        with contextlib.redirect_stderr(io.StringIO()):
+            Profile.stop()
+
+    def _report(self) -> dict[str, str]:
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            Profile.stop()
+        lines = err.getvalue().splitlines()
+        self.assertEqual(lines[0], "[i] Profile:")
+        return dict(
+            (name.strip(), value.strip())
+            for name, value in (
+                line.split(" : ") for line in lines[1:] if " : " in line
+            )
+        )
+
+    def test_requested(self):
+        self.assertEqual(Profile.requested(), (False, None))
+        self.assertEqual(Profile.requested(True), (True, None))
+        self.assertEqual(Profile.requested(False, "out.prof"), (True, "out.prof"))
+        os.environ[perf._ENV_PROFILE] = "no"
+        self.assertEqual(Profile.requested(), (False, None))
+        os.environ[perf._ENV_PROFILE] = "1"
+        self.assertEqual(Profile.requested(), (True, None))
+        os.environ[perf._ENV_PROFILE_OUT] = "env.prof"
+        self.assertEqual(Profile.requested(), (True, "env.prof"))
+        self.assertEqual(Profile.requested(False, "out.prof"), (True, "out.prof"))
+
+    def test_disabled(self):
+        with Profile.phase("render"):
+            pass
+        Profile.record_command(["wg", "genkey"], 1.0)
+        self.assertEqual(Profile.phases, {})
+        self.assertEqual(Profile.commands, [])
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            Profile.stop()
+        self.assertEqual(err.getvalue(), "")
+
+    def test_phases(self):
+        clock = iter([0.0, 1.0, 1.25, 2.0, 2.5, 3.0])
+        with mock.patch.object(perf.time, "perf_counter", lambda: next(clock)):
+            Profile.start()
+            with Profile.phase("render"):
+                pass
+            with Profile.phase("render"):
+                pass
+            Profile.record_command(["sudo", "wg", "show", "wg0", "dump"], 0.002)
+            Profile.record_command(["wg", "genkey"], 0.001)
+            Profile.record_command(["wg", "genkey"], 0.003)
+            report = self._report()
+        self.assertEqual(report["render"], "750.000 ms        2x")
+        self.assertEqual(report["subprocesses"], "6.000 ms        3x")
+        self.assertEqual(report["sudo wg show"], "2.000 ms        1x")
+        self.assertEqual(report["wg genkey"], "4.000 ms        2x")
+        self.assertEqual(report["total"], "3000.000 ms        1x")
+        self.assertFalse(Profile.enabled)
+
+    def test_peak_memory(self):
+        Profile.start()
+        block = bytearray(4 << 20)
+        del block
+        peak = float(self._report()["peak memory"].split()[0])
+        self.assertGreaterEqual(peak, 4 << 10)
+
+    def test_profile_out(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = f"{tmp}/wgup.prof"
+            Profile.start(out)
+            sorted(range(1000))
+            err = io.StringIO()
+            with contextlib.redirect_stderr(err):
+                Profile.stop()
+            self.assertIn(f'[i] Wrote profile to "{out}"', err.getvalue())
+            self.assertTrue(pstats.Stats(out).total_calls)
+
+    def test_cli(self):
+        out, err = io.StringIO(), io.StringIO()
+        with mock.patch.object(sys, "argv", ["wgup", "--profile", "version"]):
+            with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+                self.assertEqual(cli.entrypoint(), 0)
+        self.assertTrue(out.getvalue())
+        self.assertIn("[i] Profile:", err.getvalue())
+        self.assertIn("peak memory", err.getvalue())
+        self.assertFalse(Profile.enabled)
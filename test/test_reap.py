@@ -0,0 +1,114 @@
+from unittest import TestCase
+
+from wgup import wireguard
+from wgup.mesh import Mesh
+from wgup.reap import Reaper
+from wgup.util import ArgsException
+
+NOW = 1_700_000_000
+DAY = 86400
+
+
+def _dump(handshakes: dict[str, int]) -> str:
+    lines = ["privkey\tpubkey\t51820\toff"]
+    for public_key, handshake in handshakes.items():
+        endpoint = "1.2.3.4:5000" if handshake else "(none)"
+        lines.append(
+            f"{public_key}\tpsk\t{endpoint}\t10.0.0.2/32\t{handshake}\t100\t200\toff"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class TestReaper(TestCase):
+    def setUp(self):
+        self.iface = wireguard.Interface(
+            private_key="priv",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+        )
+        for i in range(5):
+            name = f"peer{i}"
+            self.iface.peers[name] = wireguard.Peer(
+                name=name,
+                private_key=f"priv{i}",
+                public_key=f"pub{i}",
+                preshared_key=f"psk{i}",
+                cidr4=f"10.0.0.{i + 2}/32",
+                cidr6=f"fd00::{i + 2}/128",
+                created=NOW - 90 * DAY,
+            )
+        self.peers = self.iface.peers
+        # created before creation times were recorded
+        self.peers["peer4"].created = 0
+
+    def test_parse_idle(self):
+        self.assertEqual(Reaper.parse_idle("30d"), 30 * DAY)
+        self.assertEqual(Reaper.parse_idle("90m"), 5400)
+        self.assertEqual(Reaper.parse_idle("3600"), 3600)
+        for value in ("", "0d", "30x", "-1d", "1.5h"):
+            with self.assertRaises(ArgsException):
+                Reaper.parse_idle(value)
+        self.assertEqual(Reaper.age(45 * DAY), "6w")
+        self.assertEqual(Reaper.age(3 * 3600 + 5), "3h")
+
+    def test_stale(self):
+        dump = _dump({"pub0": NOW - 3600, "pub1": NOW - 40 * DAY, "pub2": 0})
+        self.assertEqual(Reaper.record(self.iface, dump, NOW), 2)
+        self.assertEqual(self.peers["peer0"].last_seen, NOW - 3600)
+        # not seen and no creation time: counted from the first check
+        self.assertEqual(self.peers["peer4"].last_seen, NOW)
+        stale = Reaper.stale(self.iface, 30 * DAY, NOW)
+        self.assertEqual(list(p.name for p in stale), ["peer1", "peer2", "peer3"])
+        # an older dump does not move last_seen back
+        Reaper.record(self.iface, _dump({"pub0": NOW - 7200}), NOW)
+        self.assertEqual(self.peers["peer0"].last_seen, NOW - 3600)
+        self.peers["peer1"].enabled = False
+        stale = Reaper.stale(self.iface, 30 * DAY, NOW)
+        self.assertEqual(list(p.name for p in stale), ["peer2", "peer3"])
+        self.assertEqual(
+            list(p.name for p in Reaper.stale(self.iface, 30 * DAY, NOW + 60 * DAY)),
+            ["peer0", "peer2", "peer3", "peer4"],
+        )
+
+    def test_disabled(self):
+        self.peers["peer1"].mesh = True
+        self.peers["peer2"].mesh = True
+        routes, size = Reaper.savings(self.iface, [self.peers["peer1"]])
+        self.assertEqual(routes, 2)
+        before = len(self.iface.get_config().encode("utf-8"))
+        self.peers["peer1"].enabled = False
+        config = self.iface.get_config()
+        self.assertEqual(len(config.encode("utf-8")), before - size)
+        self.assertIn('"peer2"', config)
+        self.peers["peer1"].rate = "10mbit"
+        self.assertNotIn("tc", self.iface.get_config())
+        self.assertEqual(list(p.name for p in Mesh(self.iface).members), ["peer2"])
+        data = self.peers["peer1"].to_json()
+        self.assertFalse(data["enabled"])
+        peer = wireguard.Peer.from_json(data)
+        self.assertFalse(peer.enabled)
+        self.assertEqual(peer.created, NOW - 90 * DAY)
+        self.assertNotIn("enabled", self.peers["peer2"].to_json())
+
+    def test_savings_without_keys(self):
+        # keys that are still in the keystore are not read
+        peer = wireguard.Peer(
+            name="peer0",
+            private_key=None,
+            public_key="pub0",
+            preshared_key=None,
+            cidr4="10.0.0.2/32",
+            cidr6="fd00::2/128",
+        )
+        self.peers["peer0"].preshared_key = "x" * 44
+        routes, size = Reaper.savings(self.iface, [peer])
+        self.assertEqual(routes, 2)
+        self.assertEqual(
+            size, len(self.iface.peer_entry(self.peers["peer0"]).encode("utf-8"))
+        )
@@ -0,0 +1,159 @@
+import itertools
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import wgup
+from wgup import config, keystore, wireguard
+from wgup.config import Config
+from wgup.keyderive import KeyDerivation
+from wgup.rollout import Rollout
+
+
+class TestRollout(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.counter = itertools.count()
+
+        async def generate_keys(_):
+            return self._keys()
+
+        patchers = [
+            mock.patch.object(
+                config, "_CONFIG_INTERFACES", f"{self.dir.name}/interfaces.json"
+            ),
+            mock.patch.object(Config, "_instance", None),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_private_key", return_value="ipriv"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_public_key", return_value="ipub"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_keys", side_effect=self._keys
+            ),
+            mock.patch.object(
+                wireguard.AsyncCommandLine, "generate_keys", generate_keys
+            ),
+            mock.patch.dict(os.environ, {keystore.PASSPHRASE_ENV: ""}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with wgup.Session() as s:
+            s.create_interface(
+                "wg0", host="example.com", port=51820, cidr4="10.0.0.0/24"
+            )
+            for i in range(5):
+                s.create_peer("wg0", f"peer{i}")
+        self.keys = self._private_keys()
+        self.session = wgup.Session()
+
+    def _keys(self):
+        n = next(self.counter)
+        return f"priv{n}", f"pub{n}", f"psk{n}"
+
+    def _private_keys(self) -> dict[str, str]:
+        iface = Config.fresh().interfaces["wg0"]
+        return dict((n, p.private_key) for n, p in iface.peers.items())
+
+    def _rekeyed(self) -> list[str]:
+        return list(
+            n
+            for n, key in sorted(self._private_keys().items())
+            if n in self.keys and key != self.keys[n]
+        )
+
+    def _start(self, batch_size: int = 2, concurrency: int = 1):
+        with self.session as s:
+            Rollout.start(s.interface("wg0"), batch_size, concurrency, 0)
+            s.dirty = True
+
+    def test_batches(self):
+        saves: list[list[str]] = []
+        self._start(concurrency=2)
+        Rollout.run(
+            self.session,
+            "wg0",
+            lambda: saves.append(self._rekeyed()),
+            sleep=lambda _: None,
+        )
+        self.assertEqual(list(len(s) for s in saves), [2, 4, 5])
+        self.assertIsNone(Config.fresh().interfaces["wg0"].rollout)
+
+    def test_resume(self):
+        self._start()
+
+        def interrupt():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            Rollout.run(self.session, "wg0", interrupt)
+        self.assertEqual(len(self._rekeyed()), 2)
+        state = Config.fresh().interfaces["wg0"].rollout
+        self.assertEqual(state["pending"], ["peer2", "peer3", "peer4"])
+        applied: list[int] = []
+        Rollout.run(
+            wgup.Session(),
+            "wg0",
+            lambda: applied.append(len(self._rekeyed())),
+            sleep=lambda _: None,
+        )
+        self.assertEqual(applied, [2, 4, 5])
+        self.assertIsNone(Config.fresh().interfaces["wg0"].rollout)
+
+    def test_changed_between_batches(self):
+        self._start()
+
+        def change(_):
+            # another process edits the config while the rollout sleeps
+            with wgup.Session() as s:
+                if "newpeer" not in s.interfaces["wg0"].peers:
+                    s.create_peer("wg0", "newpeer")
+                else:
+                    s.remove_peer("wg0", "peer4")
+
+        Rollout.run(self.session, "wg0", sleep=change)
+        iface = Config.fresh().interfaces["wg0"]
+        self.assertIn("newpeer", iface.peers)
+        self.assertNotIn("peer4", iface.peers)
+        self.assertIsNone(iface.rollout)
+        self.assertEqual(self._rekeyed(), ["peer0", "peer1", "peer2", "peer3"])
+
+    def test_cancelled(self):
+        self._start()
+
+        def cancel(_):
+            with wgup.Session() as s:
+                s.interface("wg0").rollout = None
+                s.dirty = True
+
+        Rollout.run(self.session, "wg0", sleep=cancel)
+        self.assertEqual(self._rekeyed(), ["peer0", "peer1"])
+
+    def test_derived_new_seed(self):
+        with self.session as s:
+            s.set_interface("wg0", "key_mode", "derived")
+            for name in s.interfaces["wg0"].peers:
+                s.rekey_peer("wg0", name)
+            seed = s.interfaces["wg0"].key_seed
+        self.keys = self._private_keys()
+        self._start()
+        self.assertNotEqual(self.session.interfaces["wg0"].key_seed, seed)
+
+        def interrupt():
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            Rollout.run(self.session, "wg0", interrupt)
+        # pending peers keep their old keys, stored
+        self.assertEqual(self._rekeyed(), ["peer0", "peer1"])
+        Rollout.run(self.session, "wg0", sleep=lambda _: None)
+        self.assertEqual(len(self._rekeyed()), 5)
+        iface = Config.fresh().interfaces["wg0"]
+        for name, peer in iface.peers.items():
+            self.assertEqual(peer.key_seed, iface.key_seed)
+            self.assertNotEqual(
+                KeyDerivation.keys(seed, name, peer.key_epoch)[0], peer.private_key
+            )
@@ -0,0 +1,197 @@
+import fcntl
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import wgup
+from wgup import config, wireguard
+from wgup.config import Config
+from wgup.group import Group
+from wgup.util import (
+    ArgsException,
+    InterfaceExistsException,
+    InterfaceNotFoundException,
+    PeerExistsException,
+    PeerNotFoundException,
+)
+
+
+async def _generate_keys(self):
+    return "priv", "pub", "psk"
+
+
+class TestSession(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        patchers = [
+            mock.patch.object(
+                config, "_CONFIG_INTERFACES", f"{self.dir.name}/interfaces.json"
+            ),
+            mock.patch.object(Config, "_instance", None),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_private_key", return_value="priv"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_public_key", return_value="pub"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine,
+                "generate_keys",
+                return_value=("priv", "pub", "psk"),
+            ),
+            mock.patch.object(
+                wireguard.AsyncCommandLine, "generate_keys", _generate_keys
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _reload(self) -> Config:
+        Config._instance = None
+        return Config()
+
+    def test_commit_saves_once(self):
+        with mock.patch.object(Config, "save", autospec=True) as save:
+            with wgup.Session() as s:
+                s.create_interface(
+                    "wg0", host="example.com", port=51820, cidr4="10.0.0.0/24"
+                )
+                s.create_peer("wg0", "laptop")
+                s.create_peers("wg0", ["phone0", "phone1"])
+                s.set_peer("wg0", "laptop", "rate", "10mbit")
+            self.assertEqual(save.call_count, 1)
+
+    def test_commit(self):
+        with wgup.Session() as s:
+            s.create_interface(
+                "wg0", host="example.com", port=51820, cidr4="10.0.0.0/24"
+            )
+            peer = s.create_peer("wg0", "laptop")
+            self.assertEqual(peer.cidr4, "10.0.0.2/32")
+            s.create_peers("wg0", ["phone0", "phone1"])
+            s.set_interface("wg0", "mtu", "1380")
+        c = self._reload()
+        self.assertEqual(
+            sorted(c.interfaces["wg0"].peers), ["laptop", "phone0", "phone1"]
+        )
+        self.assertEqual(c.interfaces["wg0"].peers["phone1"].cidr4, "10.0.0.4/32")
+        self.assertEqual(c.interfaces["wg0"].tuning, {"mtu": 1380})
+
+    def test_rollback(self):
+        with wgup.Session() as s:
+            s.create_interface("wg0", host="example.com", port=51820)
+        with self.assertRaises(PeerExistsException):
+            with wgup.Session() as s:
+                s.create_peer("wg0", "laptop")
+                s.create_peer("wg0", "laptop")
+        # the first peer was discarded along with the failed one
+        self.assertEqual(Config().interfaces["wg0"].peers, {})
+        self.assertEqual(self._reload().interfaces["wg0"].peers, {})
+
+    def test_errors(self):
+        with wgup.Session() as s:
+            s.create_interface("wg0", host="example.com", port=51820)
+            with self.assertRaises(InterfaceExistsException):
+                s.create_interface("wg0", host="example.com", port=51821)
+            with self.assertRaises(ArgsException):
+                s.create_interface("wg1", host="example.com", port=0)
+            with self.assertRaises(InterfaceNotFoundException):
+                s.create_peer("wg1", "laptop")
+            with self.assertRaises(ArgsException) as cm:
+                s.create_peer("wg0", "laptop", cidr4="10.0.0.300/32")
+            self.assertTrue(str(cm.exception).startswith("[!] IPv4 CIDR block"))
+            with self.assertRaises(PeerNotFoundException):
+                s.set_peer("wg0", "laptop", "mesh", "on")
+            s.create_peer("wg0", "laptop")
+            with self.assertRaises(ArgsException):
+                s.set_peer("wg0", "laptop", "colour", "blue")
+            with self.assertRaises(ArgsException):
+                s.remove_nat("wg0", cidr4="192.168.0.0/24")
+
+    def test_derived_keys(self):
+        with wgup.Session() as s:
+            s.create_interface(
+                "wg0", host="example.com", port=51820, key_mode="derived"
+            )
+            private_key = s.create_peer("wg0", "laptop").private_key
+            with self.assertRaises(ArgsException):
+                s.set_interface("wg0", "key_mode", "random")
+        peer = self._reload().interfaces["wg0"].peers["laptop"]
+        self.assertEqual(peer.private_key, private_key)
+        with wgup.Session() as s:
+            s.rekey_peer("wg0", "laptop")
+            self.assertNotEqual(s.peer("wg0", "laptop").private_key, private_key)
+            s.set_interface("wg0", "key_mode", "stored")
+        peer = self._reload().interfaces["wg0"].peers["laptop"]
+        self.assertIsNone(peer.key_epoch)
+        self.assertNotEqual(peer.private_key, private_key)
+
+    def test_group(self):
+        with wgup.Session() as s:
+            for member in Group.create(
+                group="vpn",
+                count=2,
+                port_base=51820,
+                cidr4="10.8.0.0/16",
+                cidr6="fd00:8::/64",
+                host="example.com",
+            ):
+                s.interfaces[member.vpn_iface] = member
+            s.dirty = True
+            placed = s.create_peers_in_group("vpn", ["a0", "a1", "a2", "a3"])
+        self.assertEqual(
+            dict((k, len(v)) for k, v in placed.items()), {"wg-vpn0": 2, "wg-vpn1": 2}
+        )
+        c = self._reload()
+        self.assertEqual(sum(len(i.peers) for i in c.interfaces.values()), 4)
+        # peer names are unique across the group's members
+        with wgup.Session() as s:
+            with self.assertRaises(PeerExistsException):
+                s.create_peer("wg-vpn1", placed["wg-vpn0"][0].name)
+            with self.assertRaises(PeerExistsException):
+                s.create_peers("wg-vpn0", ["b0", placed["wg-vpn1"][0].name])
+
+    def test_long_lived(self):
+        service = wgup.Session()
+        with service:
+            service.create_interface("wg0", host="example.com", port=51820)
+        # changed elsewhere in the meantime
+        with wgup.Session() as s:
+            s.create_peer("wg0", "laptop")
+        with service:
+            self.assertIn("laptop", service.interfaces["wg0"].peers)
+            service.create_peer("wg0", "phone")
+        self.assertEqual(
+            sorted(self._reload().interfaces["wg0"].peers), ["laptop", "phone"]
+        )
+        # a rollback only discards the changes of its own session
+        other = wgup.Session()
+        with self.assertRaises(PeerExistsException):
+            with service:
+                service.create_peer("wg0", "tablet")
+                service.create_peer("wg0", "tablet")
+        self.assertIsNot(other.config, service.config)
+        self.assertEqual(sorted(other.interfaces["wg0"].peers), ["laptop", "phone"])
+
+    def test_lock(self):
+        lock_file = os.path.join(self.dir.name, config.LOCK_FILE)
+
+        def locked() -> bool:
+            with open(lock_file, "rb") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return True
+                return False
+
+        s = wgup.Session()
+        with s:
+            self.assertTrue(locked())
+            s.create_interface("wg0", host="example.com", port=51820)
+        self.assertFalse(locked())
+        s.begin()
+        self.assertTrue(locked())
+        s.rollback()
+        self.assertFalse(locked())
@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase, skipIf
+
+from wgup import wireguard
+from wgup.shaping import BATCH_PREFIX, Shaping
+from wgup.util import ArgsException
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+
+
+def _golden(name: str) -> str:
+    with open(os.path.join(GOLDEN_DIR, name), "r") as f:
+        return f.read()
+
+
+class TestShaping(TestCase):
+    def setUp(self):
+        self.iface = wireguard.Interface(
+            private_key="priv",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+        )
+        for i in range(5):
+            name = f"peer{i}"
+            self.iface.peers[name] = wireguard.Peer(
+                name=name,
+                private_key=f"priv{i}",
+                public_key=f"pub{i}",
+                preshared_key=f"psk{i}",
+                cidr4=f"10.0.0.{i + 2}/32",
+                cidr6=f"fd00::{i + 2}/128",
+            )
+
+    def _batch(self) -> str:
+        return Shaping.batch(
+            self.iface.vpn_iface,
+            self.iface.vpn_cidr4,
+            self.iface.shaping,
+            self.iface.peers.values(),
+        )
+
+    def test_parse_rate(self):
+        self.assertEqual(Shaping.parse_rate("20Mbit"), "20mbit")
+        self.assertEqual(Shaping.bits("1.5mbit"), 1500000)
+        for value in ("", "10", "0mbit", "10mbps", "fast"):
+            with self.assertRaises(ArgsException, msg=value):
+                Shaping.parse_rate(value)
+
+    def test_unshaped(self):
+        self.iface.shaping = {"total": "1gbit", "classes": {"mobile": "100mbit"}}
+        self.assertEqual(self._batch(), "")
+        self.assertNotIn("tc -batch", self.iface.get_config())
+
+    def test_peer_rates(self):
+        self.iface.peers["peer0"].rate = "10mbit"
+        self.iface.peers["peer3"].rate = "2mbit"
+        self.assertEqual(self._batch(), _golden("shaping_peers.tc"))
+
+    def test_classes(self):
+        self.iface.shaping = {
+            "total": "1gbit",
+            "classes": {"mobile": "30mbit", "office": "200mbit"},
+        }
+        for name in ("peer0", "peer1", "peer4"):
+            self.iface.peers[name].peer_class = "mobile"
+        # limited below its share of the class
+        self.iface.peers["peer4"].rate = "5mbit"
+        # not limited, since its class has no rate
+        self.iface.peers["peer2"].peer_class = "guest"
+        # outside the pool, so it cannot be hashed
+        self.iface.peers["peer3"].cidr4 = "192.168.5.0/24"
+        self.iface.peers["peer3"].rate = "50mbit"
+        self.assertEqual(self._batch(), _golden("shaping_classes.tc"))
+
+    def test_config(self):
+        self.iface.peers["peer0"].rate = "10mbit"
+        self.iface.peers["peer3"].rate = "2mbit"
+        config = self.iface.get_config()
+        self.assertIn("PostUp = sed -n 's/^\\x23tc //p' /etc/wireguard/%i.conf", config)
+        self.assertIn("PreDown = tc qdisc del dev %i root", config)
+        # what the PostUp step extracts is the batch
+        batch = "".join(
+            f"{line[len(BATCH_PREFIX):]}\n"
+            for line in config.splitlines()
+            if line.startswith(BATCH_PREFIX)
+        )
+        self.assertEqual(batch, _golden("shaping_peers.tc"))
+
+    def _post_up(self, config: str) -> list[str]:
+        # what wg-quick runs: every line is cut at the first "#"
+        commands: list[str] = []
+        for line in config.splitlines():
+            key, _, value = line.split("#", 1)[0].partition("=")
+            if key.strip() == "PostUp":
+                commands.append(value.strip())
+        return commands
+
+    def test_config_wg_quick(self):
+        self.iface.peers["peer0"].rate = "10mbit"
+        config = self.iface.get_config()
+        commands = list(c for c in self._post_up(config) if "tc -batch" in c)
+        self.assertEqual(
+            commands,
+            ["sed -n 's/^\\x23tc //p' /etc/wireguard/%i.conf | tc -batch -"],
+        )
+
+    @skipIf(shutil.which("sed") is None, "needs sed")
+    def test_config_extract(self):
+        self.iface.peers["peer0"].rate = "10mbit"
+        self.iface.peers["peer3"].rate = "2mbit"
+        config = self.iface.get_config()
+        (command,) = (c for c in self._post_up(config) if "tc -batch" in c)
+        with tempfile.TemporaryDirectory() as d:
+            with open(f"{d}/wg0.conf", "w") as f:
+                f.write(config)
+            command = command.replace("/etc/wireguard/%i.conf", f"{d}/wg0.conf")
+            command = command.replace("| tc -batch -", "")
+            batch = subprocess.run(
+                command, shell=True, check=True, capture_output=True, text=True
+            ).stdout
+        self.assertEqual(batch, _golden("shaping_peers.tc"))
+
+    def test_json(self):
+        self.iface.peers["peer0"].rate = "10mbit"
+        self.iface.shaping = {"total": "1gbit"}
+        iface = wireguard.Interface.from_json(self.iface.to_json())
+        self.assertEqual(iface.peers["peer0"].rate, "10mbit")
+        self.assertEqual(iface.shaping, {"total": "1gbit"})
+        self.assertNotIn("rate", self.iface.peers["peer1"].to_json())
@@ -0,0 +1,123 @@
+import itertools
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import wgup
+from wgup import config, keystore, snapshot, wireguard
+from wgup.config import Config
+from wgup.snapshot import Snapshot
+
+
+class TestSnapshot(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.interfaces_file = f"{self.dir.name}/interfaces.json"
+        self.snapshot_file = f"{self.dir.name}/{snapshot.SNAPSHOT_FILE}"
+        counter = itertools.count()
+
+        def generate_keys():
+            n = next(counter)
+            return f"priv{n}", f"pub{n}", f"psk{n}"
+
+        patchers = [
+            mock.patch.object(config, "_CONFIG_INTERFACES", self.interfaces_file),
+            mock.patch.object(Config, "_instance", None),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_private_key", return_value="ipriv"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_public_key", return_value="ipub"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_keys", side_effect=generate_keys
+            ),
+            mock.patch.object(snapshot, "_CHUNK", 3),
+            mock.patch.dict(os.environ, {keystore.PASSPHRASE_ENV: ""}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with wgup.Session() as s:
+            s.create_interface("wg0", host="example.com", port=51820)
+            s.create_peer("wg0", "laptop")
+            s.create_peer("wg0", "phone")
+            s.set_peer("wg0", "phone", "mesh", "on")
+            s.set_peer("wg0", "phone", "enabled", "off")
+            s.create_interface(
+                "wg1", host="example.com", port=51821, key_mode="derived"
+            )
+            for i in range(7):
+                s.create_peer("wg1", f"peer{i}")
+            s.set_peer("wg1", "peer3", "rate", "10mbit")
+        with open(self.interfaces_file) as f:
+            self.expected = json.load(f)["interfaces"]
+
+    def _reload(self, *names: str) -> Config:
+        Config._instance = None
+        return Config.readonly(*names) if names else Config()
+
+    def _assert_loaded(self, c: Config):
+        self.assertEqual(
+            list(i[1].to_json(secrets=False) for i in sorted(c.interfaces.items())),
+            self.expected,
+        )
+
+    def test_load(self):
+        self.assertTrue(os.path.exists(self.snapshot_file))
+        with mock.patch.object(Config, "_load") as load:
+            c = self._reload()
+        load.assert_not_called()
+        self._assert_loaded(c)
+        self.assertFalse(c.keystore.loaded)
+        self.assertEqual(c.interfaces["wg0"].peers["laptop"].private_key, "priv0")
+        with mock.patch.object(Snapshot, "load", return_value=None):
+            from_json = self._reload()
+        self.assertEqual(
+            c.interfaces["wg1"].peers["peer5"].private_key,
+            from_json.interfaces["wg1"].peers["peer5"].private_key,
+        )
+        c = self._reload("wg1")
+        self.assertEqual(list(c.interfaces), ["wg1"])
+
+    def test_stale(self):
+        st = os.stat(self.interfaces_file)
+        with open(self.interfaces_file) as f:
+            data = f.read()
+        # same size and mtime, different content
+        with open(self.interfaces_file, "w") as f:
+            f.write(data.replace('"laptop"', '"laptoq"'))
+        os.utime(self.interfaces_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        c = self._reload()
+        self.assertIn("laptoq", c.interfaces["wg0"].peers)
+        key = Snapshot.key(self.interfaces_file)
+        with open(self.snapshot_file, "rb") as f:
+            header = snapshot._HEADER.unpack(f.read(snapshot._HEADER.size))
+        self.assertEqual(header[3:6], key)
+        with mock.patch.object(Config, "_load") as load:
+            c = self._reload()
+        load.assert_not_called()
+        self.assertIn("laptoq", c.interfaces["wg0"].peers)
+
+    def test_rebuild_incremental(self):
+        os.remove(self.snapshot_file)
+        with mock.patch.object(config, "INCREMENTAL_LOAD_SIZE", 0):
+            self._reload("wg0")
+        with mock.patch.object(Config, "_load_incremental") as load:
+            c = self._reload()
+        load.assert_not_called()
+        self._assert_loaded(c)
+
+    def test_damaged(self):
+        with open(self.snapshot_file, "r+b") as f:
+            f.seek(snapshot._HEADER.size)
+            f.write(b"\xff" * 16)
+        self._assert_loaded(self._reload())
+        with open(self.snapshot_file, "wb") as f:
+            f.write(b"WGUP")
+        self._assert_loaded(self._reload())
+        with mock.patch.object(Config, "_load") as load:
+            self._assert_loaded(self._reload())
+        load.assert_not_called()
@@ -0,0 +1,158 @@
+import contextlib
+import io
+import os
+import subprocess
+import tempfile
+from unittest import TestCase, mock
+
+import wgup
+from wgup import cli, config, defaults, keystore, wireguard
+from wgup.config import Config, SyncState
+from wgup.util import HelperException
+
+
+async def _generate_keys(self):
+    return "priv", "pub", "psk"
+
+
+class TestSync(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        patchers = [
+            mock.patch.object(defaults, "CONFIG_DIR", self.dir.name),
+            mock.patch.object(
+                config, "_CONFIG_INTERFACES", f"{self.dir.name}/interfaces.json"
+            ),
+            mock.patch.object(
+                config, "_CONFIG_SYNC_STATE", f"{self.dir.name}/sync_state.json"
+            ),
+            mock.patch.object(Config, "_instance", None),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_private_key", return_value="ipriv"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine, "generate_public_key", return_value="ipub"
+            ),
+            mock.patch.object(
+                wireguard.CommandLine,
+                "generate_keys",
+                return_value=("priv", "pub", "psk"),
+            ),
+            mock.patch.object(
+                wireguard.AsyncCommandLine, "generate_keys", _generate_keys
+            ),
+            mock.patch.dict(os.environ, {keystore.PASSPHRASE_ENV: ""}),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        with wgup.Session() as s:
+            s.create_interface(
+                "wg0", host="example.com", port=51820, cidr4="10.0.0.0/24"
+            )
+            s.create_interface(
+                "wg1", host="example.com", port=51821, cidr4="10.0.1.0/24"
+            )
+            s.create_peer("wg0", "laptop")
+        self.plans: list[dict] = []
+        self.failing: set[str] = set()
+
+    def _run_helper(self, plan: dict) -> list[dict]:
+        self.plans.append(plan)
+        results = []
+        for entry in plan["install"]:
+            ok = entry["iface"] not in self.failing
+            results.append(
+                {
+                    "step": "install",
+                    "iface": entry["iface"],
+                    "ok": ok,
+                    "error": "" if ok else "copy failed",
+                }
+            )
+        return results
+
+    def _sync(self, *argv: str) -> tuple[int, str]:
+        Config._instance = None
+        args = cli.get_parser().parse_args(["iface", "sync", *argv])
+        out = io.StringIO()
+        with mock.patch.object(
+            wireguard.CommandLine, "run_helper", side_effect=self._run_helper
+        ):
+            with contextlib.redirect_stdout(out):
+                status = cli.Iface.sync(args)
+        return status, out.getvalue()
+
+    def _installed(self) -> list[list[str]]:
+        return list(sorted(e["iface"] for e in p["install"]) for p in self.plans)
+
+    def test_state(self):
+        state = SyncState()
+        self.assertFalse(state.unchanged("wg0", "conf"))
+        state.update("wg0", "conf")
+        self.assertTrue(state.unchanged("wg0", "conf"))
+        # nothing is kept until the state is saved
+        self.assertEqual(SyncState().digests, {})
+        state.save()
+        state = SyncState()
+        self.assertTrue(state.unchanged("wg0", "conf"))
+        self.assertFalse(state.unchanged("wg0", "conf\n"))
+        self.assertFalse(state.unchanged("wg1", "conf"))
+
+    def test_unchanged(self):
+        self.assertEqual(self._sync("--all")[0], 0)
+        status, out = self._sync("wg0", "wg1")
+        self.assertEqual(status, 0)
+        self.assertIn('Interface "wg0" is unchanged.', out)
+        self.assertIn('Interface "wg1" is unchanged.', out)
+        self.assertEqual(self._installed(), [["wg0", "wg1"]])
+        with wgup.Session() as s:
+            s.create_peer("wg1", "phone")
+        self._sync("--all")
+        self.assertEqual(self._installed(), [["wg0", "wg1"], ["wg1"]])
+        # rendered configs are kept for the helper to install
+        with open(f"{self.dir.name}/sync/wg1.conf") as f:
+            self.assertIn('# Peer "phone"', f.read())
+
+    def test_force(self):
+        self._sync("--all")
+        self._sync("--all", "--force")
+        self.assertEqual(self._installed(), [["wg0", "wg1"], ["wg0", "wg1"]])
+
+    def test_failed_install(self):
+        self.failing = {"wg1"}
+        status, out = self._sync("--all")
+        self.assertEqual(status, 1)
+        self.assertIn('[!] install: interface "wg1" failed: copy failed', out)
+        # only interfaces that were installed are skipped next time
+        self.assertEqual(sorted(SyncState().digests), ["wg0"])
+        self.failing = set()
+        self.assertEqual(self._sync("--all")[0], 0)
+        self.assertEqual(self._installed(), [["wg0", "wg1"], ["wg1"]])
+
+    def test_helper_error(self):
+        def fail(plan: dict):
+            raise HelperException("[!] Privileged helper did not run the plan.")
+
+        args = cli.get_parser().parse_args(["iface", "sync", "--all"])
+        with mock.patch.object(wireguard.CommandLine, "run_helper", side_effect=fail):
+            with self.assertRaises(HelperException):
+                cli.Iface.sync(args)
+        self.assertFalse(os.path.exists(config._CONFIG_SYNC_STATE))
+
+    def test_single(self):
+        args = cli.get_parser().parse_args(["iface", "sync", "wg0"])
+        with mock.patch.object(wireguard.Interface, "sync") as sync:
+            sync.side_effect = subprocess.CalledProcessError(1, ["cp"])
+            with self.assertRaises(subprocess.CalledProcessError):
+                cli.Iface.sync(args)
+            self.assertEqual(SyncState().digests, {})
+            sync.side_effect = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertEqual(cli.Iface.sync(args), 0)
+                out = io.StringIO()
+                with contextlib.redirect_stdout(out):
+                    cli.Iface.sync(args)
+        self.assertEqual(sync.call_count, 2)
+        self.assertIn('Interface "wg0" is unchanged.', out.getvalue())
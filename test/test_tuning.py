@@ -0,0 +1,99 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from wgup import tuning, wireguard
+from wgup.tuning import Tuning
+from wgup.util import ArgsException
+
+
+class TestTuning(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.sysfs = tmp.name
+        # a PPPoE uplink, a plain ethernet link and a link without an mtu file
+        for link, mtu in (("ppp0", "1492\n"), ("eth0", "1500\n"), ("bond0", None)):
+            os.makedirs(f"{self.sysfs}/{link}")
+            if mtu is not None:
+                with open(f"{self.sysfs}/{link}/mtu", "w") as f:
+                    f.write(mtu)
+        patcher = mock.patch.object(tuning, "SYSFS_NET", self.sysfs)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mtu(self):
+        self.assertEqual(Tuning.link_mtu("ppp0"), 1492)
+        self.assertIsNone(Tuning.link_mtu("bond0"))
+        self.assertEqual(Tuning.mtu({"mtu": "auto"}, "ppp0"), 1412)
+        self.assertEqual(Tuning.mtu({"mtu": "auto"}, "eth0"), 1420)
+        self.assertEqual(Tuning.mtu({"mtu": "auto"}, "bond0"), 1420)
+        self.assertEqual(Tuning.mtu({"mtu": "auto"}, ""), 1420)
+        self.assertEqual(Tuning.mtu({"mtu": 1380}, "ppp0"), 1380)
+        self.assertIsNone(Tuning.mtu({}, "ppp0"))
+
+    def test_parse(self):
+        self.assertEqual(Tuning.parse("mtu", "1400"), 1400)
+        self.assertEqual(Tuning.parse("mtu", "auto"), "auto")
+        self.assertIsNone(Tuning.parse("mtu", "off"))
+        self.assertEqual(Tuning.parse("table", "off"), "off")
+        self.assertEqual(Tuning.parse("offload", "off"), "off")
+        self.assertIsNone(Tuning.parse("offload", "default"))
+        self.assertEqual(Tuning.parse("rps", "ff"), "ff")
+        self.assertEqual(Tuning.parse("rps", "1ffffffff"), "1,ffffffff")
+        self.assertEqual(Tuning.parse("rps", "1,0000000f"), "1,0000000f")
+        self.assertEqual(Tuning.parse("rps", "1,f"), "1,0000000f")
+        for key, value in (
+            ("mtu", "576"),
+            ("txqueuelen", "0"),
+            ("fwmark", "mark"),
+            ("table", "main"),
+            ("offload", "yes"),
+            ("rps", "cpu0"),
+            ("rps", "f,,f"),
+            ("rps", "-f"),
+            ("rps", "1,fffffffff"),
+            ("qdisc", "fq"),
+        ):
+            with self.assertRaises(ArgsException):
+                Tuning.parse(key, value)
+
+    def test_config(self):
+        iface = wireguard.Interface(
+            private_key="priv",
+            public_key="pub",
+            vpn_iface="wg0",
+            vpn_cidr4="10.0.0.0/24",
+            vpn_cidr6="fd00::/64",
+            addr4="10.0.0.1/24",
+            addr6="fd00::1/64",
+            host="example.com",
+            port=51820,
+            nat_iface="ppp0",
+        )
+        plain = iface.get_config()
+        self.assertNotIn("MTU", plain)
+        self.assertNotIn("# Tuning", plain)
+        iface.tuning = {
+            "mtu": "auto",
+            "fwmark": "0xca6c",
+            "txqueuelen": 2000,
+            "offload": "on",
+            "rps": "f",
+        }
+        conf = iface.get_config()
+        self.assertIn("ListenPort = 51820\nMTU = 1412\nFwMark = 0xca6c\n", conf)
+        self.assertIn("PostUp = ip link set dev %i txqueuelen 2000\n", conf)
+        self.assertIn("ethtool -K ppp0 gso on gro on", conf)
+        self.assertIn("echo f > $q/rps_cpus", conf)
+        data = iface.to_json()
+        self.assertEqual(wireguard.Interface.from_json(data).tuning, iface.tuning)
+        # the kernel reads masks for more than 32 CPUs in 32-bit groups
+        iface.tuning = {"rps": "all"}
+        with mock.patch.object(os, "cpu_count", return_value=40):
+            conf = iface.get_config()
+        self.assertIn("echo ff,ffffffff > $q/rps_cpus", conf)
+        iface.tuning = {"rps": "ffffffffff"}
+        self.assertIn("echo ff,ffffffff > $q/rps_cpus", iface.get_config())
+        iface.tuning = {}
+        self.assertNotIn("tuning", iface.to_json())
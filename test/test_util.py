@@ -0,0 +1,58 @@
+from unittest import TestCase
+
+from wgup.util import IP, PoolExhaustedException
+
+
+class TestIP(TestCase):
+    def test_next_addr4(self):
+        self.assertEqual(IP.next_addr4("10.0.0.0/24", []), "10.0.0.2/32")
+        self.assertEqual(
+            IP.next_addr4("10.0.0.0/24", ["10.0.0.2/32", "10.0.0.4/31"]),
+            "10.0.0.3/32",
+        )
+        self.assertEqual(
+            IP.next_addr4("10.0.0.0/24", ["10.0.0.2/31", "10.9.0.1/32"]),
+            "10.0.0.4/32",
+        )
+
+    def test_next_addr6(self):
+        self.assertEqual(IP.next_addr6("fd00::/64", []), "fd00::2/128")
+        self.assertEqual(IP.next_addr6("fd00::/64", ["fd00::2/127"]), "fd00::4/128")
+
+    def test_allocate_many(self):
+        self.assertEqual(
+            IP.allocate_many("10.0.0.0/29", ["10.0.0.3/32", "10.0.0.5/32"], 4),
+            ["10.0.0.2/32", "10.0.0.4/32", "10.0.0.6/32", "10.0.0.7/32"],
+        )
+        existing = list(f"fd00::{i:x}/128" for i in range(2, 1002))
+        addrs = IP.allocate_many("fd00::/64", existing, 1000)
+        self.assertEqual(addrs[0], "fd00::3ea/128")
+        self.assertEqual(len(set(addrs) & set(existing)), 0)
+
+    def test_allocate_many_dual(self):
+        self.assertEqual(
+            IP.allocate_many_dual("10.0.0.0/24", [], "fd00::/64", ["fd00::2/128"], 2),
+            [("10.0.0.2/32", "fd00::3/128"), ("10.0.0.3/32", "fd00::4/128")],
+        )
+
+    def test_exhausted(self):
+        with self.assertRaises(PoolExhaustedException):
+            IP.allocate_many("10.0.0.0/30", [], 3)
+        with self.assertRaises(PoolExhaustedException):
+            IP.next_addr4("10.0.0.0/31", [])
+
+    def test_paired_addr6(self):
+        self.assertEqual(
+            IP.paired_addr6("10.0.0.0/24", "10.0.0.77/32", "fd00::/64"),
+            "fd00::4d/128",
+        )
+        self.assertIsNone(IP.paired_addr6("10.0.0.0/24", "10.0.1.5/32", "fd00::/64"))
+        self.assertIsNone(IP.paired_addr6("10.0.0.0/24", "10.0.0.0/30", "fd00::/64"))
+
+    def test_hashed_addr6(self):
+        addr = IP.hashed_addr6("fd00::/64", "laptop")
+        self.assertEqual(addr, IP.hashed_addr6("fd00::/64", "laptop"))
+        self.assertNotEqual(addr, IP.hashed_addr6("fd00::/64", "laptop", 1))
+        self.assertIn(
+            IP.hashed_addr6("fd00::/126", "laptop"), ("fd00::2/128", "fd00::3/128")
+        )
@@ -0,0 +1,102 @@
+import os
+import tempfile
+import threading
+import time
+from unittest import TestCase
+
+from wgup import wireguard
+from wgup.watch import Watcher
+
+
+def _iface(name: str, port: int) -> wireguard.Interface:
+    return wireguard.Interface(
+        private_key="priv",
+        public_key="pub",
+        vpn_iface=name,
+        vpn_cidr4="10.0.0.0/24",
+        vpn_cidr6="fd00::/64",
+        addr4="10.0.0.1/24",
+        addr6="fd00::1/64",
+        host="example.com",
+        port=port,
+    )
+
+
+class TestWatcher(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, filename: str, content: str):
+        with open(f"{self.dir}/{filename}", "w") as f:
+            f.write(content)
+
+    def _burst(self, watcher: Watcher, writes: int, pause: float):
+        def write():
+            for i in range(writes):
+                self._write("interfaces.json", "x" * (i + 1))
+                time.sleep(pause)
+
+        thread = threading.Thread(target=write)
+        thread.start()
+        try:
+            return watcher.wait(timeout=5)
+        finally:
+            thread.join()
+
+    def test_burst_is_merged(self):
+        for poll in (False, True):
+            with self.subTest(poll=poll):
+                watcher = Watcher(
+                    self.dir,
+                    "interfaces.json",
+                    debounce=0.2,
+                    poll=poll,
+                    poll_interval=0.01,
+                )
+                try:
+                    change = self._burst(watcher, 5, 0.03)
+                    self.assertIsNotNone(change)
+                    _, count = change
+                    if poll:
+                        self.assertTrue(watcher.polling)
+                        self.assertGreaterEqual(count, 1)
+                    else:
+                        self.assertEqual(count, 5)
+                    # everything was consumed by the first wait
+                    self.assertIsNone(watcher.wait(timeout=0.1))
+                finally:
+                    watcher.close()
+
+    def test_max_delay(self):
+        watcher = Watcher(self.dir, "interfaces.json", debounce=0.2, max_delay=0.1)
+        try:
+            start = time.monotonic()
+            change = self._burst(watcher, 20, 0.02)
+            self.assertIsNotNone(change)
+            first, _ = change
+            self.assertLess(first - start, 0.3)
+        finally:
+            watcher.close()
+
+    def test_other_files_are_ignored(self):
+        watcher = Watcher(self.dir, "interfaces.json", debounce=0.05)
+        try:
+            self._write("sync_state.json", "{}")
+            self.assertIsNone(watcher.wait(timeout=0.1))
+            self._write("interfaces.json", "{}")
+            self.assertIsNotNone(watcher.wait(timeout=1))
+        finally:
+            watcher.close()
+
+    def test_changed(self):
+        watcher = Watcher(self.dir, "interfaces.json", poll=True)
+        wg0, wg1 = _iface("wg0", 51820), _iface("wg1", 51821)
+        self.assertEqual(watcher.changed([wg0, wg1]), [wg0, wg1])
+        self.assertEqual(watcher.changed([wg0, wg1]), [])
+        wg1 = _iface("wg1", 51822)
+        wg2 = _iface("wg2", 51823)
+        self.assertEqual(watcher.changed([wg0, wg1, wg2]), [wg1, wg2])
@@ -1,3 +1,7 @@
 """
 isort:skip_file
 """
+
+from wgup.session import Session
+
+__all__ = ["Session"]
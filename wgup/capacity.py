@@ -0,0 +1,91 @@
+import ipaddress
+import math
+import time
+
+from wgup.util import IP
+from wgup.wireguard import Interface
+
+# Peers created within this window set the growth rate of the projection
+GROWTH_WINDOW = 90 * 86400
+
+# Projections further out than this are not shown as a date
+MAX_PROJECTION = 100 * 365 * 86400
+
+
+class Capacity:
+    """
+    How full the address pools of an interface are. Everything is computed
+    from the used ranges the allocator works with (IP.used_ranges), one per
+    peer address at most, so a /64 costs no more than a /24.
+
+    Exhaustion is projected from the peers created within GROWTH_WINDOW
+    (Peer.created), assuming peers keep being created at the same rate.
+    Removed peers are not recorded, so the projection errs on the early side.
+    """
+
+    @staticmethod
+    def pool(cidr: str, existing: list[str]) -> dict:
+        """
+        Returns the host count, used and free host counts and the largest
+        block of consecutive free hosts of the pool `cidr`. The network and
+        server addresses are not counted as hosts.
+        """
+        network = ipaddress.ip_network(cidr)
+        used = IP.used_ranges(network, existing)
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        free = network.num_addresses - sum(end - start + 1 for start, end in used)
+        gaps = (b[0] - a[1] - 1 for a, b in zip(used, used[1:]))
+        largest = max(gaps, default=0)
+        largest = max(largest, last - used[-1][1], used[0][0] - first)
+        hosts = max(network.num_addresses - 2, 0)
+        return {
+            "pool": str(network),
+            "hosts": hosts,
+            "used": hosts - free,
+            "free": free,
+            "largest": largest,
+        }
+
+    @staticmethod
+    def growth(iface: Interface, now: float | None = None) -> float:
+        """
+        Returns how many peers per second were created within GROWTH_WINDOW.
+        """
+        if now is None:
+            now = time.time()
+        since = now - GROWTH_WINDOW
+        created = sum(1 for p in iface.peers.values() if p.created > since)
+        return created / GROWTH_WINDOW
+
+    @staticmethod
+    def report(iface: Interface, now: float | None = None) -> list[dict]:
+        """
+        Returns `pool` for the interface's IPv4 and IPv6 pools, each with
+        "exhausted", the projected time it runs out (None if there is no
+        recent growth or it is more than MAX_PROJECTION away).
+        """
+        if now is None:
+            now = time.time()
+        rate = Capacity.growth(iface, now)
+        rows = [
+            Capacity.pool(iface.vpn_cidr4, list(p.cidr4 for p in iface.peers.values())),
+            Capacity.pool(iface.vpn_cidr6, list(p.cidr6 for p in iface.peers.values())),
+        ]
+        for row in rows:
+            row["rate"] = rate
+            row["exhausted"] = None
+            if not row["free"]:
+                row["exhausted"] = now
+            elif rate and row["free"] / rate <= MAX_PROJECTION:
+                row["exhausted"] = now + row["free"] / rate
+        return rows
+
+    @staticmethod
+    def count(n: int) -> str:
+        """
+        Returns `n` as digits, or as a power of two if it is too long to read.
+        """
+        if n < 1 << 32:
+            return str(n)
+        return f"~2^{math.log2(n):.1f}"
@@ -1,19 +1,38 @@
 import argparse
 import logging
+import os
 import sys
-from enum import Enum
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 from wgup import defaults, wireguard
-from wgup.config import Config
+from wgup.capacity import GROWTH_WINDOW, Capacity
+from wgup.cluster import Layout
+from wgup.config import INTERFACES_FILE, Config, SyncState
+from wgup.group import Group as IfaceGroup
+from wgup.importer import Importer
+from wgup.keepalive import Keepalive as KeepalivePolicy
+from wgup.keypool import KeyPool
+from wgup.mesh import Mesh
+from wgup.output import FORMATS, RowFilter, RowWriter
+from wgup.perf import Profile
+from wgup.reap import Reaper
+from wgup.rollout import Rollout
+from wgup.session import Session
+from wgup.shaping import Shaping as ShapingRules
+from wgup.tuning import Tuning
 from wgup.util import (
     IP,
     ArgsException,
     ExitException,
+    HelperException,
     Input,
     InterfaceNotFoundException,
     PeerNotFoundException,
+    write_private,
 )
+from wgup.watch import DEBOUNCE, MAX_DELAY, Watcher
 
 _logger = logging.getLogger(defaults.PROG)
 _logger.setLevel(logging.INFO)
@@ -22,18 +41,21 @@ _stderr_handler.setLevel(logging.DEBUG)
 _stderr_handler.setFormatter(logging.Formatter("{levelname:<8} : {message}", style="{"))
 _logger.addHandler(_stderr_handler)
 
-_FMT_INTERFACES = "{iface:15} : {host}:{port}"
+_FMT_INTERFACES = "{name:15} : {host}:{port}"
 _FMT_PEERS = "{name:20} : {cidr4:16} : {cidr6}"
 _FMT_ATTRS = "{:20} : {}"
+_FMT_GROUPS = "{group:15} : {cidr4} : {cidr6}"
+_FMT_GROUP_MEMBERS = "  {iface:13} : {port:5} : {peers} peers"
+_FMT_KEEPALIVE = "{source:20} : {policy:12} : {peers:>8} peers : {rate:>10.1f} pkt/s"
+_FMT_NODES = "{name:15} : {host}:{port} : {cidr4} : {cidr6}"
+_FMT_REAP = "{name:20} : {cidr4:16} : {seen}"
+_FMT_CAPACITY = (
+    "  {pool:22} : {used:>10} used ({share:5.1%}) : {free:>10} free"
+    " : {largest:>10} largest block : {exhausted}"
+)
 
 
 class Iface:
-    class Attributes(Enum):
-        NAME = "name"
-        HOST = "host"
-        PORT = "port"
-        NAT_IFACE = "nat_iface"
-
     @staticmethod
     def _get(c: Config, args: argparse.Namespace):
         """
@@ -49,22 +71,136 @@ class Iface:
         return iface
 
     @staticmethod
-    def ls(_: argparse.Namespace):
+    def _get_many(c: Config, args: argparse.Namespace):
+        """
+        Returns the interfaces named in args.interface, or all interfaces if
+        args.all is set.
+        """
+        if args.all:
+            if args.interface:
+                raise ArgsException(
+                    "[!] Please specify either interfaces or --all, not both."
+                )
+            if not c.interfaces:
+                raise ArgsException("[!] No interfaces have been defined.")
+            return list(i[1] for i in sorted(c.interfaces.items()))
+        if not args.interface:
+            raise ArgsException("[!] Please specify an interface (or --all).")
+        ifaces: list[wireguard.Interface] = []
+        for name in args.interface:
+            iface = c.interfaces.get(name)
+            if iface is None:
+                raise InterfaceNotFoundException(
+                    f'[!] Interface "{name}" does not exist.'
+                )
+            ifaces.append(iface)
+        return ifaces
+
+    @staticmethod
+    def _render_many(
+        ifaces: list[wireguard.Interface], state: SyncState, force: bool = False
+    ):
+        """
+        Renders configs for all given interfaces concurrently. Configs that
+        differ from the last synced version (or all of them, if `force` is
+        set) are written to CONFIG_DIR/sync. Returns the install entries for
+        the helper, the rendered configs, and the names of unchanged
+        interfaces.
+        """
+        sync_dir = f"{defaults.CONFIG_DIR}/sync"
+        os.makedirs(sync_dir, mode=0o700, exist_ok=True)
+
+        def render(iface: wireguard.Interface):
+            iface_conf = iface.get_config()
+            if not force and state.unchanged(iface.vpn_iface, iface_conf):
+                return iface_conf, None
+            filename = f"{sync_dir}/{iface.vpn_iface}.conf"
+            with open(filename, "w") as f:
+                f.write(iface_conf)
+            return iface_conf, {"iface": iface.vpn_iface, "source": filename}
+
+        with Profile.phase("render"):
+            with ThreadPoolExecutor() as pool:
+                rendered = list(pool.map(render, ifaces))
+        install = list(entry for _, entry in rendered if entry is not None)
+        confs = dict((i.vpn_iface, conf) for i, (conf, _) in zip(ifaces, rendered))
+        unchanged = list(
+            i.vpn_iface for i, (_, entry) in zip(ifaces, rendered) if entry is None
+        )
+        return install, confs, unchanged
+
+    @staticmethod
+    def _run_helper(plan: dict):
+        """
+        Runs the plan through the privileged helper and prints its results.
+        Returns the status and the names of interfaces whose steps all
+        succeeded.
+        """
+        results = wireguard.CommandLine.run_helper(plan)
+        for r in results:
+            if r["ok"]:
+                print(f'[i] {r["step"]}: interface "{r["iface"]}" OK.')
+            else:
+                print(f'[!] {r["step"]}: interface "{r["iface"]}" failed: {r["error"]}')
+        failed = set(r["iface"] for r in results if not r["ok"])
+        succeeded = list(set(r["iface"] for r in results) - failed)
+        return (0 if not failed else 1), succeeded
+
+    @staticmethod
+    def ls(args: argparse.Namespace):
         c = Config()
-        if c.interfaces:
-            print("[i] Showing all interfaces.")
-            for k, v in c.interfaces.items():
-                print(_FMT_INTERFACES.format(iface=k, port=v.port, host=v.host))
-        else:
+        if not c.interfaces and args.format == "table":
             print("[i] No interfaces have been defined.")
+            return 0
+        rows = (
+            {
+                "name": k,
+                "host": v.host,
+                "port": v.port,
+                "cidr4": v.vpn_cidr4,
+                "cidr6": v.vpn_cidr6,
+                "peers": len(v.peers),
+            }
+            for k, v in c.interfaces.items()
+        )
+        rows = RowFilter(args.filter, ("cidr4", "cidr6")).select(
+            rows, args.offset, args.limit
+        )
+        writer = RowWriter(
+            args.format,
+            ("name", "host", "port", "cidr4", "cidr6", "peers"),
+            _FMT_INTERFACES,
+        )
+        if args.format == "table":
+            print("[i] Showing all interfaces.")
+        for row in rows:
+            if not writer.write(row):
+                break
+        writer.close()
         return 0
 
     @staticmethod
     def create(args: argparse.Namespace):
+        with Session() as s:
+            s.create_interface(
+                str(args.name),
+                host=str(args.host),
+                port=args.port,
+                cidr4=str(args.cidr4),
+                cidr6=str(args.cidr6),
+                nat_iface=str(args.nat_iface),
+                addr_mode=args.addr_mode,
+                key_mode=args.key_mode,
+            )
+        print(f'[i] Created interface "{args.name}".')
+        return 0
+
+    @staticmethod
+    def import_(args: argparse.Namespace):
         c = Config()
-        # sanitize params
-        # TODO(lavajuno): write library for command line forms
-        iface_name = str(args.name)
+        iface_name = args.name
+        if not iface_name:
+            iface_name = os.path.basename(args.filename).removesuffix(".conf")
         valid, reason = Input.check_iface(iface_name)
         if not valid:
             print("[!] Interface name is invalid:")
@@ -75,118 +211,139 @@ class Iface:
                 "[!] An interface with this name already exists! Please choose a different name."
             )
             return 1
-        cidr4 = str(args.cidr4)
-        if cidr4:
-            valid, reason = Input.check_cidr4(cidr4)
-            if not valid:
-                print("[!] IPv4 CIDR block is invalid:")
-                print(reason)
-                return 1
-        else:
-            cidr4 = IP.auto_cidr4()
-        cidr6 = str(args.cidr6)
-        if cidr6:
-            valid, reason = Input.check_cidr6(cidr6)
+        if args.port is not None:
+            valid, reason = Input.check_int(args.port, min_value=1, max_value=65535)
             if not valid:
-                print("[!] IPv4 CIDR block is invalid:")
+                print("[!] Port is invalid:")
                 print(reason)
                 return 1
-        else:
-            cidr6 = IP.auto_cidr6()
-        port = int(args.port)
-        valid, reason = Input.check_int(port, min_value=1, max_value=65535)
-        if not valid:
-            print("[!] Port is invalid:")
-            print(reason)
-            return 1
-        host = str(args.host)
-        if not host:
-            print("[!] Host is required.")
-            return 1
-        iface = wireguard.Interface.create(
-            vpn_iface=iface_name,
-            vpn_cidr4=cidr4,
-            vpn_cidr6=cidr6,
-            host=host,
-            port=port,
+        iface, importer, seconds = Importer.from_file(
+            args.filename, iface_name, args.host, args.port
         )
+        for warning in importer.warnings:
+            print(f"[!] {warning}")
         c.interfaces[iface_name] = iface
         c.save()
-        print(f'[i] Created interface "{iface_name}".')
+        rate = len(iface.peers) / seconds if seconds else 0
+        print(
+            f'[i] Imported interface "{iface_name}" with {len(iface.peers)} peers'
+            f" ({importer.lines} lines in {seconds:.2f}s, {rate:.0f} peers/s)."
+        )
+        if iface.peers:
+            print(
+                "    Imported peers have no private keys. Rekey them before exporting their configs."
+            )
         return 0
 
     @classmethod
     def show(cls, args: argparse.Namespace):
-        c = Config()
+        c = Config.readonly(args.interface)
         iface = cls._get(c, args)
         print(f'[i] Showing interface "{iface.vpn_iface}".')
         print(_FMT_ATTRS.format("Public Key", iface.public_key))
         print(_FMT_ATTRS.format("VPN IPv4 Pool", iface.vpn_cidr4))
         print(_FMT_ATTRS.format("VPN IPv6 Pool", iface.vpn_cidr6))
+        print(_FMT_ATTRS.format("Address Mode", iface.addr_mode))
+        print(_FMT_ATTRS.format("Key Mode", iface.key_mode))
+        if iface.group:
+            print(_FMT_ATTRS.format("Group", iface.group))
+        if iface.net_cidr4 or iface.net_cidr6:
+            print(_FMT_ATTRS.format("Routed IPv4 Network", iface.routed_cidr4))
+            print(_FMT_ATTRS.format("Routed IPv6 Network", iface.routed_cidr6))
         print(_FMT_ATTRS.format("NAT", "Enabled" if iface.nat_iface else "Disabled"))
         if iface.nat_iface:
             print(_FMT_ATTRS.format("NAT Interface", iface.nat_iface))
             print(_FMT_ATTRS.format("NAT IPv4 Dests", ", ".join(iface.nat_cidr4)))
             print(_FMT_ATTRS.format("NAT IPv6 Dests", ", ".join(iface.nat_cidr6)))
+        for key in Tuning.KEYS:
+            if key in iface.tuning:
+                value = iface.tuning[key]
+                if key == "mtu" and value == "auto":
+                    value = f"auto ({Tuning.mtu(iface.tuning, iface.nat_iface)})"
+                print(_FMT_ATTRS.format(f"Tuning: {key}", value))
         return 0
 
     @classmethod
-    def set(cls, args: argparse.Namespace):
-        c = Config()
-        iface = cls._get(c, args)
-        match args.attribute:
-            case cls.Attributes.NAME.value:
-                raise NotImplementedError
-            case cls.Attributes.HOST.value:
-                iface.host = args.value
-            case cls.Attributes.PORT.value:
-                valid, reason = Input.check_int(
-                    args.value, min_value=1, max_value=65535
-                )
-                if not valid:
-                    print("[!] Port is invalid:")
-                    print(reason)
-                    return 1
-                iface.port = int(args.value)
-            case cls.Attributes.NAT_IFACE.value:
-                valid, reason = Input.check_iface(args.value)
-                if not valid:
-                    print("[!] NAT interface is invalid:")
-                    print(reason)
-                    return 1
-                iface.nat_iface = args.value
-            case _:
+    def capacity(cls, args: argparse.Namespace):
+        c = Config() if args.all else Config.readonly(*args.interface)
+        ifaces = cls._get_many(c, args)
+        now = time.time()
+        for iface in ifaces:
+            rows = Capacity.report(iface, now)
+            print(
+                f'[i] Address capacity of interface "{iface.vpn_iface}"'
+                f" ({rows[0]['rate'] * GROWTH_WINDOW:.0f} peers created in the last"
+                f" {GROWTH_WINDOW // 86400} days)."
+            )
+            for row in rows:
+                if row["exhausted"] is None:
+                    exhausted = "no exhaustion projected"
+                elif row["exhausted"] <= now:
+                    exhausted = "exhausted"
+                else:
+                    day = time.strftime("%Y-%m-%d", time.localtime(row["exhausted"]))
+                    exhausted = f"exhausted around {day}"
                 print(
-                    f"[!] Please specify one of the following attributes: {", ".join(x.value for x in cls.Attributes)}"
+                    _FMT_CAPACITY.format(
+                        pool=row["pool"],
+                        used=Capacity.count(row["used"]),
+                        share=row["used"] / row["hosts"] if row["hosts"] else 1,
+                        free=Capacity.count(row["free"]),
+                        largest=Capacity.count(row["largest"]),
+                        exhausted=exhausted,
+                    )
                 )
-                return 1
+        return 0
+
+    @classmethod
+    def set(cls, args: argparse.Namespace):
+        with Session() as s:
+            s.set_interface(args.interface, args.attribute, args.value)
         print(
             f'[i] Set {args.attribute}="{args.value}" (interface "{args.interface}").'
         )
-        c.save()
         return 0
 
     @classmethod
     def rm(cls, args: argparse.Namespace):
-        c = Config()
-        _ = cls._get(c, args)  # ignore
-        if not args.force:
-            print("Are you sure you want to remove this interface?")
-            print("This operation is irreversible!")
-            print("-> (y/N):")
-            if input().lower() != "y":
-                print("[!] Operation cancelled by user. No action taken.")
-                return 1
-        del c.interfaces[args.interface]
+        with Session() as s:
+            s.interface(args.interface)
+            if not args.force:
+                print("Are you sure you want to remove this interface?")
+                print("This operation is irreversible!")
+                print("-> (y/N):")
+                if input().lower() != "y":
+                    print("[!] Operation cancelled by user. No action taken.")
+                    return 1
+            s.remove_interface(args.interface)
         print(f'Removed interface "{args.interface}".')
-        c.save()
         return 0
 
     @classmethod
     def sync(cls, args: argparse.Namespace):
         c = Config()
-        iface = cls._get(c, args)
-        iface_conf = iface.get_config()
+        ifaces = cls._get_many(c, args)
+        state = SyncState()
+        if len(ifaces) > 1 or args.all:
+            install, confs, unchanged = cls._render_many(ifaces, state, args.force)
+            for name in unchanged:
+                print(f'[i] Interface "{name}" is unchanged.')
+            if not install:
+                return 0
+            services = list({"iface": i["iface"], "action": "reload"} for i in install)
+            status, succeeded = cls._run_helper(
+                {"install": install, "services": services if args.reload else []}
+            )
+            for name in succeeded:
+                state.update(name, confs[name])
+            state.save()
+            return status
+        iface = ifaces[0]
+        with Profile.phase("render"):
+            iface_conf = iface.get_config()
+        if not args.force and state.unchanged(iface.vpn_iface, iface_conf):
+            print(f'[i] Interface "{iface.vpn_iface}" is unchanged.')
+            return 0
         temp_filename = f"{defaults.CONFIG_DIR}/sync_temp"
         try:
             with open(temp_filename, "w") as f:
@@ -194,14 +351,18 @@ class Iface:
         except Exception as e:
             print(f"[!] Could not write temporary file: {str(e)}")
         iface.sync(temp_filename)
-        print(f'[i] Synced interface "{args.interface}".')
+        state.update(iface.vpn_iface, iface_conf)
+        state.save()
+        print(f'[i] Synced interface "{iface.vpn_iface}".')
+        if args.reload:
+            wireguard.CommandLine.service_reload(iface.vpn_iface)
         return 0
 
     @classmethod
     def export(cls, args: argparse.Namespace):
-        c = Config()
-        iface = cls._get(c, args)
-        iface_conf = iface.get_config()
+        iface_conf = Session(Config.readonly(args.interface)).interface_config(
+            args.interface
+        )
         if args.filename:
             try:
                 with open(args.filename, "w") as f:
@@ -216,106 +377,115 @@ class Iface:
 
     @classmethod
     def up(cls, args: argparse.Namespace):
-        c = Config()
-        iface = cls._get(c, args)
-        wireguard.CommandLine.service_up(iface.vpn_iface)
-        return 0
+        return cls._service(args, "up", wireguard.CommandLine.service_up)
 
     @classmethod
     def down(cls, args: argparse.Namespace):
-        c = Config()
-        iface = cls._get(c, args)
-        wireguard.CommandLine.service_down(iface.vpn_iface)
-        return 0
+        return cls._service(args, "down", wireguard.CommandLine.service_down)
 
     @classmethod
     def reload(cls, args: argparse.Namespace):
+        return cls._service(args, "reload", wireguard.CommandLine.service_reload)
+
+    @classmethod
+    def _service(cls, args: argparse.Namespace, action: str, single):
         c = Config()
-        iface = cls._get(c, args)
-        wireguard.CommandLine.service_reload(iface.vpn_iface)
+        ifaces = cls._get_many(c, args)
+        if len(ifaces) > 1 or args.all:
+            services = list({"iface": i.vpn_iface, "action": action} for i in ifaces)
+            status, _ = cls._run_helper({"services": services})
+            return status
+        single(ifaces[0].vpn_iface)
         return 0
 
     @classmethod
     def nat_create(cls, args: argparse.Namespace):
-        if not (args.cidr4 or args.cidr6):
-            raise ArgsException(
-                "[!] Please specify an IPv4 or IPv6 destination (or both)."
-            )
-        c = Config()
-        iface = cls._get(c, args)
-        if args.cidr4 and args.cidr4 not in iface.nat_cidr4:
-            valid, reason = Input.check_cidr4(args.cidr4)
-            if not valid:
-                print("[!] IPv4 CIDR is invalid:")
-                print(reason)
-                return 1
-            iface.nat_cidr4.append(args.cidr4)
-        if args.cidr6 and args.cidr6 not in iface.nat_cidr6:
-            valid, reason = Input.check_cidr6(args.cidr6)
-            if not valid:
-                print("[!] IPv6 CIDR is invalid:")
-                print(reason)
-                return 1
-            iface.nat_cidr6.append(args.cidr6)
-        c.save()
+        with Session() as s:
+            s.add_nat(args.interface, args.cidr4, args.cidr6)
         print(f'[i] Created NAT on interface "{args.interface}".')
         return 0
 
     @classmethod
     def nat_rm(cls, args: argparse.Namespace):
-        if not (args.cidr4 or args.cidr6):
-            raise ArgsException(
-                "[!] Please specify an IPv4 or IPv6 destination (or both)."
-            )
-        c = Config()
-        iface = cls._get(c, args)
-        if args.cidr4:
-            valid, reason = Input.check_cidr4(args.cidr4)
-            if not valid:
-                print("[!] IPv4 CIDR is invalid:")
-                print(reason)
-                return 1
-            if args.cidr4 in iface.nat_cidr4:
-                iface.nat_cidr4.remove(args.cidr4)
-            else:
-                raise ArgsException(
-                    f'[!] NAT to {args.cidr4} does not exist on interface "{args.interface}".'
-                )
-        if args.cidr6:
-            valid, reason = Input.check_cidr6(args.cidr6)
-            if not valid:
-                print("[!] IPv6 CIDR is invalid:")
-                print(reason)
-                return 1
-            if args.cidr6 in iface.nat_cidr6:
-                iface.nat_cidr6.remove(args.cidr6)
-            else:
-                raise ArgsException(
-                    f'[!] NAT to {args.cidr6} does not exist on interface "{args.interface}".'
-                )
-            c.save()
+        with Session() as s:
+            s.remove_nat(args.interface, args.cidr4, args.cidr6)
         print(f'[i] Removed NAT on interface "{args.interface}".')
         return 0
 
     @classmethod
     def rekey(cls, args: argparse.Namespace):
-        c = Config()
-        iface = cls._get(c, args)
-        iface.rekey()
-        c.save()
+        s = Session()
+        s.begin()
+        try:
+            iface = s.interface(args.interface)
+            if args.cancel:
+                if iface.rollout is None:
+                    print(f'[!] No staged rekey in progress on "{args.interface}".')
+                    return 1
+                iface.rollout = None
+                s.dirty = True
+                s.commit()
+                print(f'[i] Cancelled staged rekey on "{args.interface}".')
+                return 0
+            if args.staged or iface.rollout is not None:
+                return cls._rekey_staged(s, iface, args)
+            s.rekey_interface(args.interface)
+            s.commit()
+        finally:
+            # releases the lock if nothing was committed
+            s.rollback()
         print(f'[i] Rekeyed interface "{args.interface}".')
         print(
             "    Please export its interface and peer configs again to connect using the new keys."
         )
         return 0
 
+    @classmethod
+    def _rekey_staged(cls, s: Session, iface: wireguard.Interface, args):
+        if iface.rollout is None:
+            for name, value, minimum in (
+                ("Batch size", args.batch_size, 1),
+                ("Concurrency", args.concurrency, 1),
+                ("Interval", args.interval, 0),
+            ):
+                valid, reason = Input.check_int(value, min_value=minimum)
+                if not valid:
+                    print(f"[!] {name} is invalid:")
+                    print(reason)
+                    return 1
+            Rollout.start(iface, args.batch_size, args.concurrency, args.interval)
+            s.dirty = True
+            print(f"[i] Started staged rekey of {len(iface.peers)} peers.")
+        else:
+            pending = len(iface.rollout["pending"])
+            print(f"[i] Resuming staged rekey ({pending} peers left).")
+        s.commit()
+        state = SyncState()
 
-class Peer:
-    class Attributes(Enum):
-        NAME = "name"
-        CIDR4 = "cidr4"
-        CIDR6 = "cidr6"
+        def apply():
+            # rendered from the config as of the last batch
+            install, confs, _ = cls._render_many(
+                [s.interface(args.interface)], state, force=True
+            )
+            status, succeeded = cls._run_helper(
+                {
+                    "install": install,
+                    "services": [{"iface": args.interface, "action": "apply"}],
+                }
+            )
+            for name in succeeded:
+                state.update(name, confs[name])
+            state.save()
+            if status != 0:
+                raise HelperException("[!] Could not apply the new keys.")
+
+        Rollout.run(s, args.interface, None if args.no_apply else apply)
+        print(f'[i] Rekeyed all peers on "{args.interface}".')
+        print("    Please export the peer configs again to connect using the new keys.")
+        return 0
 
+
+class Peer:
     @staticmethod
     def _get(c: Config, args: argparse.Namespace):
         """
@@ -333,78 +503,81 @@ class Peer:
             raise PeerNotFoundException(f'[!] Peer "{args.peer}" does not exist.')
         return iface, peer
 
-    @staticmethod
-    def __next_addr4(interface: wireguard.Interface):
-        peer_cidr4 = list(peer.cidr4 for peer in interface.peers.values())
-        return IP.next_addr4(interface.vpn_cidr4, peer_cidr4)
-
-    @staticmethod
-    def __next_addr6(interface: wireguard.Interface):
-        peer_cidr6 = list(peer.cidr6 for peer in interface.peers.values())
-        return IP.next_addr6(interface.vpn_cidr6, peer_cidr6)
-
     @classmethod
     def create(cls, args: argparse.Namespace):
-        c = Config()
-        if not c.interfaces.get(args.interface):
-            print(f'No such interface: "{args.interface}".')
-            return 1
-        interface = c.interfaces[args.interface]
-        # sanitize params
-        # TODO(lavajuno): write library for command line forms
-        peer_name = str(args.name)
-        valid, reason = Input.check_peer_name(peer_name)
-        if not valid:
-            print("[!] Peer name is invalid:")
-            print(reason)
-            return 1
-        if interface.peers.get(peer_name):
-            print(
-                "[!] A peer with this name already exists! Please choose a different name."
-            )
-            return 1
-        cidr4 = str(args.cidr4)
-        if cidr4:
-            valid, reason = Input.check_cidr4(cidr4)
+        if args.count is not None:
+            valid, reason = Input.check_int(args.count, min_value=1)
             if not valid:
-                print("[!] IPv4 CIDR block is invalid:")
+                print("[!] Count is invalid:")
                 print(reason)
                 return 1
+            names = list(f"{args.name}{i}" for i in range(args.count))
         else:
-            cidr4 = cls.__next_addr4(interface)
-        cidr6 = str(args.cidr6)
-        if cidr6:
-            valid, reason = Input.check_cidr6(cidr6)
-            if not valid:
-                print("[!] IPv6 CIDR block is invalid:")
-                print(reason)
-                return 1
+            names = [str(args.name)]
+        placed: dict[str, list[wireguard.Peer]] = {}
+        with Session() as s:
+            in_group = args.interface not in s.interfaces and bool(
+                IfaceGroup.members(s.interfaces, args.interface)
+            )
+            if (in_group or args.count is not None) and (args.cidr4 or args.cidr6):
+                raise ArgsException(
+                    "[!] CIDR blocks can only be given when creating a single peer."
+                )
+            if in_group:
+                placed = s.create_peers_in_group(args.interface, names)
+            elif args.count is not None:
+                s.create_peers(args.interface, names)
+            else:
+                s.create_peer(args.interface, names[0], args.cidr4, args.cidr6)
+        if in_group:
+            for iface_name, peers in placed.items():
+                if len(peers) == 1:
+                    print(
+                        f'[i] Created peer "{peers[0].name}" on interface "{iface_name}".'
+                    )
+                else:
+                    print(
+                        f'[i] Created {len(peers)} peers on interface "{iface_name}".'
+                    )
+        elif args.count is not None:
+            print(
+                f'[i] Created {args.count} peers ("{names[0]}" to "{names[-1]}") for interface "{args.interface}".'
+            )
         else:
-            cidr6 = cls.__next_addr6(interface)
-        peer = wireguard.Peer.create(name=peer_name, cidr4=cidr4, cidr6=cidr6)
-        interface.peers[peer_name] = peer
-        c.save()
-        print(f'[i] Created peer "{peer_name}" for interface "{args.interface}".')
+            print(f'[i] Created peer "{names[0]}" for interface "{args.interface}".')
         return 0
 
     @classmethod
     def ls(cls, args: argparse.Namespace):
-        c = Config()
+        c = Config.readonly(args.interface)
         iface = c.interfaces.get(args.interface)
         if iface is None:
             print(f'[!] Interface "{args.interface}" does not exist.')
             return 1
-        if iface.peers:
-            print(f'[i] Showing peers for "{iface.vpn_iface}".')
-            for k, v in iface.peers.items():
-                print(_FMT_PEERS.format(name=k, cidr4=v.cidr4, cidr6=v.cidr6))
-        else:
+        if not iface.peers and args.format == "table":
             print("[i] No peers have been defined for this interface.")
+            return 0
+        rows = (
+            {"name": k, "cidr4": v.cidr4, "cidr6": v.cidr6, "public_key": v.public_key}
+            for k, v in iface.peers.items()
+        )
+        rows = RowFilter(args.filter, ("cidr4", "cidr6")).select(
+            rows, args.offset, args.limit
+        )
+        writer = RowWriter(
+            args.format, ("name", "cidr4", "cidr6", "public_key"), _FMT_PEERS
+        )
+        if args.format == "table":
+            print(f'[i] Showing peers for "{iface.vpn_iface}".')
+        for row in rows:
+            if not writer.write(row):
+                break
+        writer.close()
         return 0
 
     @classmethod
     def show(cls, args: argparse.Namespace):
-        c = Config()
+        c = Config.readonly(args.interface)
         iface = c.interfaces.get(args.interface)
         if iface is None:
             print(f'[!] Interface "{args.interface}" does not exist.')
@@ -417,27 +590,17 @@ class Peer:
         print(_FMT_ATTRS.format("Public Key", peer.public_key))
         print(_FMT_ATTRS.format("IPv4 CIDR", peer.cidr4))
         print(_FMT_ATTRS.format("IPv6 CIDR", peer.cidr6))
+        if not peer.enabled:
+            print(_FMT_ATTRS.format("Enabled", "No"))
+        if peer.last_seen:
+            ago = Reaper.age(time.time() - peer.last_seen)
+            print(_FMT_ATTRS.format("Last Seen", f"{ago} ago"))
         return 0
 
     @classmethod
     def export(cls, args: argparse.Namespace):
-        c = Config()
-        iface = c.interfaces.get(args.interface)
-        if iface is None:
-            print(f'[!] Interface "{args.interface}" does not exist.')
-            return 1
-        peer = iface.peers.get(args.peer)
-        if peer is None:
-            print(f'[!] Peer "{args.peer}" does not exist.')
-            return 1
-        peer_conf = peer.get_config(
-            vpn_cidr4=iface.vpn_cidr4,
-            vpn_cidr6=iface.vpn_cidr6,
-            nat_cidr4=iface.nat_cidr4,
-            nat_cidr6=iface.nat_cidr6,
-            endpoint_public_key=iface.public_key,
-            endpoint_host=iface.host,
-            endpoint_port=iface.port,
+        peer_conf = Session(Config.readonly(args.interface)).peer_config(
+            args.interface, args.peer
         )
         if args.filename:
             try:
@@ -451,65 +614,523 @@ class Peer:
             return 1
         return 0
 
+    @classmethod
+    def export_all(cls, args: argparse.Namespace):
+        c = Config.readonly(args.interface)
+        iface = c.interfaces.get(args.interface)
+        if iface is None:
+            print(f'[!] Interface "{args.interface}" does not exist.')
+            return 1
+        os.makedirs(args.out, mode=0o700, exist_ok=True)
+        mesh = Mesh(iface)
+        with Profile.phase("render"):
+            for peer in iface.peers.values():
+                write_private(f"{args.out}/{peer.name}.conf", mesh.peer_config(peer))
+        print(
+            f'[i] Wrote {len(iface.peers)} peer configs ({len(mesh.members)} in the mesh) to "{args.out}".'
+        )
+        return 0
+
     @classmethod
     def set(cls, args: argparse.Namespace):
-        c = Config()
-        _, peer = cls._get(c, args)
-        match args.attribute:
-            case cls.Attributes.NAME.value:
-                raise NotImplementedError
-            case cls.Attributes.CIDR4.value:
-                # TODO ensure CIDRs are in network and unused
-                valid, reason = Input.check_cidr4(args.value)
-                if not valid:
-                    print("[!] IPv4 CIDR block is invalid:")
-                    print(reason)
-                    return 1
-                peer.cidr4 = args.value
-            case cls.Attributes.CIDR6.value:
-                valid, reason = Input.check_cidr6(args.value)
-                if not valid:
-                    print("[!] IPv6 CIDR block is invalid:")
-                    print(reason)
-                    return 1
-                peer.cidr6 = args.value
-            case _:
-                print(
-                    f"[!] Please specify one of the following attributes: {", ".join(x.value for x in cls.Attributes)}"
-                )
-                return 1
+        with Session() as s:
+            s.set_peer(args.interface, args.peer, args.attribute, args.value)
         print(
             f'[i] Set {args.attribute}="{args.value}" (peer "{args.peer}" on {args.interface}).'
         )
-        c.save()
         return 0
 
     @classmethod
     def rm(cls, args: argparse.Namespace):
+        with Session() as s:
+            s.peer(args.interface, args.peer)
+            if not args.force:
+                print("Are you sure you want to remove this peer?")
+                print("This operation is irreversible!")
+                print("-> (y/N):")
+                if input().lower() != "y":
+                    print("[!] Operation cancelled by user. No action taken.")
+                    return 1
+            s.remove_peer(args.interface, args.peer)
+        print(f'Removed peer "{args.peer}" (on {args.interface}).')
+        return 0
+
+    @classmethod
+    def reap(cls, args: argparse.Namespace):
+        idle = Reaper.parse_idle(args.idle)
+        with Session() as s:
+            iface = s.interface(args.interface)
+            now = time.time()
+            dump = wireguard.CommandLine.show_dump(iface.vpn_iface)
+            seen = Reaper.record(iface, dump, now)
+            stale = Reaper.stale(iface, idle, now)
+            print(
+                f'[i] {len(stale)} of {len(iface.peers)} peers on "{iface.vpn_iface}" have been idle for more than {args.idle} ({seen} seen).'
+            )
+            for peer in stale:
+                seen_ago = "never seen"
+                if peer.last_seen:
+                    seen_ago = f"last seen {Reaper.age(now - peer.last_seen)} ago"
+                print(_FMT_REAP.format(name=peer.name, cidr4=peer.cidr4, seen=seen_ago))
+            routes, size = Reaper.savings(iface, stale)
+            action = "Removing" if args.remove else "Disabling"
+            print(
+                f"[i] {action} them saves {routes} routes and about {size} bytes of interface config."
+            )
+            if args.dry_run:
+                print("[i] Dry run. No action taken.")
+                return 0
+            for peer in stale:
+                if args.remove:
+                    s.remove_peer(iface.vpn_iface, peer.name)
+                else:
+                    peer.enabled = False
+            # one save for the last seen times and all changes
+            s.dirty = True
+        print(f"[i] {'Removed' if args.remove else 'Disabled'} {len(stale)} peers.")
+        if not stale or args.no_apply:
+            return 0
+        state = SyncState()
+        install, confs, _ = Iface._render_many([iface], state)
+        status, succeeded = Iface._run_helper(
+            {
+                "install": install,
+                "services": [{"iface": iface.vpn_iface, "action": "apply"}],
+            }
+        )
+        for name in succeeded:
+            state.update(name, confs[name])
+        state.save()
+        return status
+
+    @classmethod
+    def rekey(cls, args: argparse.Namespace):
+        with Session() as s:
+            s.rekey_peer(args.interface, args.peer)
+        print(f'[i] Rekeyed peer "{args.peer}" (on {args.interface}).')
+        print(
+            "    Please export the peer's config again to connect using the new keys."
+        )
+        return 0
+
+
+class Group:
+    @staticmethod
+    def _members(c: Config, args: argparse.Namespace):
+        members = IfaceGroup.members(c.interfaces, args.group)
+        if not members:
+            raise InterfaceNotFoundException(
+                f'[!] Interface group "{args.group}" does not exist.'
+            )
+        return members
+
+    @staticmethod
+    def ls(_: argparse.Namespace):
+        c = Config()
+        groups = IfaceGroup.names(c.interfaces)
+        if not groups:
+            print("[i] No interface groups have been defined.")
+            return 0
+        print("[i] Showing all interface groups.")
+        for group in groups:
+            members = IfaceGroup.members(c.interfaces, group)
+            print(
+                _FMT_GROUPS.format(
+                    group=group,
+                    cidr4=members[0].net_cidr4,
+                    cidr6=members[0].net_cidr6,
+                )
+            )
+            for m in members:
+                print(
+                    _FMT_GROUP_MEMBERS.format(
+                        iface=m.vpn_iface, port=m.port, peers=len(m.peers)
+                    )
+                )
+        return 0
+
+    @staticmethod
+    def create(args: argparse.Namespace):
         c = Config()
-        iface, _ = cls._get(c, args.interface)
-        if not args.force:
-            print("Are you sure you want to remove this peer?")
-            print("This operation is irreversible!")
-            print("-> (y/N):")
-            if input().lower() != "y":
-                print("[!] Operation cancelled by user. No action taken.")
+        group = str(args.name)
+        valid, reason = Input.check_int(args.count, min_value=1, max_value=256)
+        if not valid:
+            print("[!] Count is invalid:")
+            print(reason)
+            return 1
+        # the longest member name must still be a valid interface name
+        last = wireguard.Interface.group_member(group, args.count - 1)
+        valid, reason = Input.check_iface(last)
+        if not valid:
+            print(f'[!] Group name is invalid (member "{last}"):')
+            print(reason)
+            return 1
+        if IfaceGroup.members(c.interfaces, group):
+            print("[!] A group with this name already exists!")
+            return 1
+        valid, reason = Input.check_int(
+            args.port_base, min_value=1, max_value=65536 - args.count
+        )
+        if not valid:
+            print("[!] Port base is invalid:")
+            print(reason)
+            return 1
+        cidr4 = str(args.cidr4) or IP.auto_cidr4()
+        valid, reason = Input.check_cidr4(cidr4)
+        if not valid:
+            print("[!] IPv4 CIDR block is invalid:")
+            print(reason)
+            return 1
+        cidr6 = str(args.cidr6) or IP.auto_cidr6()
+        valid, reason = Input.check_cidr6(cidr6)
+        if not valid:
+            print("[!] IPv6 CIDR block is invalid:")
+            print(reason)
+            return 1
+        ports = set(i.port for i in c.interfaces.values())
+        for i in range(args.count):
+            name = wireguard.Interface.group_member(group, i)
+            if c.interfaces.get(name):
+                print(f'[!] An interface named "{name}" already exists!')
                 return 1
-        del iface.peers[args.peer]
-        print(f'Removed peer "{args.peer}" (on {args.interface}).')
+            if args.port_base + i in ports:
+                print(f"[!] Port {args.port_base + i} is already in use!")
+                return 1
+        members = IfaceGroup.create(
+            group=group,
+            count=args.count,
+            port_base=args.port_base,
+            cidr4=cidr4,
+            cidr6=cidr6,
+            host=str(args.host),
+            addr_mode=args.addr_mode,
+        )
+        for m in members:
+            c.interfaces[m.vpn_iface] = m
         c.save()
+        print(
+            f'[i] Created group "{group}" ("{members[0].vpn_iface}" to "{members[-1].vpn_iface}").'
+        )
         return 0
 
     @classmethod
-    def rekey(cls, args: argparse.Namespace):
+    def rebalance(cls, args: argparse.Namespace):
         c = Config()
-        _, peer = cls._get(c, args)
-        peer.rekey()
+        members = cls._members(c, args)
+        moves = IfaceGroup.rebalance(members, dry_run=args.dry_run)
+        if not moves:
+            print(f'[i] Group "{args.group}" is already balanced.')
+            return 0
+        for peer, source, dest in moves:
+            print(f'[i] Peer "{peer}": "{source}" -> "{dest}"')
+        if args.dry_run:
+            print(f"[i] Would move {len(moves)} peers.")
+            return 0
         c.save()
-        print(f'[i] Rekeyed peer "{args.peer}" (on {args.interface}).')
         print(
-            "    Please export the peer's config again to connect using the new keys."
+            f"[i] Moved {len(moves)} peers. Sync the group and re-export their configs."
+        )
+        return 0
+
+
+class Cluster:
+    @staticmethod
+    def init(args: argparse.Namespace):
+        valid, reason = Input.check_iface(args.iface)
+        if not valid:
+            print("[!] Interface name is invalid:")
+            print(reason)
+            return 1
+        valid, reason = Input.check_int(args.shards, min_value=1)
+        if not valid:
+            print("[!] Shard count is invalid:")
+            print(reason)
+            return 1
+        cidr4 = str(args.cidr4) or IP.auto_cidr4()
+        valid, reason = Input.check_cidr4(cidr4)
+        if not valid:
+            print("[!] IPv4 CIDR block is invalid:")
+            print(reason)
+            return 1
+        cidr6 = str(args.cidr6) or IP.auto_cidr6()
+        valid, reason = Input.check_cidr6(cidr6)
+        if not valid:
+            print("[!] IPv6 CIDR block is invalid:")
+            print(reason)
+            return 1
+        if os.path.exists(args.layout):
+            print(f'[!] "{args.layout}" already exists.')
+            return 1
+        layout = Layout(iface=args.iface, cidr4=cidr4, cidr6=cidr6, shards=args.shards)
+        layout.save(args.layout)
+        print(
+            f'[i] Wrote cluster layout "{args.layout}" ({args.shards} shards of {layout.shards4[0]}).'
+        )
+        return 0
+
+    @staticmethod
+    def show(args: argparse.Namespace):
+        layout = Layout.load(args.layout)
+        print(f'[i] Showing cluster "{layout.iface}".')
+        print(_FMT_ATTRS.format("IPv4 Network", layout.cidr4))
+        print(_FMT_ATTRS.format("IPv6 Network", layout.cidr6))
+        print(_FMT_ATTRS.format("Shards", f"{len(layout.nodes)}/{layout.shards} used"))
+        for node in layout.nodes:
+            cidr4, cidr6 = layout.shard(node["name"])
+            print(
+                _FMT_NODES.format(
+                    name=node["name"],
+                    host=node["host"],
+                    port=node["port"],
+                    cidr4=cidr4,
+                    cidr6=cidr6,
+                )
+            )
+        return 0
+
+    @staticmethod
+    def add_node(args: argparse.Namespace):
+        layout = Layout.load(args.layout)
+        valid, reason = Input.check_peer_name(args.name)
+        if not valid:
+            print("[!] Node name is invalid:")
+            print(reason)
+            return 1
+        valid, reason = Input.check_int(args.port, min_value=1, max_value=65535)
+        if not valid:
+            print("[!] Port is invalid:")
+            print(reason)
+            return 1
+        node = layout.add_node(args.name, args.host, args.port)
+        layout.save(args.layout)
+        cidr4, cidr6 = layout.shard(node["name"])
+        print(f'[i] Added node "{node["name"]}" with shard {cidr4}, {cidr6}.')
+        return 0
+
+    @staticmethod
+    def join(args: argparse.Namespace):
+        c = Config()
+        layout = Layout.load(args.layout)
+        if c.interfaces.get(layout.iface):
+            print(f'[!] Interface "{layout.iface}" already exists on this node.')
+            return 1
+        iface = layout.create_interface(args.name)
+        c.interfaces[iface.vpn_iface] = iface
+        c.save()
+        print(
+            f'[i] Created interface "{iface.vpn_iface}" for node "{args.name}" ({iface.vpn_cidr4}, {iface.vpn_cidr6}).'
+        )
+        return 0
+
+    @staticmethod
+    def render(args: argparse.Namespace):
+        layout = Layout.load(args.layout)
+        with Profile.phase("render"):
+            written = layout.render(args.nodes_dir, args.out)
+        print(
+            f'[i] Wrote {len(written)} configs for {len(layout.nodes)} nodes to "{args.out}".'
+        )
+        return 0
+
+
+class Keepalive:
+    @staticmethod
+    def set(args: argparse.Namespace):
+        if args.peer and args.peer_class:
+            print("[!] Please specify either --peer or --class, not both.")
+            return 1
+        with Session() as s:
+            if args.peer:
+                s.set_peer(args.interface, args.peer, "keepalive", args.policy)
+                target = f'peer "{args.peer}"'
+            else:
+                s.set_keepalive(args.interface, args.policy, args.peer_class)
+                target = f'class "{args.peer_class or KeepalivePolicy.DEFAULT_CLASS}"'
+        print(f'[i] Set keepalive="{args.policy}" for {target} on {args.interface}.')
+        print("[i] Export the affected peer configs again for this to take effect.")
+        return 0
+
+    @staticmethod
+    def observe(args: argparse.Namespace):
+        c = Config()
+        iface = Iface._get(c, args)
+        dump = wireguard.CommandLine.show_dump(iface.vpn_iface)
+        count = KeepalivePolicy.observe(iface, dump)
+        c.save()
+        print(
+            f'[i] Observed {count} of {len(iface.peers)} peers on "{iface.vpn_iface}".'
+        )
+        return 0
+
+    @staticmethod
+    def report(args: argparse.Namespace):
+        c = Config.readonly(args.interface)
+        iface = Iface._get(c, args)
+        rows = KeepalivePolicy.report(iface)
+        print(f'[i] Estimated keepalive rate for "{iface.vpn_iface}" (idle peers).')
+        for source, policy, peers, rate in rows:
+            print(
+                _FMT_KEEPALIVE.format(
+                    source=source, policy=policy, peers=peers, rate=rate
+                )
+            )
+        print(
+            _FMT_KEEPALIVE.format(
+                source="total",
+                policy="",
+                peers=sum(r[2] for r in rows),
+                rate=sum(r[3] for r in rows),
+            )
+        )
+        return 0
+
+
+class Shaping:
+    @staticmethod
+    def set(args: argparse.Namespace):
+        with Session() as s:
+            s.set_rate(args.interface, args.rate, args.peer_class)
+        target = f'class "{args.peer_class}"' if args.peer_class else "the interface"
+        print(f'[i] Set rate="{args.rate}" for {target} on {args.interface}.')
+        print("[i] Restart the interface for this to take effect.")
+        return 0
+
+    @staticmethod
+    def show(args: argparse.Namespace):
+        c = Config.readonly(args.interface)
+        iface = Iface._get(c, args)
+        batch = ShapingRules.batch(
+            iface.vpn_iface, iface.vpn_cidr4, iface.shaping, iface.peers.values()
         )
+        if not batch:
+            print(f'[i] No peers on "{iface.vpn_iface}" are shaped.')
+            return 0
+        sys.stdout.write(batch)
+        return 0
+
+
+class Watch:
+    @staticmethod
+    def _apply(
+        ifaces: list[wireguard.Interface], state: SyncState, reload: bool
+    ) -> int:
+        """
+        Installs the configs of `ifaces` that differ from what is installed,
+        and applies them to the running interfaces in place (or reloads them,
+        if in-place updates fail or `reload` is set). Returns the number of
+        interfaces installed.
+        """
+        install, confs, _ = Iface._render_many(ifaces, state)
+        if not install:
+            return 0
+        action = "reload" if reload else "apply"
+        results = wireguard.CommandLine.run_helper(
+            {
+                "install": install,
+                "services": list(
+                    {"iface": i["iface"], "action": action} for i in install
+                ),
+            }
+        )
+        fallback: list[dict] = []
+        for r in results:
+            if r["step"] == "install" and r["ok"]:
+                state.update(r["iface"], confs[r["iface"]])
+            elif not r["ok"]:
+                _logger.warning(
+                    f'{r["step"]}: interface "{r["iface"]}" failed: {r["error"]}'
+                )
+                if r["step"] == "apply":
+                    fallback.append({"iface": r["iface"], "action": "reload"})
+        if fallback:
+            for r in wireguard.CommandLine.run_helper({"services": fallback}):
+                if not r["ok"]:
+                    _logger.warning(
+                        f'reload: interface "{r["iface"]}" failed: {r["error"]}'
+                    )
+        state.save()
+        return len(install)
+
+    @staticmethod
+    def run(args: argparse.Namespace):
+        c = Config()
+        state = SyncState()
+        watcher = Watcher(
+            defaults.CONFIG_DIR,
+            INTERFACES_FILE,
+            debounce=args.debounce,
+            max_delay=args.max_delay,
+            poll=args.poll,
+        )
+        mode = "polling" if watcher.polling else "inotify"
+        print(f'[i] Watching "{defaults.CONFIG_DIR}" ({mode}). Press Ctrl+C to stop.')
+        try:
+            # catch up with changes made while not watching
+            Watch._apply(
+                watcher.changed(list(c.interfaces.values())), state, args.reload
+            )
+            while True:
+                change = watcher.wait()
+                if change is None:
+                    continue
+                first, count = change
+                try:
+                    c.reload()
+                except (ValueError, KeyError, ExitException) as e:
+                    # most likely caught in the middle of a write, which
+                    # will be followed by another change
+                    _logger.warning(f"Could not read the config: {str(e)}")
+                    continue
+                changed = watcher.changed(list(c.interfaces.values()))
+                applied = Watch._apply(changed, state, args.reload)
+                latency = (time.monotonic() - first) * 1000
+                _logger.info(
+                    f"{count} change(s), {len(changed)} interface(s) changed, "
+                    f"{applied} applied, {latency:.0f} ms after the first change."
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+        return 0
+
+
+class Keys:
+    @staticmethod
+    def _generate(_: int):
+        private_key = wireguard.CommandLine.generate_private_key()
+        public_key = wireguard.CommandLine.generate_public_key(private_key)
+        preshared_key = wireguard.CommandLine.generate_preshared_key()
+        return private_key, public_key, preshared_key
+
+    @classmethod
+    def fill(cls, args: argparse.Namespace):
+        if args.target is not None:
+            count = max(0, int(args.target) - KeyPool.size())
+        else:
+            count = int(args.count)
+        valid, reason = Input.check_int(count, min_value=0)
+        if not valid:
+            print("[!] Count is invalid:")
+            print(reason)
+            return 1
+        # key generation is subprocess-bound, so threads overlap it well
+        with ThreadPoolExecutor(args.jobs) as pool:
+            keys = pool.map(cls._generate, range(count))
+            batch: list[tuple[str, str, str]] = []
+            for triple in keys:
+                batch.append(triple)
+                if len(batch) == 100:
+                    KeyPool.put(batch)
+                    batch = []
+            if batch:
+                KeyPool.put(batch)
+        print(f"[i] Added {count} keys to the pool ({KeyPool.size()} available).")
+        return 0
+
+    @staticmethod
+    def status(_: argparse.Namespace):
+        print(f"[i] {KeyPool.size()} keys available in the pool.")
         return 0
 
 
@@ -522,10 +1143,30 @@ class Version:
         return 0
 
 
+def add_listing_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--format", choices=FORMATS, default="table")
+    parser.add_argument(
+        "--filter", type=str, default=None, help="Name glob or CIDR to match"
+    )
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--offset", type=int, default=0)
+
+
 @staticmethod
 def get_parser():
     # root
     root = argparse.ArgumentParser(defaults.PROG)
+    root.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print a timing breakdown when the command finishes (or set WGUP_PROFILE=1)",
+    )
+    root.add_argument(
+        "--profile-out",
+        type=str,
+        default=None,
+        help="Dump cProfile stats to this file (or set WGUP_PROFILE_OUT)",
+    )
     root_sub = root.add_subparsers(title="subcommands", required=True)
 
     # iface.*
@@ -535,6 +1176,7 @@ def get_parser():
     # iface.ls
     interface_ls = iface_sub.add_parser("ls", help="List all interfaces")
     interface_ls.set_defaults(func=Iface.ls)
+    add_listing_args(interface_ls)
 
     # iface.create
     iface_create = iface_sub.add_parser("create", help="Create an interface")
@@ -545,12 +1187,44 @@ def get_parser():
     iface_create.add_argument("--nat_iface", type=str, default="")
     iface_create.add_argument("--host", type=str, required=True)
     iface_create.add_argument("--port", type=int, required=True)
+    iface_create.add_argument(
+        "--addr-mode",
+        choices=wireguard.Interface.ADDR_MODES,
+        default="independent",
+        help="How peers' IPv6 addresses are chosen",
+    )
+    iface_create.add_argument(
+        "--key-mode",
+        choices=wireguard.Interface.KEY_MODES,
+        default="stored",
+        help="Whether peer keys are stored or derived from a seed",
+    )
+
+    # iface.import
+    iface_import = iface_sub.add_parser(
+        "import", help="Import an existing wg-quick config"
+    )
+    iface_import.set_defaults(func=Iface.import_)
+    iface_import.add_argument("filename", type=str)
+    iface_import.add_argument(
+        "--name", type=str, default="", help="Defaults to the file name"
+    )
+    iface_import.add_argument("--host", type=str, required=True)
+    iface_import.add_argument("--port", type=int, help="Defaults to ListenPort")
 
     # iface.show
     iface_show = iface_sub.add_parser("show", help="Show details for an interface")
     iface_show.set_defaults(func=Iface.show)
     iface_show.add_argument("interface", type=str)
 
+    # iface.capacity
+    iface_capacity = iface_sub.add_parser(
+        "capacity", help="Show how full the address pools of interfaces are"
+    )
+    iface_capacity.set_defaults(func=Iface.capacity)
+    iface_capacity.add_argument("interface", type=str, nargs="*")
+    iface_capacity.add_argument("--all", action="store_true", help="All interfaces")
+
     # iface.set
     iface_set = iface_sub.add_parser("set", help="Set parameters for an interface")
     iface_set.set_defaults(func=Iface.set)
@@ -574,24 +1248,27 @@ def get_parser():
 
     # iface.up
     iface_up = iface_sub.add_parser(
-        "up", help="Bring an interface up and enable its systemd target"
+        "up", help="Bring interfaces up and enable their systemd targets"
     )
     iface_up.set_defaults(func=Iface.up)
-    iface_up.add_argument("interface", type=str)
+    iface_up.add_argument("interface", type=str, nargs="*")
+    iface_up.add_argument("--all", action="store_true", help="All interfaces")
 
     # iface.down
     iface_down = iface_sub.add_parser(
-        "down", help="Bring an interface down and disable its systemd target"
+        "down", help="Bring interfaces down and disable their systemd targets"
     )
     iface_down.set_defaults(func=Iface.down)
-    iface_down.add_argument("interface", type=str)
+    iface_down.add_argument("interface", type=str, nargs="*")
+    iface_down.add_argument("--all", action="store_true", help="All interfaces")
 
     # iface.reload
     iface_reload = iface_sub.add_parser(
-        "reload", help="Tell systemd to reload an interface's config"
+        "reload", help="Tell systemd to reload interfaces' configs"
     )
     iface_reload.set_defaults(func=Iface.reload)
-    iface_reload.add_argument("interface", type=str)
+    iface_reload.add_argument("interface", type=str, nargs="*")
+    iface_reload.add_argument("--all", action="store_true", help="All interfaces")
 
     # iface.rekey
     iface_rekey = iface_sub.add_parser(
@@ -599,13 +1276,38 @@ def get_parser():
     )
     iface_rekey.set_defaults(func=Iface.rekey)
     iface_rekey.add_argument("interface", type=str)
+    iface_rekey.add_argument(
+        "--staged",
+        action="store_true",
+        help="Rekey peers in batches, applying each batch live (resumable)",
+    )
+    iface_rekey.add_argument("--batch-size", type=int, default=100)
+    iface_rekey.add_argument(
+        "--concurrency", type=int, default=4, help="Peers rekeyed in parallel"
+    )
+    iface_rekey.add_argument(
+        "--interval", type=float, default=60.0, help="Seconds between batches"
+    )
+    iface_rekey.add_argument(
+        "--no-apply", action="store_true", help="Do not apply batches live"
+    )
+    iface_rekey.add_argument(
+        "--cancel", action="store_true", help="Cancel a staged rekey"
+    )
 
     # iface.sync
     iface_sync = iface_sub.add_parser(
-        "sync", help="Update an interface's config in /etc/wireguard"
+        "sync", help="Update interfaces' configs in /etc/wireguard"
     )
     iface_sync.set_defaults(func=Iface.sync)
-    iface_sync.add_argument("interface", type=str)
+    iface_sync.add_argument("interface", type=str, nargs="*")
+    iface_sync.add_argument("--all", action="store_true", help="All interfaces")
+    iface_sync.add_argument(
+        "--reload", action="store_true", help="Reload interfaces after syncing"
+    )
+    iface_sync.add_argument(
+        "--force", action="store_true", help="Sync even if configs are unchanged"
+    )
 
     # peer.*
     peer = root_sub.add_parser("peer", help="Manage peers")
@@ -615,6 +1317,7 @@ def get_parser():
     peer_ls = peer_sub.add_parser("ls", help="Show peers defined for an interface")
     peer_ls.set_defaults(func=Peer.ls)
     peer_ls.add_argument("interface", type=str)
+    add_listing_args(peer_ls)
 
     # peer.create
     peer_create = peer_sub.add_parser(
@@ -625,6 +1328,9 @@ def get_parser():
     peer_create.add_argument("name", type=str, default="")
     peer_create.add_argument("--cidr4", type=str, default="")
     peer_create.add_argument("--cidr6", type=str, default="")
+    peer_create.add_argument(
+        "--count", type=int, help="Create this many peers, numbered after the name"
+    )
 
     # peer.show
     peer_show = peer_sub.add_parser("show", help="Show details for a peer")
@@ -639,6 +1345,14 @@ def get_parser():
     peer_export.add_argument("peer", type=str)
     peer_export.add_argument("-f", "--filename", type=str)
 
+    # peer.export-all
+    peer_export_all = peer_sub.add_parser(
+        "export-all", help="Export config files for all peers of an interface"
+    )
+    peer_export_all.set_defaults(func=Peer.export_all)
+    peer_export_all.add_argument("interface", type=str)
+    peer_export_all.add_argument("--out", type=str, required=True)
+
     # peer.set
     peer_set = peer_sub.add_parser("set")
     peer_set.set_defaults(func=Peer.set)
@@ -660,6 +1374,28 @@ def get_parser():
     peer_rekey.add_argument("interface", type=str)
     peer_rekey.add_argument("peer", type=str)
 
+    # peer.reap
+    peer_reap = peer_sub.add_parser(
+        "reap", help="Disable or remove peers without recent handshakes"
+    )
+    peer_reap.set_defaults(func=Peer.reap)
+    peer_reap.add_argument("interface", type=str)
+    peer_reap.add_argument(
+        "--idle",
+        type=str,
+        required=True,
+        help="How long a peer must have been idle (e.g. 30d, 12h)",
+    )
+    peer_reap.add_argument(
+        "--remove", action="store_true", help="Remove idle peers instead of disabling"
+    )
+    peer_reap.add_argument(
+        "--dry-run", action="store_true", help="Only report what would be done"
+    )
+    peer_reap.add_argument(
+        "--no-apply", action="store_true", help="Do not apply the changes live"
+    )
+
     # nat.*
     nat = root_sub.add_parser("nat", help="Manage NATs")
     nat_sub = nat.add_subparsers(title="subcommands", required=True)
@@ -678,6 +1414,185 @@ def get_parser():
     nat_rm.add_argument("--cidr4", type=str, default="")
     nat_rm.add_argument("--cidr6", type=str, default="")
 
+    # keepalive.*
+    keepalive = root_sub.add_parser("keepalive", help="Manage keepalive policies")
+    keepalive_sub = keepalive.add_subparsers(title="subcommands", required=True)
+
+    # keepalive.set
+    keepalive_set = keepalive_sub.add_parser(
+        "set", help="Set the keepalive policy of an interface, class or peer"
+    )
+    keepalive_set.set_defaults(func=Keepalive.set)
+    keepalive_set.add_argument("interface", type=str)
+    keepalive_set.add_argument(
+        "policy", type=str, help='"off", "auto", seconds, or "default"'
+    )
+    keepalive_set.add_argument("--class", dest="peer_class", type=str, default="")
+    keepalive_set.add_argument("--peer", type=str, default="")
+
+    # keepalive.observe
+    keepalive_observe = keepalive_sub.add_parser(
+        "observe", help="Record peer endpoints from the running interface"
+    )
+    keepalive_observe.set_defaults(func=Keepalive.observe)
+    keepalive_observe.add_argument("interface", type=str)
+
+    # keepalive.report
+    keepalive_report = keepalive_sub.add_parser(
+        "report", help="Estimate the keepalive packet rate of an interface"
+    )
+    keepalive_report.set_defaults(func=Keepalive.report)
+    keepalive_report.add_argument("interface", type=str)
+
+    # shaping.*
+    shaping = root_sub.add_parser("shaping", help="Manage rate limits for peers")
+    shaping_sub = shaping.add_subparsers(title="subcommands", required=True)
+
+    # shaping.set
+    shaping_set = shaping_sub.add_parser(
+        "set", help="Set the rate limit of an interface or a class of peers"
+    )
+    shaping_set.set_defaults(func=Shaping.set)
+    shaping_set.add_argument("interface", type=str)
+    shaping_set.add_argument("rate", type=str, help='e.g. "100mbit", or "off"')
+    shaping_set.add_argument("--class", dest="peer_class", type=str, default="")
+
+    # shaping.show
+    shaping_show = shaping_sub.add_parser(
+        "show", help="Print the tc batch that applies the rate limits"
+    )
+    shaping_show.set_defaults(func=Shaping.show)
+    shaping_show.add_argument("interface", type=str)
+
+    # watch
+    watch = root_sub.add_parser(
+        "watch", help="Apply config changes to running interfaces as they happen"
+    )
+    watch.set_defaults(func=Watch.run)
+    watch.add_argument(
+        "--debounce",
+        type=float,
+        default=DEBOUNCE,
+        help="Seconds without changes before applying them",
+    )
+    watch.add_argument(
+        "--max-delay",
+        type=float,
+        default=MAX_DELAY,
+        help="Longest a change waits while more changes keep coming",
+    )
+    watch.add_argument(
+        "--poll", action="store_true", help="Poll the config instead of using inotify"
+    )
+    watch.add_argument(
+        "--reload",
+        action="store_true",
+        help="Reload interfaces instead of updating them in place",
+    )
+
+    # keys.*
+    keys = root_sub.add_parser("keys", help="Manage the pre-generated key pool")
+    keys_sub = keys.add_subparsers(title="subcommands", required=True)
+
+    # keys.fill
+    keys_fill = keys_sub.add_parser("fill", help="Generate keys into the pool")
+    keys_fill.set_defaults(func=Keys.fill)
+    keys_fill_count = keys_fill.add_mutually_exclusive_group(required=True)
+    keys_fill_count.add_argument("--count", type=int, help="Number of keys to add")
+    keys_fill_count.add_argument(
+        "--target", type=int, help="Top the pool up to this many keys"
+    )
+    keys_fill.add_argument("-j", "--jobs", type=int, default=8)
+
+    # keys.status
+    keys_status = keys_sub.add_parser("status", help="Show the size of the pool")
+    keys_status.set_defaults(func=Keys.status)
+
+    # group.*
+    group = root_sub.add_parser("group", help="Manage interface groups")
+    group_sub = group.add_subparsers(title="subcommands", required=True)
+
+    # group.ls
+    group_ls = group_sub.add_parser("ls", help="List all interface groups")
+    group_ls.set_defaults(func=Group.ls)
+
+    # group.create
+    group_create = group_sub.add_parser(
+        "create", help="Create a group of interfaces sharing one network"
+    )
+    group_create.set_defaults(func=Group.create)
+    group_create.add_argument("name", type=str)
+    group_create.add_argument("--count", type=int, required=True)
+    group_create.add_argument("--port-base", type=int, required=True)
+    group_create.add_argument("--host", type=str, required=True)
+    group_create.add_argument("--cidr4", type=str, default="")
+    group_create.add_argument("--cidr6", type=str, default="")
+    group_create.add_argument(
+        "--addr-mode",
+        choices=wireguard.Interface.ADDR_MODES,
+        default="independent",
+    )
+
+    # group.rebalance
+    group_rebalance = group_sub.add_parser(
+        "rebalance", help="Even out peer counts across a group"
+    )
+    group_rebalance.set_defaults(func=Group.rebalance)
+    group_rebalance.add_argument("group", type=str)
+    group_rebalance.add_argument("--dry-run", action="store_true")
+
+    # cluster.*
+    cluster = root_sub.add_parser(
+        "cluster", help="Share one network between several gateway nodes"
+    )
+    cluster_sub = cluster.add_subparsers(title="subcommands", required=True)
+
+    # cluster.init
+    cluster_init = cluster_sub.add_parser("init", help="Create a cluster layout")
+    cluster_init.set_defaults(func=Cluster.init)
+    cluster_init.add_argument("layout", type=str)
+    cluster_init.add_argument("--iface", type=str, default="wg0")
+    cluster_init.add_argument("--cidr4", type=str, default="")
+    cluster_init.add_argument("--cidr6", type=str, default="")
+    cluster_init.add_argument("--shards", type=int, default=16)
+
+    # cluster.show
+    cluster_show = cluster_sub.add_parser("show", help="Show nodes and their shards")
+    cluster_show.set_defaults(func=Cluster.show)
+    cluster_show.add_argument("layout", type=str)
+
+    # cluster.add-node
+    cluster_add_node = cluster_sub.add_parser(
+        "add-node", help="Add a node and assign it a shard"
+    )
+    cluster_add_node.set_defaults(func=Cluster.add_node)
+    cluster_add_node.add_argument("layout", type=str)
+    cluster_add_node.add_argument("name", type=str)
+    cluster_add_node.add_argument("--host", type=str, required=True)
+    cluster_add_node.add_argument("--port", type=int, default=51820)
+
+    # cluster.join
+    cluster_join = cluster_sub.add_parser(
+        "join", help="Create this node's interface from the layout"
+    )
+    cluster_join.set_defaults(func=Cluster.join)
+    cluster_join.add_argument("layout", type=str)
+    cluster_join.add_argument("name", type=str)
+
+    # cluster.render
+    cluster_render = cluster_sub.add_parser(
+        "render", help="Render interface and peer configs for every node"
+    )
+    cluster_render.set_defaults(func=Cluster.render)
+    cluster_render.add_argument("layout", type=str)
+    cluster_render.add_argument(
+        "--nodes-dir",
+        type=str,
+        required=True,
+        help="Directory with a copy of each node's config directory, by node name",
+    )
+    cluster_render.add_argument("--out", type=str, required=True)
+
     # version
     version = root_sub.add_parser("version", help="Show version information")
     version.set_defaults(func=Version.display)
@@ -688,9 +1603,14 @@ def get_parser():
 def entrypoint():
     parser = get_parser()
     args = parser.parse_args(sys.argv[1:])
+    profile, profile_out = Profile.requested(args.profile, args.profile_out)
+    if profile:
+        Profile.start(profile_out)
     try:
         status = int(args.func(args))
         return status
     except ExitException as e:
         print(str(e))
         return 1
+    finally:
+        Profile.stop()
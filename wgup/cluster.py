@@ -0,0 +1,201 @@
+import json
+import os
+
+from wgup import jsonstream
+from wgup.keystore import KEYSTORE_FILE, Keystore
+from wgup.mesh import Mesh
+from wgup.util import IP, ClusterException, write_private
+from wgup.wireguard import Interface
+
+LAYOUT_VERSION = 1
+
+CONFIG_GATEWAY_PEER = """
+# Gateway "{name}"
+[Peer]
+PublicKey = {public_key}
+AllowedIPs = {cidr4}
+AllowedIPs = {cidr6}
+Endpoint = {endpoint}
+PersistentKeepalive = 25
+"""
+
+
+class Layout:
+    """
+    A cluster layout splits one supernet into equal shards and assigns one
+    shard to each gateway node. Every node runs the same interface, but its
+    allocator only hands out addresses from its own shard, so nodes can
+    create peers without coordinating with each other.
+
+    The layout is a plain JSON file that is copied to every node:
+
+        {
+            "version": 1,
+            "iface": "wg0",
+            "cidr4": "10.8.0.0/16",
+            "cidr6": "fd00:8::/64",
+            "shards": 16,
+            "nodes": [{"name": "gw1", "host": "gw1.example.com", "port": 51820, "shard": 0}, ...]
+        }
+    """
+
+    def __init__(
+        self,
+        *,
+        iface: str,
+        cidr4: str,
+        cidr6: str,
+        shards: int,
+        nodes: list[dict] | None = None,
+    ):
+        self.iface = iface
+        self.cidr4 = cidr4
+        self.cidr6 = cidr6
+        self.shards = shards
+        if nodes is None:
+            nodes = []
+        self.nodes = nodes
+        # fail early if the supernet cannot hold this many shards
+        self.shards4 = IP.split(cidr4, shards)
+        self.shards6 = IP.split(cidr6, shards)
+
+    def node(self, name: str) -> dict:
+        for node in self.nodes:
+            if node["name"] == name:
+                return node
+        raise ClusterException(f'[!] Node "{name}" is not part of the cluster.')
+
+    def add_node(self, name: str, host: str, port: int) -> dict:
+        """
+        Adds a node and assigns it the lowest free shard.
+        """
+        if any(n["name"] == name for n in self.nodes):
+            raise ClusterException(f'[!] Node "{name}" is already part of the cluster.')
+        used = set(n["shard"] for n in self.nodes)
+        free = list(i for i in range(self.shards) if i not in used)
+        if not free:
+            raise ClusterException(f"[!] All {self.shards} shards are in use.")
+        node = {"name": name, "host": host, "port": port, "shard": free[0]}
+        self.nodes.append(node)
+        return node
+
+    def shard(self, name: str) -> tuple[str, str]:
+        """
+        Returns the IPv4 and IPv6 pools of the given node.
+        """
+        index = self.node(name)["shard"]
+        return self.shards4[index], self.shards6[index]
+
+    def create_interface(self, name: str) -> Interface:
+        """
+        Creates the interface for the given node. Its pools are the node's
+        shard, while its peers route the whole supernet.
+        """
+        node = self.node(name)
+        cidr4, cidr6 = self.shard(name)
+        iface = Interface.create(
+            vpn_iface=self.iface,
+            vpn_cidr4=cidr4,
+            vpn_cidr6=cidr6,
+            host=node["host"],
+            port=node["port"],
+        )
+        iface.net_cidr4 = self.cidr4
+        iface.net_cidr6 = self.cidr6
+        return iface
+
+    def load_node(self, config_dir: str, name: str) -> Interface:
+        """
+        Loads the cluster interface from a node's config directory.
+        """
+        filename = f"{config_dir}/interfaces.json"
+        keystore = Keystore(f"{config_dir}/{KEYSTORE_FILE}")
+        if os.path.exists(filename):
+            for iface in jsonstream.iter_interfaces(filename, {self.iface}, keystore):
+                return iface
+        raise ClusterException(
+            f'[!] Node "{name}" has no interface "{self.iface}" in "{config_dir}".'
+        )
+
+    def render(self, nodes_dir: str, out_dir: str) -> list[str]:
+        """
+        Renders the interface config and all peer configs of every node,
+        reading each node's config from nodes_dir/<node>. Interface configs
+        include the other gateways as peers (routing their shards), so peers
+        on different nodes can reach each other. Configs are written to
+        out_dir/<node>/<iface>.conf and out_dir/<node>/peers/<peer>.conf.
+        Returns the paths of all written files.
+        """
+        ifaces: dict[str, Interface] = {}
+        for node in self.nodes:
+            iface = self.load_node(f"{nodes_dir}/{node['name']}", node["name"])
+            cidr4, cidr6 = self.shard(node["name"])
+            if (iface.vpn_cidr4, iface.vpn_cidr6) != (cidr4, cidr6):
+                raise ClusterException(
+                    f'[!] Node "{node["name"]}" does not use its shard ({cidr4}, {cidr6}).'
+                )
+            ifaces[node["name"]] = iface
+        written: list[str] = []
+        for node in self.nodes:
+            iface = ifaces[node["name"]]
+            node_dir = f"{out_dir}/{node['name']}"
+            os.makedirs(f"{node_dir}/peers", mode=0o700, exist_ok=True)
+            gateways = "".join(
+                CONFIG_GATEWAY_PEER.format(
+                    name=other["name"],
+                    public_key=ifaces[other["name"]].public_key,
+                    cidr4=ifaces[other["name"]].vpn_cidr4,
+                    cidr6=ifaces[other["name"]].vpn_cidr6,
+                    endpoint=f"{other['host']}:{other['port']}",
+                )
+                for other in self.nodes
+                if other is not node
+            )
+            written.append(
+                write_private(
+                    f"{node_dir}/{self.iface}.conf", iface.get_config() + gateways
+                )
+            )
+            mesh = Mesh(iface)
+            for peer in iface.peers.values():
+                conf = mesh.peer_config(peer, node["host"], node["port"])
+                written.append(
+                    write_private(f"{node_dir}/peers/{peer.name}.conf", conf)
+                )
+        return written
+
+    def to_json(self):
+        return {
+            "version": LAYOUT_VERSION,
+            "iface": self.iface,
+            "cidr4": self.cidr4,
+            "cidr6": self.cidr6,
+            "shards": self.shards,
+            "nodes": self.nodes,
+        }
+
+    @classmethod
+    def from_json(cls, data: dict):
+        if data.get("version") != LAYOUT_VERSION:
+            raise ClusterException("[!] Incompatible cluster layout version.")
+        return cls(
+            iface=data["iface"],
+            cidr4=data["cidr4"],
+            cidr6=data["cidr6"],
+            shards=int(data["shards"]),
+            nodes=data["nodes"],
+        )
+
+    @classmethod
+    def load(cls, filename: str):
+        try:
+            with open(filename, "r") as f:
+                return cls.from_json(json.loads(f.read()))
+        except (OSError, ValueError, KeyError) as e:
+            raise ClusterException(
+                f'[!] Could not read cluster layout "{filename}": {str(e)}'
+            )
+
+    def save(self, filename: str):
+        with open(filename, "w") as f:
+            f.write(json.dumps(self.to_json(), indent=2))
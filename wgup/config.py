@@ -1,12 +1,23 @@
+import fcntl
+import hashlib
 import json
 import logging
 import os
 
-from wgup import defaults
-from wgup.util import ConfigVersionException
+from wgup import defaults, jsonstream
+from wgup.keystore import KEYSTORE_FILE, InterfaceKeys, Keystore
+from wgup.perf import Profile
+from wgup.snapshot import SNAPSHOT_FILE, Key, Snapshot
+from wgup.util import ConfigVersionException, ExitException
 from wgup.wireguard import Interface
 
-_CONFIG_INTERFACES = f"{defaults.CONFIG_DIR}/interfaces.json"
+INTERFACES_FILE = "interfaces.json"
+LOCK_FILE = "interfaces.lock"
+_CONFIG_INTERFACES = f"{defaults.CONFIG_DIR}/{INTERFACES_FILE}"
+_CONFIG_SYNC_STATE = f"{defaults.CONFIG_DIR}/sync_state.json"
+
+# Configs larger than this are loaded incrementally (see wgup.jsonstream).
+INCREMENTAL_LOAD_SIZE = 16 * 1024 * 1024
 
 _logger = logging.getLogger(defaults.PROG)
 
@@ -20,27 +31,170 @@ class Config:
             cls._instance._setup()
         return cls._instance
 
-    def _setup(self):
+    @classmethod
+    def readonly(cls, *names: str):
+        """
+        Returns the config, loading only the named interfaces if it has not
+        been loaded yet. A config loaded this way cannot be saved.
+        """
+        if cls._instance is None:
+            cls._instance = super(Config, cls).__new__(cls)
+            cls._instance._setup(set(names))
+        return cls._instance
+
+    @classmethod
+    def fresh(cls):
+        """
+        Returns a config of its own, read from disk and not shared with the
+        one returned by Config().
+        """
+        config = super(Config, cls).__new__(cls)
+        config._setup()
+        return config
+
+    def _setup(self, only: set[str] | None = None):
         self.interfaces: dict[str, Interface] = {}
+        self.partial = only is not None
         os.makedirs(defaults.CONFIG_DIR, exist_ok=True)
-        self.load()
+        self.load(only)
+
+    @staticmethod
+    def _stat() -> tuple[int, int, int] | None:
+        try:
+            st = os.stat(_CONFIG_INTERFACES)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def changed(self) -> bool:
+        """
+        Whether interfaces.json was written since the config was loaded or
+        saved, e.g. by another process.
+        """
+        return self._stat() != self.loaded_stat
 
-    def load(self):
-        if not os.path.exists(_CONFIG_INTERFACES):
+    def lock(self):
+        """
+        Takes an exclusive lock on the config, which other processes take
+        before changing it too, and returns the file that holds it. Closing
+        the file releases the lock.
+        """
+        filename = os.path.join(os.path.dirname(_CONFIG_INTERFACES), LOCK_FILE)
+        f = os.fdopen(os.open(filename, os.O_RDWR | os.O_CREAT, 0o600), "r+b")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return f
+
+    def load(self, only: set[str] | None = None):
+        config_dir = os.path.dirname(_CONFIG_INTERFACES)
+        # Keys are kept in the keystore next to interfaces.json since config
+        # version 2, and only read when they are used
+        self.keystore = Keystore(os.path.join(config_dir, KEYSTORE_FILE))
+        self.snapshot = Snapshot(os.path.join(config_dir, SNAPSHOT_FILE))
+        # taken first: a write while loading shows up as a change later
+        self.loaded_stat = self._stat()
+        if self.loaded_stat is None:
             return
+        with Profile.phase("Config.load"):
+            interfaces = self.snapshot.load(_CONFIG_INTERFACES, only, self.keystore)
+            if interfaces is not None:
+                for interface in interfaces:
+                    self.interfaces[interface.vpn_iface] = interface
+                return
+            # the snapshot is missing or stale, so it is rebuilt while loading
+            key = Snapshot.key(_CONFIG_INTERFACES)
+            if os.path.getsize(_CONFIG_INTERFACES) >= INCREMENTAL_LOAD_SIZE:
+                self._load_incremental(only, key)
+            else:
+                self._load(only, key)
+
+    def _load(self, only: set[str] | None = None, key: Key | None = None):
         with open(_CONFIG_INTERFACES, "rb") as f:
             networks_json = json.loads(f.read())
-        if networks_json["version"] != defaults.CONFIG_VERSION:
+        version = networks_json["version"]
+        if version not in defaults.CONFIG_VERSIONS_READ:
             raise ConfigVersionException("[!] Incompatible config version.")
+        if key is not None:
+            self.snapshot.save(key, version, networks_json["interfaces"])
         for n in networks_json["interfaces"]:
-            interface = Interface.from_json(n)
+            if only is not None and n["vpn_iface"] not in only:
+                continue
+            secrets = None
+            if version >= 2:
+                secrets = InterfaceKeys(self.keystore, n["vpn_iface"])
+            interface = Interface.from_json(n, secrets)
             self.interfaces[interface.vpn_iface] = interface
 
+    def reload(self):
+        """
+        Discards the loaded interfaces and reads the config again.
+        """
+        self.interfaces = {}
+        self.load()
+
+    def _load_incremental(self, only: set[str] | None = None, key: Key | None = None):
+        writer = self.snapshot.writer(key) if key is not None else None
+        try:
+            for interface in jsonstream.iter_interfaces(
+                _CONFIG_INTERFACES, only, self.keystore, writer
+            ):
+                self.interfaces[interface.vpn_iface] = interface
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            raise
+
     def save(self):
+        if self.partial:
+            raise ExitException("[!] Cannot save a partially loaded config.")
+        with Profile.phase("Config.save"):
+            self._save()
+
+    def _save(self):
+        # keys first, so that interfaces.json never refers to missing keys
+        self.keystore.save(self.interfaces.values())
         interfaces_json = {
             "version": defaults.CONFIG_VERSION,
-            "interfaces": list(i[1].to_json() for i in sorted(self.interfaces.items())),
+            "interfaces": list(
+                i[1].to_json(secrets=False) for i in sorted(self.interfaces.items())
+            ),
         }
-        with open(_CONFIG_INTERFACES, "w") as f:
-            f.write(json.dumps(interfaces_json, indent=4))
+        raw = json.dumps(interfaces_json, indent=4).encode("utf-8")
+        # replaced at once, so that readers that do not lock never see half
+        temp_filename = f"{_CONFIG_INTERFACES}.tmp"
+        with open(temp_filename, "wb") as f:
+            f.write(raw)
+        os.replace(temp_filename, _CONFIG_INTERFACES)
+        self.loaded_stat = self._stat()
         _logger.debug("Saved configuration.")
+        self.snapshot.save(
+            Snapshot.key(_CONFIG_INTERFACES, raw),
+            interfaces_json["version"],
+            interfaces_json["interfaces"],
+        )
+
+
+class SyncState:
+    """
+    Digests of the configs last installed to /etc/wireguard, so that syncing
+    an unchanged interface can be skipped.
+    """
+
+    def __init__(self):
+        self.digests: dict[str, str] = {}
+        if os.path.exists(_CONFIG_SYNC_STATE):
+            with open(_CONFIG_SYNC_STATE, "r") as f:
+                self.digests = json.loads(f.read())
+
+    @staticmethod
+    def digest(iface_conf: str) -> str:
+        return hashlib.sha256(iface_conf.encode("utf-8")).hexdigest()
+
+    def unchanged(self, if_name: str, iface_conf: str) -> bool:
+        return self.digests.get(if_name) == self.digest(iface_conf)
+
+    def update(self, if_name: str, iface_conf: str):
+        self.digests[if_name] = self.digest(iface_conf)
+
+    def save(self):
+        with open(_CONFIG_SYNC_STATE, "w") as f:
+            f.write(json.dumps(self.digests, indent=4, sort_keys=True))
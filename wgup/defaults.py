@@ -3,5 +3,7 @@ import os
 PROG = "wgup"
 VERSION = "0.0.0-alpha.10"
 
-CONFIG_VERSION = 1
+CONFIG_VERSION = 2
+# Configs of these versions are still read (and saved as CONFIG_VERSION)
+CONFIG_VERSIONS_READ = (1, 2)
 CONFIG_DIR = f"{os.path.expanduser("~")}/.wgup"
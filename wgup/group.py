@@ -0,0 +1,144 @@
+import heapq
+
+from wgup.util import IP, PeerExistsException, PoolExhaustedException
+from wgup.wireguard import Interface
+
+
+class Group:
+    """
+    An interface group spreads one logical network over several interfaces
+    (wg-{group}0, wg-{group}1, ...), each with its own listen port and an
+    equal sub-pool of the group's supernet. Handshakes and crypto for the
+    group are then spread over several kernel queues and CPU cores, while
+    every peer still routes the whole supernet.
+
+    Membership is stored on the interfaces themselves (Interface.group,
+    Interface.group_size and Interface.net_cidr4/6), so a group needs no state
+    of its own.
+    """
+
+    @staticmethod
+    def members(interfaces: dict[str, Interface], group: str) -> list[Interface]:
+        """
+        Returns the members of `group`, ordered by their index.
+        """
+        found = list(i for i in interfaces.values() if i.group == group)
+        prefix = len(Interface.group_member(group, 0)) - 1
+        return sorted(found, key=lambda i: int(i.vpn_iface[prefix:]))
+
+    @staticmethod
+    def names(interfaces: dict[str, Interface]) -> list[str]:
+        return sorted(set(i.group for i in interfaces.values() if i.group))
+
+    @staticmethod
+    def create(
+        *,
+        group: str,
+        count: int,
+        port_base: int,
+        cidr4: str,
+        cidr6: str,
+        host: str,
+        addr_mode: str = "independent",
+    ) -> list[Interface]:
+        """
+        Creates `count` member interfaces with consecutive ports starting at
+        `port_base`, carving their sub-pools out of cidr4 and cidr6.
+        """
+        pools4 = IP.split(cidr4, count)
+        pools6 = IP.split(cidr6, count)
+        members: list[Interface] = []
+        for i, (pool4, pool6) in enumerate(zip(pools4, pools6)):
+            iface = Interface.create(
+                vpn_iface=Interface.group_member(group, i),
+                vpn_cidr4=pool4,
+                vpn_cidr6=pool6,
+                host=host,
+                port=port_base + i,
+            )
+            iface.addr_mode = addr_mode
+            iface.group = group
+            iface.group_size = count
+            iface.net_cidr4 = cidr4
+            iface.net_cidr6 = cidr6
+            members.append(iface)
+        return members
+
+    @staticmethod
+    def place(members: list[Interface], count: int) -> list[Interface]:
+        """
+        Returns a member for each of `count` new peers, always picking the
+        member with the fewest peers (counting the ones placed so far).
+        """
+        heap = list((len(m.peers), i) for i, m in enumerate(members))
+        heapq.heapify(heap)
+        placed: list[Interface] = []
+        for _ in range(count):
+            load, i = heapq.heappop(heap)
+            placed.append(members[i])
+            heapq.heappush(heap, (load + 1, i))
+        return placed
+
+    @staticmethod
+    def rebalance(
+        members: list[Interface], dry_run: bool = False
+    ) -> list[tuple[str, str, str]]:
+        """
+        Moves peers from the most to the least loaded members until their
+        peer counts differ by at most one. Moved peers keep their keys but
+        get an address from their new member's sub-pool. Returns a
+        (peer, from, to) tuple for each move.
+        """
+        total = sum(len(m.peers) for m in members)
+        base, extra = divmod(total, len(members))
+        # the members that are already largest keep the extra peers
+        order = sorted(range(len(members)), key=lambda i: -len(members[i].peers))
+        target = dict(
+            (i, base + (1 if rank < extra else 0)) for rank, i in enumerate(order)
+        )
+        over: dict[int, int] = {}
+        candidates: dict[int, list[str]] = {}
+        for i, m in enumerate(members):
+            if len(m.peers) > target[i]:
+                over[i] = len(m.peers) - target[i]
+                # move the last peers by name, so repeated runs agree, and
+                # fall back to earlier ones when a name is taken on the target
+                names = sorted(m.peers)
+                candidates[i] = names[-over[i] :] + names[-over[i] - 1 :: -1]
+        taken: set[str] = set()
+        moves: list[tuple[str, str, str]] = []
+        for i, m in enumerate(members):
+            under = target[i] - len(m.peers)
+            if under <= 0:
+                continue
+            batch: list[tuple[str, int]] = []
+            for s in over:
+                for name in candidates[s]:
+                    if len(batch) == under or not over[s]:
+                        break
+                    if name in taken or name in m.peers:
+                        continue
+                    batch.append((name, s))
+                    taken.add(name)
+                    over[s] -= 1
+            if len(batch) < under:
+                raise PeerExistsException(
+                    f'[!] Could not move enough peers to "{m.vpn_iface}" without a name clash.'
+                )
+            if dry_run:
+                moves.extend((n, members[s].vpn_iface, m.vpn_iface) for n, s in batch)
+                continue
+            addrs = m.allocate(list(n for n, _ in batch))
+            for (name, source), (cidr4, cidr6) in zip(batch, addrs):
+                peer = members[source].peers.pop(name)
+                peer.cidr4, peer.cidr6 = cidr4, cidr6
+                if peer.key_seed != m.key_seed:
+                    # keep the keys derived from the old member's seed
+                    peer.materialize()
+                # stored keys are read, so they are saved under the new member
+                peer.secrets()
+                m.peers[name] = peer
+                moves.append((name, members[source].vpn_iface, m.vpn_iface))
+        if any(over.values()):
+            raise PoolExhaustedException("[!] Could not place every peer.")
+        return moves
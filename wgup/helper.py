@@ -0,0 +1,124 @@
+"""
+Privileged helper for wgup.
+
+wgup runs this module once per bulk operation as
+`sudo python -m wgup.helper PLAN_FILE`, so that installing many configs and
+managing many services takes a single sudo prompt. The plan is a JSON file:
+
+    {
+        "install": [{"iface": "wg0", "source": "/home/me/.wgup/sync/wg0.conf"}],
+        "services": [{"iface": "wg0", "action": "reload"}]
+    }
+
+Service actions are "up", "down", "reload" and "apply" (which updates the
+running interface in place with `wg syncconf`).
+
+All installs run first, then all service actions. Both run in parallel, and
+service actions that take longer than SERVICE_TIMEOUT seconds are killed. The
+results are printed to stdout as a JSON list, one entry per step.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from wgup.util import Input
+from wgup.wireguard import AsyncCommandLine
+
+WIREGUARD_DIR = "/etc/wireguard"
+MAX_WORKERS = 16
+
+# systemd's default timeout for starting and stopping a unit
+SERVICE_TIMEOUT = 90.0
+
+# Live-applies the installed config without restarting the interface.
+_APPLY = 'wg syncconf "$1" <(wg-quick strip "$1")'
+
+SERVICE_ACTIONS = {
+    "up": (
+        ["systemctl", "enable", "wg-quick@{iface}"],
+        ["systemctl", "restart", "wg-quick@{iface}"],
+    ),
+    "down": (
+        ["systemctl", "disable", "wg-quick@{iface}"],
+        ["systemctl", "stop", "wg-quick@{iface}"],
+    ),
+    "reload": (["systemctl", "reload", "wg-quick@{iface}"],),
+    "apply": (["bash", "-c", _APPLY, "_", "{iface}"],),
+}
+
+
+def _result(iface: str, step: str, error: str = ""):
+    return {"iface": iface, "step": step, "ok": not error, "error": error}
+
+
+def _install(entry: dict):
+    iface = entry["iface"]
+    try:
+        target = f"{WIREGUARD_DIR}/{iface}.conf"
+        shutil.move(entry["source"], target)
+        os.chown(target, 0, 0)
+        os.chmod(target, 0o600)
+    except OSError as e:
+        return _result(iface, "install", str(e))
+    return _result(iface, "install")
+
+
+async def _service(commands: AsyncCommandLine, entry: dict):
+    iface, action = entry["iface"], entry["action"]
+    try:
+        for command in SERVICE_ACTIONS[action]:
+            await commands.run(list(arg.format(iface=iface) for arg in command))
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as e:
+        return _result(iface, action, AsyncCommandLine.reason(e))
+    return _result(iface, action)
+
+
+def validate(plan: dict):
+    """
+    Raises ValueError if the plan contains anything the helper should not run.
+    """
+    for entry in plan.get("install", []) + plan.get("services", []):
+        valid, reason = Input.check_iface(entry.get("iface", ""))
+        if not valid:
+            raise ValueError(f"Invalid interface name: {reason}")
+    for entry in plan.get("install", []):
+        if not os.path.isfile(entry.get("source", "")):
+            raise ValueError(f'Source for "{entry["iface"]}" is not a file.')
+    for entry in plan.get("services", []):
+        if entry.get("action") not in SERVICE_ACTIONS:
+            raise ValueError(f'Unknown service action "{entry.get("action")}".')
+
+
+def run(plan: dict) -> list[dict]:
+    validate(plan)
+    results: list[dict] = []
+    with ThreadPoolExecutor(MAX_WORKERS) as pool:
+        results.extend(pool.map(_install, plan.get("install", [])))
+    failed = set(r["iface"] for r in results if not r["ok"])
+    services = list(s for s in plan.get("services", []) if s["iface"] not in failed)
+    commands = AsyncCommandLine(MAX_WORKERS, SERVICE_TIMEOUT)
+    results.extend(commands.gather(_service(commands, s) for s in services))
+    return results
+
+
+def main(argv: list[str]):
+    if len(argv) != 1:
+        print("usage: python -m wgup.helper PLAN_FILE", file=sys.stderr)
+        return 2
+    with open(argv[0], "r") as f:
+        plan = json.load(f)
+    try:
+        results = run(plan)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    print(json.dumps(results))
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
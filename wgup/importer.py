@@ -0,0 +1,365 @@
+import ipaddress
+import re
+import time
+
+from wgup.shaping import (
+    BATCH_PREFIX,
+    DEFAULT_TOTAL,
+    SHAPING_POST_UP,
+    SHAPING_PRE_DOWN,
+    Shaping,
+)
+from wgup.tuning import Tuning
+from wgup.util import IP, ArgsException, ImportException, Input
+from wgup.wireguard import CommandLine, Interface, Peer
+
+_REGEX_PEER_NAME = re.compile(r'#\s*Peer\s+"([^"]*)"')
+_REGEX_FW_FWD = re.compile(r"ip6?tables -[ID] FORWARD -i (\S+) -o (\S+) -j ACCEPT")
+_REGEX_FW_NAT = re.compile(
+    r"(ip6?tables) -t nat -[ID] POSTROUTING -o (\S+) -d (\S+) -j MASQUERADE"
+)
+_REGEX_TXQUEUELEN = re.compile(r"ip link set dev %i txqueuelen (\d+)")
+_REGEX_OFFLOAD = re.compile(
+    r"ethtool -K (\S+) rx-udp-gro-forwarding (on|off) rx-gro-list off \|\| true"
+)
+_REGEX_OFFLOAD_GSO = re.compile(r"ethtool -K \S+ gso (on|off) gro (on|off) \|\| true")
+_REGEX_RPS = re.compile(
+    r"for q in /sys/class/net/(\S+)/queues/rx-\*; "
+    r"do echo ([0-9a-f,]+) > \$q/rps_cpus; done \|\| true"
+)
+_REGEX_TC_CLASS = re.compile(
+    r"class add dev \S+ parent (\S+) classid (\S+) htb rate (\d+)bit(?: ceil (\d+)bit)?"
+)
+_REGEX_TC_FILTER4 = re.compile(r"filter add dev \S+ .* match ip dst (\S+) flowid (\S+)")
+
+# [Interface] settings that wgup renders from Interface.tuning
+_TUNING_DIRECTIVES = ("mtu", "fwmark", "table")
+
+
+class Importer:
+    """
+    Streaming parser for wg-quick configs.
+
+    Lines are fed one at a time and each [Peer] section is turned into a Peer
+    as soon as it ends, so only one section is buffered at a time. Peer names
+    are taken from the `# Peer "name"` comments that wgup writes, and firewall
+    rules generated by wgup are turned back into NAT settings, and its tuning
+    and shaping steps back into Interface.tuning and peer rates. Addresses in use
+    are collected while parsing, so peers without an address in one family can
+    be given one without another pass over the peers.
+    """
+
+    def __init__(self, vpn_iface: str, host: str, port: int | None = None):
+        self.vpn_iface = vpn_iface
+        self.host = host
+        self.port = port
+        self.warnings: list[str] = []
+        self.peers: dict[str, Peer] = {}
+        self.used4: list[str] = []
+        self.used6: list[str] = []
+        self.lines = 0
+        self._interface: dict[str, list[str]] = {}
+        self._section: str | None = None
+        self._values: dict[str, list[str]] = {}
+        self._comment_name: str | None = None
+        self._name: str | None = None
+        self._unnamed = 0
+        self._missing4: list[Peer] = []
+        self._missing6: list[Peer] = []
+        self._source_iface: str | None = None
+        self._dropped: dict[str, int] = {}
+        # shaping batch: (parent, rate, ceil) by class id, class id by IPv4
+        self._tc_classes: dict[str, tuple[str, int, int]] = {}
+        self._tc_flows: dict[str, str] = {}
+
+    def _warn(self, message: str):
+        self.warnings.append(f"line {self.lines}: {message}")
+
+    def feed(self, line: str):
+        self.lines += 1
+        line = line.strip()
+        if not line:
+            return
+        if line.startswith(BATCH_PREFIX):
+            self._feed_batch(line[len(BATCH_PREFIX) :])
+            return
+        if line.startswith("#"):
+            match = _REGEX_PEER_NAME.match(line)
+            if match:
+                self._comment_name = match.group(1)
+            return
+        if line.startswith("["):
+            self._end_section()
+            section = line.strip("[]").strip().lower()
+            if section not in ("interface", "peer"):
+                raise ImportException(
+                    f"[!] Unknown section {line} (line {self.lines})."
+                )
+            self._section = section
+            self._name = self._comment_name
+            self._comment_name = None
+            return
+        if self._section is None:
+            raise ImportException(
+                f"[!] Value outside of a section (line {self.lines})."
+            )
+        key, sep, value = line.partition("=")
+        if not sep:
+            raise ImportException(f"[!] Malformed line {self.lines}.")
+        # inline comments, as in "PersistentKeepalive = 10  # comment"
+        value = value.split("#", 1)[0].strip()
+        self._values.setdefault(key.strip().lower(), []).append(value)
+
+    def _feed_batch(self, line: str):
+        match = _REGEX_TC_CLASS.fullmatch(line)
+        if match:
+            parent, classid, rate, ceil = match.groups()
+            self._tc_classes[classid] = (parent, int(rate), int(ceil or rate))
+            return
+        match = _REGEX_TC_FILTER4.fullmatch(line)
+        if match:
+            self._tc_flows[match.group(1)] = match.group(2)
+
+    def _end_section(self):
+        if self._section == "interface":
+            if self._interface:
+                raise ImportException("[!] Config has more than one [Interface].")
+            self._interface = self._values
+        elif self._section == "peer":
+            self._end_peer()
+        self._section = None
+        self._values = {}
+
+    def _peer_name(self) -> str:
+        name = self._name
+        if name is not None:
+            valid, _ = Input.check_peer_name(name)
+            if valid and name not in self.peers:
+                return name
+            self._warn(f'Peer name "{name}" is invalid or taken, generating one.')
+        while True:
+            name = f"peer{self._unnamed}"
+            self._unnamed += 1
+            if name not in self.peers:
+                return name
+
+    def _end_peer(self):
+        values = self._values
+        public_key = values.get("publickey", [""])[0]
+        if not public_key:
+            raise ImportException(f"[!] Peer without PublicKey (line {self.lines}).")
+        cidr4, cidr6 = "", ""
+        for allowed in ",".join(values.get("allowedips", [])).split(","):
+            allowed = allowed.strip()
+            if not allowed:
+                continue
+            network = ipaddress.ip_network(allowed, strict=False)
+            if network.version == 4 and not cidr4:
+                cidr4 = allowed
+            elif network.version == 6 and not cidr6:
+                cidr6 = allowed
+            else:
+                self._warn(f"Dropped extra AllowedIPs {allowed}.")
+        for key in values:
+            if key not in ("publickey", "presharedkey", "allowedips"):
+                self._dropped[key] = self._dropped.get(key, 0) + 1
+        name = self._peer_name()
+        peer = Peer(
+            name=name,
+            private_key="",
+            public_key=public_key,
+            preshared_key=values.get("presharedkey", [""])[0],
+            cidr4=cidr4,
+            cidr6=cidr6,
+        )
+        if cidr4:
+            self.used4.append(cidr4)
+        else:
+            self._missing4.append(peer)
+        if cidr6:
+            self.used6.append(cidr6)
+        else:
+            self._missing6.append(peer)
+        self.peers[name] = peer
+
+    def _parse_steps(self, nat: dict, tuning: dict):
+        rules = self._interface.get("postup", []) + self._interface.get("predown", [])
+        # the interface may have had a different name in the imported config
+        for rule in rules:
+            match = _REGEX_FW_FWD.fullmatch(rule)
+            if match and match.group(1) == match.group(2):
+                self._source_iface = match.group(1)
+        for rule in rules:
+            match = _REGEX_FW_FWD.fullmatch(rule)
+            if match:
+                i, o = match.groups()
+                if i != self._source_iface and o == self._source_iface:
+                    nat["iface"] = i
+                elif i == self._source_iface and o != self._source_iface:
+                    nat["iface"] = o
+                continue
+            match = _REGEX_FW_NAT.fullmatch(rule)
+            if match:
+                tool, nat_iface, dests = match.groups()
+                nat["iface"] = nat_iface
+                key = "cidr6" if tool == "ip6tables" else "cidr4"
+                for dest in dests.split(","):
+                    if dest not in nat[key]:
+                        nat[key].append(dest)
+                continue
+            if rule in (SHAPING_POST_UP, SHAPING_PRE_DOWN):
+                continue
+            match = _REGEX_TXQUEUELEN.fullmatch(rule)
+            if match:
+                tuning["txqueuelen"] = int(match.group(1))
+                continue
+            # offloads and RPS apply to the uplink, even without NAT rules
+            match = _REGEX_OFFLOAD.fullmatch(rule)
+            if match:
+                nat["iface"] = nat["iface"] or match.group(1)
+                tuning["offload"] = match.group(2)
+                continue
+            if _REGEX_OFFLOAD_GSO.fullmatch(rule):
+                continue
+            match = _REGEX_RPS.fullmatch(rule)
+            if match:
+                nat["iface"] = nat["iface"] or match.group(1)
+                tuning["rps"] = match.group(2)
+                continue
+            self._warn(f'Dropped firewall rule not generated by wgup: "{rule}"')
+
+    def _parse_tuning(self, tuning: dict):
+        for key in _TUNING_DIRECTIVES:
+            if key not in self._interface:
+                continue
+            value = self._interface[key][0]
+            try:
+                parsed = Tuning.parse(key, value)
+            except ArgsException:
+                self.warnings.append(f"Dropped [Interface] setting {key} = {value}.")
+                continue
+            if parsed is not None:
+                tuning[key] = parsed
+
+    def _parse_shaping(self) -> dict:
+        """
+        Restores peer rates from the shaping batch and returns the shaping
+        settings. Class limits cannot be restored, since the batch does not
+        name the classes.
+        """
+        shaping: dict = {}
+        root = self._tc_classes.get("1:1")
+        if root is None:
+            return shaping
+        if root[1] != Shaping.bits(DEFAULT_TOTAL):
+            shaping["total"] = Shaping.format_rate(root[1])
+        limited = set(
+            c for c, (parent, _, _) in self._tc_classes.items() if parent == "1:1"
+        )
+        limited.discard("1:ffff")
+        for peer in self.peers.values():
+            classid = self._tc_flows.get(peer.cidr4)
+            if classid not in self._tc_classes:
+                continue
+            parent, _, ceil = self._tc_classes[classid]
+            # peers in a limited class have their own rate if it is lower
+            if parent == "1:1" or ceil < self._tc_classes[parent][2]:
+                peer.rate = Shaping.format_rate(ceil)
+            limited.discard(classid)
+        if limited:
+            self.warnings.append(
+                f"Dropped {len(limited)} shaping class limits (classes are unnamed)."
+            )
+        return shaping
+
+    def finish(self) -> Interface:
+        self._end_section()
+        values = self._interface
+        if not values:
+            raise ImportException("[!] Config has no [Interface] section.")
+        private_key = values.get("privatekey", [""])[0]
+        if not private_key:
+            raise ImportException("[!] [Interface] has no PrivateKey.")
+        addr4, addr6 = "", ""
+        for address in ",".join(values.get("address", [])).split(","):
+            address = address.strip()
+            if not address:
+                continue
+            iface_addr = ipaddress.ip_interface(address)
+            if iface_addr.version == 4 and not addr4:
+                addr4 = address
+            elif iface_addr.version == 6 and not addr6:
+                addr6 = address
+        if not addr4:
+            raise ImportException("[!] [Interface] has no IPv4 Address.")
+        vpn_cidr4 = str(ipaddress.ip_interface(addr4).network)
+        if addr6:
+            vpn_cidr6 = str(ipaddress.ip_interface(addr6).network)
+        else:
+            vpn_cidr6 = IP.auto_cidr6()
+            addr6 = IP.server_addr6(vpn_cidr6)
+            self.warnings.append(f"No IPv6 Address, using {vpn_cidr6}.")
+        port = self.port
+        if port is None:
+            port = int(values.get("listenport", ["51820"])[0])
+        nat = {"iface": "", "cidr4": [], "cidr6": []}
+        tuning: dict = {}
+        self._parse_steps(nat, tuning)
+        self._parse_tuning(tuning)
+        for key in values:
+            if (
+                key
+                not in (
+                    "privatekey",
+                    "address",
+                    "listenport",
+                    "postup",
+                    "predown",
+                )
+                + _TUNING_DIRECTIVES
+            ):
+                self.warnings.append(f"Dropped [Interface] setting {key}.")
+        for key, count in sorted(self._dropped.items()):
+            self.warnings.append(f"Dropped [Peer] setting {key} from {count} peers.")
+        self.used4.append(addr4.split("/")[0] + "/32")
+        self.used6.append(addr6.split("/")[0] + "/128")
+        addrs4 = IP.allocate_many(vpn_cidr4, self.used4, len(self._missing4))
+        for peer, cidr4 in zip(self._missing4, addrs4):
+            peer.cidr4 = cidr4
+        addrs6 = IP.allocate_many(vpn_cidr6, self.used6, len(self._missing6))
+        for peer, cidr6 in zip(self._missing6, addrs6):
+            peer.cidr6 = cidr6
+        return Interface(
+            private_key=private_key,
+            public_key=CommandLine.generate_public_key(private_key),
+            vpn_iface=self.vpn_iface,
+            vpn_cidr4=vpn_cidr4,
+            vpn_cidr6=vpn_cidr6,
+            addr4=addr4,
+            addr6=addr6,
+            host=self.host,
+            port=port,
+            nat_iface=nat["iface"],
+            nat_cidr4=nat["cidr4"],
+            nat_cidr6=nat["cidr6"],
+            peers=self.peers,
+            tuning=tuning,
+            shaping=self._parse_shaping(),
+        )
+
+    @classmethod
+    def from_file(cls, filename: str, vpn_iface: str, host: str, port=None):
+        """
+        Imports a wg-quick config. Returns the interface, the importer (for
+        its warnings) and the time taken in seconds.
+        """
+        start = time.perf_counter()
+        importer = cls(vpn_iface, host, port)
+        try:
+            with open(filename, "r") as f:
+                for line in f:
+                    importer.feed(line)
+            iface = importer.finish()
+        except ValueError as e:
+            raise ImportException(f"[!] {e} (line {importer.lines}).")
+        return iface, importer, time.perf_counter() - start
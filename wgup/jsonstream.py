@@ -0,0 +1,185 @@
+"""
+Incremental loader for interfaces.json.
+
+The file is memory-mapped and decoded a chunk at a time. Peers are decoded and
+turned into Peer objects one by one, so the raw file, the parsed JSON tree and
+the object graph are never all in memory at once. Interfaces that were not
+asked for are scanned but never built.
+"""
+
+import codecs
+import json
+import mmap
+import re
+from typing import Any, Iterator
+
+from wgup import defaults
+from wgup.keystore import InterfaceKeys, Keystore
+from wgup.snapshot import SnapshotWriter
+from wgup.util import ConfigVersionException
+from wgup.wireguard import Interface, Peer
+
+_CHUNK = 1 << 20
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _Reader:
+    def __init__(self, mm: mmap.mmap):
+        self._mm = mm
+        self._offset = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+
+    def _fill(self) -> bool:
+        """
+        Appends the next chunk of the file to the buffer, dropping what has
+        already been consumed. Returns False at the end of the file.
+        """
+        if self._offset >= len(self._mm):
+            return False
+        chunk = self._mm[self._offset : self._offset + _CHUNK]
+        self._offset += len(chunk)
+        final = self._offset >= len(self._mm)
+        self.buffer = self.buffer[self.pos :] + self._decoder.decode(chunk, final)
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of file.")
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self._position()}.")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buffer, self.pos)
+                # a number may continue in the next chunk
+                if end < len(self.buffer) or not self._fill():
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def items(self, close: str) -> Iterator[None]:
+        """
+        Yields once per element of the array or object that was just opened,
+        with the reader positioned at the element. Stops after `close`.
+        """
+        if self.peek() == close:
+            self.pos += 1
+            return
+        while True:
+            yield
+            char = self.peek()
+            self.pos += 1
+            if char == close:
+                return
+            if char != ",":
+                raise ValueError(f"Expected ',' at offset {self._position()}.")
+
+    def key(self) -> str:
+        key = self.value()
+        if not isinstance(key, str):
+            raise ValueError(f"Expected a key at offset {self._position()}.")
+        self.expect(":")
+        return key
+
+    def _position(self):
+        return self._offset - len(self.buffer) + self.pos
+
+
+def _interface(
+    reader: _Reader,
+    only: set[str] | None,
+    keystore: Keystore | None,
+    snapshot: SnapshotWriter | None,
+) -> Interface | None:
+    data: dict[str, Any] = {}
+    peers: dict[str, Peer] = {}
+    wanted = True
+    reader.expect("{")
+    for _ in reader.items("}"):
+        key = reader.key()
+        if key != "peers":
+            data[key] = reader.value()
+            if key == "vpn_iface" and only is not None:
+                wanted = data[key] in only
+            continue
+        secrets = None
+        if keystore is not None:
+            secrets = InterfaceKeys(keystore, data["vpn_iface"])
+        reader.expect("[")
+        for _ in reader.items("]"):
+            p = reader.value()
+            if snapshot is not None:
+                snapshot.peer(p)
+            if wanted:
+                # a seed that is not in the file is read from the keystore
+                peer = Peer.from_json(p, None if secrets else "", secrets)
+                peers[peer.name] = peer
+    if snapshot is not None:
+        snapshot.interface(data)
+    if only is not None and data.get("vpn_iface") not in only:
+        return None
+    data["peers"] = []
+    iface = Interface.from_json(data, secrets)
+    if secrets is None:
+        # the seed of derived peers comes after them in the file
+        for peer in peers.values():
+            if peer.key_epoch is not None:
+                peer.key_seed = iface.key_seed
+    iface.peers = peers
+    return iface
+
+
+def iter_interfaces(
+    filename: str,
+    only: set[str] | None = None,
+    keystore: Keystore | None = None,
+    snapshot: SnapshotWriter | None = None,
+):
+    """
+    Yields the interfaces in `filename` one at a time, skipping any whose name
+    is not in `only` (if given). Configs from version 2 on read their keys
+    from `keystore`. Every interface, wanted or not, is also passed to
+    `snapshot`, which is closed once the whole file has been read.
+    """
+    with open(filename, "rb") as f:
+        if not f.seek(0, 2):
+            raise ValueError("Config file is empty.")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            reader = _Reader(mm)
+            version = None
+            reader.expect("{")
+            for _ in reader.items("}"):
+                key = reader.key()
+                if key == "version":
+                    version = reader.value()
+                    if version not in defaults.CONFIG_VERSIONS_READ:
+                        raise ConfigVersionException("[!] Incompatible config version.")
+                elif key == "interfaces":
+                    reader.expect("[")
+                    for _ in reader.items("]"):
+                        iface = _interface(
+                            reader, only, keystore if version >= 2 else None, snapshot
+                        )
+                        if iface is not None:
+                            yield iface
+                else:
+                    reader.value()
+            if version is None:
+                raise ConfigVersionException("[!] Incompatible config version.")
+            if snapshot is not None:
+                snapshot.close(version)
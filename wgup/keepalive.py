@@ -0,0 +1,169 @@
+import time
+
+from wgup.util import ArgsException, Input
+from wgup.wireguard import Interface, Peer
+
+# What every peer used before keepalive policies existed
+DEFAULT_POLICY = "10"
+
+# Comfortably below the ~30s UDP mapping timeout of most NATs
+NAT_KEEPALIVE = 25
+
+# Observations needed before "auto" turns keepalives off for a peer, and how
+# long they must span: well past the UDP mapping timeout of common NATs
+MIN_SAMPLES = 3
+MIN_SPAN = 15 * 60
+
+
+class Keepalive:
+    """
+    Decides the PersistentKeepalive interval of each peer. A policy is "off",
+    a fixed interval in seconds, or "auto", and is looked up in order from:
+
+        Peer.keepalive                      (set for a single peer)
+        Interface.keepalive[Peer.peer_class] (set for a class of peers)
+        Interface.keepalive["default"]      (set for the interface)
+        DEFAULT_POLICY
+
+    "auto" uses what `wg show dump` has shown about the peer (recorded in
+    Peer.observed by `observe`). A peer only gets no keepalives once it is
+    shown not to be behind a NAT: it has been seen on the port of its own
+    configured endpoint (its ListenPort), in MIN_SAMPLES handshakes spanning
+    at least MIN_SPAN, and its endpoint never changed. Every other peer gets
+    NAT_KEEPALIVE, since a stable endpoint is also what keepalives produce
+    for a peer behind a NAT.
+    """
+
+    DEFAULT_CLASS = "default"
+
+    @staticmethod
+    def parse(value: str) -> str:
+        """
+        Returns `value` as a policy, raising ArgsException if it is invalid.
+        """
+        if value in ("off", "auto"):
+            return value
+        valid, reason = Input.check_int(value, min_value=1, max_value=65535)
+        if not valid:
+            raise ArgsException(
+                f'[!] Keepalive must be "off", "auto" or an interval in seconds: {reason}'
+            )
+        return str(int(value))
+
+    @staticmethod
+    def policy(iface: Interface, peer: Peer) -> tuple[str, str]:
+        """
+        Returns the policy that applies to `peer` and where it was set.
+        """
+        if peer.keepalive:
+            return peer.keepalive, "peer"
+        if peer.peer_class and peer.peer_class in iface.keepalive:
+            return iface.keepalive[peer.peer_class], f"class {peer.peer_class}"
+        if Keepalive.DEFAULT_CLASS in iface.keepalive:
+            return iface.keepalive[Keepalive.DEFAULT_CLASS], "interface"
+        return DEFAULT_POLICY, "default"
+
+    @staticmethod
+    def auto(peer: Peer) -> int | None:
+        observed = peer.observed
+        if not observed or not peer.endpoint:
+            return NAT_KEEPALIVE
+        if observed["samples"] < MIN_SAMPLES or observed["rebinds"]:
+            return NAT_KEEPALIVE
+        if observed.get("handshake", 0) - observed.get("since", 0) < MIN_SPAN:
+            return NAT_KEEPALIVE
+        # a NAT would have mapped the peer to another port (most of the time)
+        _, _, port = observed["endpoint"].rpartition(":")
+        if port != peer.endpoint.rpartition(":")[2]:
+            return NAT_KEEPALIVE
+        return None
+
+    @staticmethod
+    def interval(iface: Interface, peer: Peer) -> int | None:
+        """
+        Returns the keepalive interval for `peer` in seconds, or None if it
+        should not send keepalives.
+        """
+        policy, _ = Keepalive.policy(iface, peer)
+        if policy == "off":
+            return None
+        if policy == "auto":
+            return Keepalive.auto(peer)
+        return int(policy)
+
+    @staticmethod
+    def parse_dump(dump: str) -> dict[str, tuple[str, int]]:
+        """
+        Returns (endpoint, latest handshake) by public key from the output of
+        `wg show <iface> dump`. The first line describes the interface itself.
+        """
+        peers: dict[str, tuple[str, int]] = {}
+        for line in dump.splitlines()[1:]:
+            fields = line.split("\t")
+            if len(fields) < 8:
+                continue
+            public_key, _, endpoint, _, handshake = fields[:5]
+            peers[public_key] = (endpoint, int(handshake))
+        return peers
+
+    @staticmethod
+    def observe(iface: Interface, dump: str, now: float | None = None) -> int:
+        """
+        Records the endpoint of every peer in `dump` that has completed a
+        handshake since it was last observed. Any change of endpoint counts as
+        a NAT rebinding. Returns the number of peers observed.
+        """
+        if now is None:
+            now = time.time()
+        seen = Keepalive.parse_dump(dump)
+        count = 0
+        for peer in iface.peers.values():
+            entry = seen.get(peer.public_key)
+            if entry is None:
+                continue
+            endpoint, handshake = entry
+            if endpoint == "(none)" or not handshake:
+                continue
+            observed = peer.observed or {
+                "endpoint": endpoint,
+                "samples": 0,
+                "rebinds": 0,
+                "since": handshake,
+            }
+            # the same handshake seen again says nothing new
+            if handshake <= observed.get("handshake", 0):
+                continue
+            if endpoint != observed["endpoint"]:
+                observed["rebinds"] += 1
+            observed["endpoint"] = endpoint
+            observed["handshake"] = handshake
+            observed.setdefault("since", handshake)
+            observed["samples"] += 1
+            observed["seen"] = int(now)
+            peer.observed = observed
+            count += 1
+        return count
+
+    @staticmethod
+    def report(iface: Interface) -> list[tuple[str, str, int, float]]:
+        """
+        Returns (source, interval, peers, packets per second) for each
+        combination of policy source and resulting interval. The rate assumes
+        idle peers, since keepalives are only sent when there is no other
+        traffic.
+        """
+        rows: dict[tuple[str, str], list] = {}
+        for peer in iface.peers.values():
+            policy, source = Keepalive.policy(iface, peer)
+            interval = Keepalive.interval(iface, peer)
+            label = "off" if interval is None else f"{interval}s"
+            if policy == "auto":
+                label = f"auto: {label}"
+            row = rows.setdefault((source, label), [0, 0.0])
+            row[0] += 1
+            if interval is not None:
+                row[1] += 1 / interval
+        return list(
+            (source, label, peers, rate)
+            for (source, label), (peers, rate) in sorted(rows.items())
+        )
@@ -0,0 +1,112 @@
+import base64
+import functools
+import hashlib
+import hmac
+import os
+
+# Curve25519 field prime and the (A - 2) / 4 constant of the Montgomery ladder
+_P = 2**255 - 19
+_A24 = 121665
+_BASE_POINT = (9).to_bytes(32, "little")
+
+# Fixed HKDF salt, so that keys derived by other tools from the same seed
+# do not collide with ours
+_SALT = b"wgup peer keys v1"
+
+# Derived keys kept in memory per process
+CACHE_SIZE = 1 << 16
+
+
+def hkdf(ikm: bytes, salt: bytes, info: bytes, length: int) -> bytes:
+    """
+    HKDF with SHA-256 (RFC 5869).
+    """
+    prk = hmac.new(salt, ikm, hashlib.sha256).digest()
+    okm = b""
+    block = b""
+    counter = 1
+    while len(okm) < length:
+        block = hmac.new(prk, block + info + bytes([counter]), hashlib.sha256).digest()
+        okm += block
+        counter += 1
+    return okm[:length]
+
+
+def _clamp(scalar: bytes) -> bytes:
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+
+def x25519(scalar: bytes, point: bytes) -> bytes:
+    """
+    The X25519 function (RFC 7748), computed with the Montgomery ladder. With
+    the base point, this is what `wg pubkey` computes.
+    """
+    k = int.from_bytes(_clamp(scalar), "little")
+    x1 = int.from_bytes(point, "little") & ((1 << 255) - 1)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in range(254, -1, -1):
+        bit = (k >> t) & 1
+        swap ^= bit
+        if swap:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a = x2 + z2
+        aa = a * a % _P
+        b = x2 - z2
+        bb = b * b % _P
+        e = aa - bb
+        c = x3 + z3
+        d = x3 - z3
+        da = d * a % _P
+        cb = c * b % _P
+        x3 = (da + cb) ** 2 % _P
+        z3 = x1 * (da - cb) ** 2 % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, x3, z2, z3 = x3, x2, z3, z2
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+class KeyDerivation:
+    """
+    Derives a peer's private and preshared keys from its interface's seed,
+    its name and its key epoch:
+
+        HKDF-SHA256(seed, salt, "<name>\\0<epoch>") -> private | preshared
+
+    so that they do not have to be stored. A new epoch gives the peer new,
+    unrelated keys. Derivation is cheap (two HMACs) and cached, but computing
+    a public key takes a couple of milliseconds in Python, so public keys are
+    still stored and only computed when keys change.
+    """
+
+    @staticmethod
+    def new_seed() -> str:
+        return base64.b64encode(os.urandom(32)).decode("ascii")
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def keys(seed: str, name: str, epoch: int) -> tuple[str, str]:
+        """
+        Returns the (private, preshared) keys of the peer `name` at `epoch`.
+        """
+        if not seed:
+            raise ValueError(f'Keys of peer "{name}" are derived but no seed is set.')
+        info = name.encode("utf-8") + b"\0" + str(epoch).encode("ascii")
+        okm = hkdf(base64.b64decode(seed), _SALT, info, 64)
+        return (
+            base64.b64encode(_clamp(okm[:32])).decode("ascii"),
+            base64.b64encode(okm[32:]).decode("ascii"),
+        )
+
+    @staticmethod
+    @functools.lru_cache(maxsize=CACHE_SIZE)
+    def public_key(private_key: str) -> str:
+        public = x25519(base64.b64decode(private_key), _BASE_POINT)
+        return base64.b64encode(public).decode("ascii")
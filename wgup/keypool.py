@@ -0,0 +1,70 @@
+import fcntl
+import os
+
+from wgup import defaults
+
+_KEYPOOL_FILE = f"{defaults.CONFIG_DIR}/keypool"
+_KEY_LEN = 44  # base64 of 32 bytes
+# Each entry is "<private> <public> <preshared>\n", so every record has the
+# same length and can be popped off the end of the file in O(1).
+_RECORD_LEN = 3 * _KEY_LEN + 3
+
+
+class KeyPool:
+    """
+    A stock of pre-generated (private, public, preshared) key triples.
+    Entries are removed from the pool as they are taken, under an exclusive
+    lock, so that each entry is only ever used once, even across processes.
+    """
+
+    @staticmethod
+    def _open(flags: int):
+        return os.fdopen(os.open(_KEYPOOL_FILE, flags, 0o600), "r+b")
+
+    @staticmethod
+    def size() -> int:
+        try:
+            return os.stat(_KEYPOOL_FILE).st_size // _RECORD_LEN
+        except FileNotFoundError:
+            return 0
+
+    @staticmethod
+    def put(keys: list[tuple[str, str, str]]):
+        records = []
+        for triple in keys:
+            if any(len(k) != _KEY_LEN or " " in k for k in triple):
+                raise ValueError("Malformed key.")
+            records.append(" ".join(triple) + "\n")
+        with KeyPool._open(os.O_RDWR | os.O_CREAT) as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # drop a partial record left behind by an interrupted write
+            size = os.fstat(f.fileno()).st_size
+            f.truncate(size - size % _RECORD_LEN)
+            f.seek(0, os.SEEK_END)
+            f.write("".join(records).encode("ascii"))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def take() -> tuple[str, str, str] | None:
+        """
+        Removes one entry from the pool and returns it, or returns None if the
+        pool is empty or does not exist.
+        """
+        try:
+            f = KeyPool._open(os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        with f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            size = os.fstat(f.fileno()).st_size
+            size -= size % _RECORD_LEN
+            if size < _RECORD_LEN:
+                return None
+            f.seek(size - _RECORD_LEN)
+            record = f.read(_RECORD_LEN).decode("ascii")
+            f.truncate(size - _RECORD_LEN)
+            f.flush()
+            os.fsync(f.fileno())
+        private_key, public_key, preshared_key = record.split()
+        return private_key, public_key, preshared_key
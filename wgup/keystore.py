@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import subprocess
+from typing import Any, Iterable
+
+from wgup import defaults
+from wgup.perf import Profile
+from wgup.util import KeystoreException
+
+KEYSTORE_FILE = "keystore.json"
+
+# The keystore is encrypted when this is set, and must be set to read an
+# encrypted keystore
+PASSPHRASE_ENV = "WGUP_KEYSTORE_PASSPHRASE"
+
+# `openssl enc` output starts with this, followed by the salt
+_MAGIC = b"Salted__"
+_OPENSSL = [
+    "openssl",
+    "enc",
+    "-aes-256-cbc",
+    "-pbkdf2",
+    "-iter",
+    "200000",
+    "-pass",
+    f"env:{PASSPHRASE_ENV}",
+]
+
+_logger = logging.getLogger(defaults.PROG)
+
+
+class Keystore:
+    """
+    The private keys, preshared keys and key seeds of all interfaces, kept
+    apart from interfaces.json so that commands that only list or look up
+    interfaces and peers never read them. The file is only read when a key is
+    first needed, e.g. to render a config:
+
+        {
+            "version": 1,
+            "interfaces": {
+                "wg0": {
+                    "private_key": "...",
+                    "key_seed": "...",  # only in derived key mode
+                    "peers": {"laptop": ["<private>", "<preshared>"], ...},
+                },
+            },
+        }
+
+    Peers with derived keys (see wgup.keyderive) have no entry. If
+    PASSPHRASE_ENV is set, the file is encrypted with `openssl enc`.
+    """
+
+    VERSION = 1
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self._data: dict | None = None
+        # set when the file holds keys of removed interfaces or peers
+        self._stale = False
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    @staticmethod
+    def _openssl(args: list[str], data: bytes, error: str) -> bytes:
+        try:
+            result = subprocess.run(
+                _OPENSSL + args, input=data, capture_output=True, check=True
+            )
+        except (OSError, subprocess.CalledProcessError):
+            raise KeystoreException(error)
+        return result.stdout
+
+    def _load(self) -> dict:
+        try:
+            with open(self.filename, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return {"version": self.VERSION, "interfaces": {}}
+        if raw.startswith(_MAGIC):
+            if not os.environ.get(PASSPHRASE_ENV):
+                raise KeystoreException(
+                    f"[!] The keystore is encrypted. Please set {PASSPHRASE_ENV}."
+                )
+            raw = self._openssl(
+                ["-d"], raw, "[!] Could not decrypt the keystore (wrong passphrase?)."
+            )
+        data = json.loads(raw)
+        if data.get("version") != self.VERSION:
+            raise KeystoreException("[!] Incompatible keystore version.")
+        return data
+
+    def interface(self, name: str) -> dict:
+        """
+        Returns the key material of the interface `name`, reading the
+        keystore the first time.
+        """
+        if self._data is None:
+            with Profile.phase("Keystore.load"):
+                self._data = self._load()
+        return self._data["interfaces"].get(name, {})
+
+    def invalidate(self):
+        """
+        Makes the next `save` rewrite the file, so that the keys of removed
+        interfaces and peers do not stay in it.
+        """
+        self._stale = True
+
+    def save(self, interfaces: Iterable[Any]):
+        """
+        Writes the key material of `interfaces` (Interface.secrets). Nothing is
+        written if no key was read or changed and nothing was removed since
+        the keystore was loaded.
+        """
+        interfaces = list(interfaces)
+        if (
+            not self.loaded
+            and not self._stale
+            and os.path.exists(self.filename)
+            and not any(iface.secrets_loaded for iface in interfaces)
+        ):
+            return
+        data = {
+            "version": self.VERSION,
+            "interfaces": dict(
+                (iface.vpn_iface, iface.secrets())
+                for iface in sorted(interfaces, key=lambda i: i.vpn_iface)
+            ),
+        }
+        raw = json.dumps(data, indent=4).encode("utf-8")
+        if os.environ.get(PASSPHRASE_ENV):
+            raw = self._openssl(["-salt"], raw, "[!] Could not encrypt the keystore.")
+        temp_filename = f"{self.filename}.tmp"
+        fd = os.open(temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_filename, self.filename)
+        self._data = data
+        self._stale = False
+        _logger.debug("Saved keystore.")
+
+
+class InterfaceKeys:
+    """
+    The key material of one interface in a keystore, for the interface and
+    its peers to read when a key is first used.
+    """
+
+    def __init__(self, keystore: Keystore, name: str):
+        self.keystore = keystore
+        self.name = name
+
+    def private_key(self) -> str:
+        return self._get().get("private_key", "")
+
+    def key_seed(self) -> str:
+        return self._get().get("key_seed", "")
+
+    def peer(self, name: str) -> tuple[str, str]:
+        """
+        Returns the (private, preshared) keys of the peer `name`.
+        """
+        keys = self._get().get("peers", {}).get(name)
+        if keys is None:
+            raise KeystoreException(
+                f'[!] The keystore has no keys for peer "{name}" (interface "{self.name}").'
+            )
+        return keys[0], keys[1]
+
+    def _get(self) -> dict:
+        data = self.keystore.interface(self.name)
+        if not data:
+            raise KeystoreException(
+                f'[!] The keystore has no keys for interface "{self.name}".'
+            )
+        return data
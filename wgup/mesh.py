@@ -0,0 +1,125 @@
+import base64
+import hashlib
+import hmac
+
+from wgup.keepalive import NAT_KEEPALIVE, Keepalive
+from wgup.wireguard import Interface, Peer
+
+CONFIG_MESH_PEER_HEAD = """
+# Mesh peer "{name}"
+[Peer]
+PublicKey = {public_key}
+"""
+
+CONFIG_MESH_PEER_TAIL = """AllowedIPs = {cidr4}
+AllowedIPs = {cidr6}
+"""
+
+CONFIG_MESH_PEER_ENDPOINT = """Endpoint = {endpoint}
+"""
+
+CONFIG_MESH_PEER_KEEPALIVE = """PersistentKeepalive = {keepalive}
+"""
+
+
+class Mesh:
+    """
+    Renders peer configs for an interface whose mesh peers (Peer.mesh) talk
+    to each other directly instead of through the server.
+
+    Each mesh peer's config gets a [Peer] entry for every other mesh peer
+    it can reach or be reached by: a pair is linked only when at least one
+    side has an endpoint, and the side without one sends keepalives so the
+    other can reach it back through its NAT. A full export is O(n^2) entries. To keep that cheap, each peer's
+    entry is rendered once and reused in every other peer's config, and the
+    per-pair preshared keys are derived on demand (HMAC of the interface's
+    private key over the pair's public keys) rather than generated and
+    stored. Both sides of a pair derive the same key, and rekeying the
+    interface rotates all of them.
+    """
+
+    def __init__(self, iface: Interface):
+        self.iface = iface
+        self.members = list(
+            p
+            for _, p in sorted(iface.peers.items())
+            if p.mesh and p.public_key and p.enabled
+        )
+        self._secret = iface.private_key.encode("ascii")
+        self._fragments: dict[str, tuple[str, str]] = {}
+        self._psks: dict[tuple[str, str], str] = {}
+
+    def psk(self, a: Peer, b: Peer) -> str:
+        pair = (
+            (a.public_key, b.public_key)
+            if a.public_key < b.public_key
+            else (b.public_key, a.public_key)
+        )
+        psk = self._psks.get(pair)
+        if psk is None:
+            digest = hmac.digest(
+                self._secret, f"{pair[0]}:{pair[1]}".encode("ascii"), hashlib.sha256
+            )
+            psk = base64.b64encode(digest).decode("ascii")
+            self._psks[pair] = psk
+        return psk
+
+    def _fragment(self, peer: Peer) -> tuple[str, str]:
+        """
+        Returns the parts of `peer`'s entry before and after its preshared key.
+        """
+        fragment = self._fragments.get(peer.name)
+        if fragment is None:
+            tail = CONFIG_MESH_PEER_TAIL.format(cidr4=peer.cidr4, cidr6=peer.cidr6)
+            if peer.endpoint:
+                tail += CONFIG_MESH_PEER_ENDPOINT.format(endpoint=peer.endpoint)
+            fragment = (
+                CONFIG_MESH_PEER_HEAD.format(
+                    name=peer.name, public_key=peer.public_key
+                ),
+                tail,
+            )
+            self._fragments[peer.name] = fragment
+        return fragment
+
+    def entries(self, peer: Peer) -> str:
+        """
+        Returns the [Peer] entries for every other mesh peer that either
+        side can reach, or nothing if `peer` is not part of the mesh.
+        """
+        if not peer.mesh:
+            return ""
+        parts: list[str] = []
+        for other in self.members:
+            # neither side of the pair could start a handshake
+            if other is peer or not (peer.endpoint or other.endpoint):
+                continue
+            head, tail = self._fragment(other)
+            parts.append(head)
+            parts.append(f"PresharedKey = {self.psk(peer, other)}\n")
+            parts.append(tail)
+            if not peer.endpoint:
+                parts.append(CONFIG_MESH_PEER_KEEPALIVE.format(keepalive=NAT_KEEPALIVE))
+        return "".join(parts)
+
+    def peer_config(
+        self,
+        peer: Peer,
+        endpoint_host: str | None = None,
+        endpoint_port: int | None = None,
+    ) -> str:
+        return peer.get_config(
+            vpn_cidr4=self.iface.routed_cidr4,
+            vpn_cidr6=self.iface.routed_cidr6,
+            nat_cidr4=self.iface.nat_cidr4,
+            nat_cidr6=self.iface.nat_cidr6,
+            endpoint_public_key=self.iface.public_key,
+            endpoint_host=(
+                endpoint_host if endpoint_host is not None else self.iface.host
+            ),
+            endpoint_port=(
+                endpoint_port if endpoint_port is not None else self.iface.port
+            ),
+            mesh_peers=self.entries(peer),
+            keepalive=Keepalive.interval(self.iface, peer),
+        )
@@ -0,0 +1,160 @@
+import csv
+import fnmatch
+import io
+import ipaddress
+import json
+import os
+import sys
+from typing import Any, Iterable, Iterator, TextIO
+
+from wgup.util import IP, ArgsException
+
+FORMATS = ("table", "json", "ndjson", "csv")
+
+# rows are joined and written in batches instead of one print() per row
+_BATCH = 1000
+
+
+class RowFilter:
+    """
+    Selects rows by a name glob, or by CIDR overlap if the pattern parses as
+    an IPv4/IPv6 network (e.g. "10.0.3.0/24" matches every peer inside it).
+    """
+
+    def __init__(self, pattern: str | None, cidr_fields: tuple[str, ...]):
+        self.pattern = pattern
+        self.cidr_fields = cidr_fields
+        self.block = None
+        if not pattern:
+            return
+        try:
+            network = ipaddress.ip_network(pattern, strict=False)
+        except ValueError:
+            return
+        self.version = network.version
+        self.block = (int(network.network_address), int(network.broadcast_address))
+
+    def match(self, row: dict[str, Any]) -> bool:
+        if not self.pattern:
+            return True
+        if self.block is None:
+            return fnmatch.fnmatchcase(row["name"], self.pattern)
+        for field in self.cidr_fields:
+            block = IP.block_range(row[field], self.version)
+            if (
+                block is not None
+                and block[0] <= self.block[1]
+                and block[1] >= self.block[0]
+            ):
+                return True
+        return False
+
+    def select(
+        self, rows: Iterable[dict[str, Any]], offset: int = 0, limit: int | None = None
+    ) -> Iterator[dict[str, Any]]:
+        """
+        Yields matching rows, skipping the first `offset` matches and stopping
+        after `limit` of them.
+        """
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ArgsException("[!] --offset and --limit must not be negative.")
+        return self._select(rows, offset, limit)
+
+    def _select(
+        self, rows: Iterable[dict[str, Any]], offset: int, limit: int | None
+    ) -> Iterator[dict[str, Any]]:
+        if limit == 0:
+            return
+        skipped = 0
+        emitted = 0
+        for row in rows:
+            if not self.match(row):
+                continue
+            if skipped < offset:
+                skipped += 1
+                continue
+            yield row
+            emitted += 1
+            if emitted == limit:
+                return
+
+
+class RowWriter:
+    """
+    Writes rows to stdout in one of FORMATS. Output is buffered and written
+    in batches; ndjson is flushed after the first row and after every batch
+    so consumers like jq start producing output right away.
+    """
+
+    def __init__(
+        self,
+        fmt: str,
+        fields: tuple[str, ...],
+        table_fmt: str,
+        out: TextIO | None = None,
+    ):
+        if fmt not in FORMATS:
+            raise ArgsException(f'[!] Unknown output format "{fmt}".')
+        self.fmt = fmt
+        self.fields = fields
+        self.table_fmt = table_fmt
+        self.out = out if out is not None else sys.stdout
+        self.count = 0
+        self.closed = False
+        self._buf: list[str] = []
+        if fmt == "csv":
+            self._csv_buf = io.StringIO()
+            self._csv = csv.writer(self._csv_buf, lineterminator="\n")
+            self._csv.writerow(fields)
+            self._take_csv()
+        elif fmt == "json":
+            self._buf.append("[")
+
+    def _take_csv(self):
+        self._buf.append(self._csv_buf.getvalue())
+        self._csv_buf.seek(0)
+        self._csv_buf.truncate()
+
+    def write(self, row: dict[str, Any]) -> bool:
+        """
+        Writes one row. Returns False once the reader has gone away (e.g.
+        `| head`), after which the caller should stop producing rows.
+        """
+        if self.closed:
+            return False
+        if self.fmt == "table":
+            self._buf.append(self.table_fmt.format(**row) + "\n")
+        elif self.fmt == "csv":
+            self._csv.writerow(row[f] for f in self.fields)
+            self._take_csv()
+        else:
+            line = json.dumps({f: row[f] for f in self.fields})
+            if self.fmt == "json":
+                line = ("\n  " if self.count == 0 else ",\n  ") + line
+            else:
+                line += "\n"
+            self._buf.append(line)
+        self.count += 1
+        if len(self._buf) >= _BATCH or (self.fmt == "ndjson" and self.count == 1):
+            self._flush()
+        return not self.closed
+
+    def close(self):
+        if self.fmt == "json":
+            self._buf.append("\n]\n" if self.count else "]\n")
+        self._flush()
+        self.closed = True
+
+    def _flush(self):
+        if self.closed:
+            return
+        try:
+            self.out.write("".join(self._buf))
+            self.out.flush()
+        except BrokenPipeError:
+            # Python would otherwise complain again while flushing at exit
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self.out.fileno())
+            os.close(devnull)
+            self.closed = True
+        self._buf.clear()
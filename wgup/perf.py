@@ -0,0 +1,103 @@
+import contextlib
+import cProfile
+import os
+import sys
+import time
+import tracemalloc
+
+_ENV_PROFILE = "WGUP_PROFILE"
+_ENV_PROFILE_OUT = "WGUP_PROFILE_OUT"
+
+_FMT_PHASE = "{:20} : {:>10.3f} ms {:>8}x"
+
+
+class Profile:
+    """
+    Collects per-phase timings, subprocess statistics and peak memory for a
+    single command. Everything here is a no-op unless profiling is enabled.
+    """
+
+    enabled = False
+    phases: dict[str, list[float]] = {}
+    commands: list[tuple[str, float]] = []
+    _start = 0.0
+    _profiler: cProfile.Profile | None = None
+    _profile_out: str | None = None
+
+    @staticmethod
+    def requested(flag: bool = False, profile_out: str | None = None):
+        """
+        Returns (enabled, profile_out) from the command line flags, falling
+        back to the WGUP_PROFILE and WGUP_PROFILE_OUT environment variables.
+        """
+        if profile_out is None:
+            profile_out = os.environ.get(_ENV_PROFILE_OUT) or None
+        env = os.environ.get(_ENV_PROFILE, "").lower() not in ("", "0", "no")
+        return flag or env or profile_out is not None, profile_out
+
+    @classmethod
+    def start(cls, profile_out: str | None = None):
+        cls.enabled = True
+        cls.phases = {}
+        cls.commands = []
+        cls._profile_out = profile_out
+        tracemalloc.start()
+        if profile_out:
+            cls._profiler = cProfile.Profile()
+            cls._profiler.enable()
+        cls._start = time.perf_counter()
+
+    @classmethod
+    def stop(cls):
+        if not cls.enabled:
+            return
+        total = time.perf_counter() - cls._start
+        if cls._profiler is not None:
+            cls._profiler.disable()
+            cls._profiler.dump_stats(cls._profile_out)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        cls.enabled = False
+        cls._report(total, peak)
+
+    @classmethod
+    @contextlib.contextmanager
+    def phase(cls, name: str):
+        if not cls.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.phases.setdefault(name, []).append(time.perf_counter() - start)
+
+    @classmethod
+    def record_command(cls, args: list[str], duration: float):
+        if cls.enabled:
+            words = 3 if args[0] == "sudo" else 2
+            cls.commands.append((" ".join(args[:words]), duration))
+
+    @classmethod
+    def _report(cls, total: float, peak: int):
+        out = sys.stderr
+        print("[i] Profile:", file=out)
+        for name, times in cls.phases.items():
+            print(_FMT_PHASE.format(name, sum(times) * 1000, len(times)), file=out)
+        commands_total = sum(d for _, d in cls.commands)
+        print(
+            _FMT_PHASE.format("subprocesses", commands_total * 1000, len(cls.commands)),
+            file=out,
+        )
+        by_command: dict[str, list[float]] = {}
+        for command, duration in cls.commands:
+            by_command.setdefault(command, []).append(duration)
+        for command, times in sorted(by_command.items()):
+            print(
+                _FMT_PHASE.format(f"  {command}", sum(times) * 1000, len(times)),
+                file=out,
+            )
+        print(_FMT_PHASE.format("total", total * 1000, 1), file=out)
+        print("{:20} : {:>10.1f} KiB".format("peak memory", peak / 1024), file=out)
+        if cls._profile_out:
+            print(f'[i] Wrote profile to "{cls._profile_out}"', file=out)
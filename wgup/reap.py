@@ -0,0 +1,106 @@
+import re
+import time
+
+from wgup.keepalive import Keepalive
+from wgup.util import ArgsException
+from wgup.wireguard import CONFIG_INTERFACE_PEER, Interface, Peer
+
+_REGEX_DURATION = re.compile(r"(\d+)([smhdw]?)")
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+# stands in for a base64 WireGuard key of the same length
+_PLACEHOLDER_KEY = "=" * 44
+
+
+class Reaper:
+    """
+    Finds peers that have not completed a handshake for a while, so that
+    abandoned peers can be disabled or removed in bulk.
+
+    `record` keeps the latest handshake that `wg show dump` has shown for each
+    peer in Peer.last_seen. A peer is idle since it was last seen or, if it
+    never was, since it was created (Peer.created). Peers that have neither
+    (created before either was recorded) are treated as seen the first time
+    they are checked, so they are only reaped after a full idle period.
+    """
+
+    @staticmethod
+    def parse_idle(value: str) -> int:
+        """
+        Returns a duration such as "30d", "12h" or "3600" in seconds, raising
+        ArgsException if it is invalid.
+        """
+        match = _REGEX_DURATION.fullmatch(value)
+        if not match or int(match.group(1)) <= 0:
+            raise ArgsException(
+                f'[!] "{value}" is not a duration (e.g. 3600, 90m, 12h, 30d, 4w).'
+            )
+        return int(match.group(1)) * _UNITS[match.group(2)]
+
+    @staticmethod
+    def age(seconds: float) -> str:
+        for unit in ("w", "d", "h", "m"):
+            if seconds >= _UNITS[unit]:
+                return f"{int(seconds // _UNITS[unit])}{unit}"
+        return f"{int(seconds)}s"
+
+    @staticmethod
+    def record(iface: Interface, dump: str, now: float | None = None) -> int:
+        """
+        Updates Peer.last_seen from the output of `wg show <iface> dump`.
+        Returns the number of peers that have completed a handshake.
+        """
+        if now is None:
+            now = time.time()
+        seen = Keepalive.parse_dump(dump)
+        count = 0
+        for peer in iface.peers.values():
+            entry = seen.get(peer.public_key)
+            if entry is not None and entry[1]:
+                peer.last_seen = max(peer.last_seen, entry[1])
+                count += 1
+            elif not peer.last_seen and not peer.created:
+                peer.last_seen = int(now)
+        return count
+
+    @staticmethod
+    def idle_since(peer: Peer) -> int:
+        return max(peer.last_seen, peer.created)
+
+    @staticmethod
+    def stale(iface: Interface, idle: int, now: float | None = None) -> list[Peer]:
+        """
+        Returns the enabled peers that have been idle for more than `idle`
+        seconds, by name.
+        """
+        if now is None:
+            now = time.time()
+        return list(
+            peer
+            for _, peer in sorted(iface.peers.items())
+            if peer.enabled and Reaper.idle_since(peer) < now - idle
+        )
+
+    @staticmethod
+    def savings(iface: Interface, peers: list[Peer]) -> tuple[int, int]:
+        """
+        Returns how many routes (AllowedIPs) and bytes of the interface's
+        config leaving out `peers` would save. Keys that are not loaded yet
+        are not read: their entries are sized with a placeholder preshared
+        key, which peers imported without one do not have.
+        """
+        entries = list(
+            (
+                iface.peer_entry(peer)
+                if peer.keys_loaded
+                else CONFIG_INTERFACE_PEER.format(
+                    name=peer.name,
+                    public_key=peer.public_key,
+                    preshared_key=_PLACEHOLDER_KEY,
+                    cidr4=peer.cidr4,
+                    cidr6=peer.cidr6,
+                )
+            )
+            for peer in peers
+        )
+        routes = sum(entry.count("AllowedIPs = ") for entry in entries)
+        return routes, sum(len(entry.encode("utf-8")) for entry in entries)
@@ -0,0 +1,118 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from wgup import defaults
+from wgup.keyderive import KeyDerivation
+from wgup.session import Session
+from wgup.wireguard import Interface
+
+_logger = logging.getLogger(defaults.PROG)
+
+
+class Rollout:
+    """
+    Rekeys the peers of an interface in batches instead of all at once.
+
+    The state of a rollout is kept in Interface.rollout and saved after every
+    batch, so an interrupted rollout resumes where it stopped, and cancelling
+    it (setting it to None) stops a running rollout after its current batch:
+
+        {
+            "pending": ["peer0", "peer1", ...],
+            "total": 1000,
+            "batch_size": 100,
+            "concurrency": 4,
+            "interval": 60.0,
+            "started": 1700000000,
+        }
+
+    With derived keys, the interface gets a new seed when the rollout starts
+    (like Interface.rekey), and the peers that are still pending keep their
+    keys stored until their batch is rekeyed.
+    """
+
+    @staticmethod
+    def start(
+        iface: Interface, batch_size: int, concurrency: int, interval: float
+    ) -> dict:
+        if iface.key_seed:
+            for peer in iface.peers.values():
+                peer.materialize()
+            iface.key_seed = KeyDerivation.new_seed()
+        iface.rollout = {
+            "pending": sorted(iface.peers.keys()),
+            "total": len(iface.peers),
+            "batch_size": batch_size,
+            "concurrency": concurrency,
+            "interval": interval,
+            "started": int(time.time()),
+        }
+        return iface.rollout
+
+    @staticmethod
+    def _rekey(iface: Interface, names: list[str], pool: ThreadPoolExecutor):
+        peers = list(iface.peers[n] for n in names if n in iface.peers)
+        if iface.key_seed:
+            # derived keys need no `wg`, just a new epoch each
+            for peer in peers:
+                iface.rekey_peer(peer)
+        else:
+            list(pool.map(lambda p: p.rekey(), peers))
+
+    @staticmethod
+    def run(
+        session: Session,
+        name: str,
+        apply: Callable[[], None] | None = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        Runs the rollout stored on the interface `name` to completion. Each
+        batch is rekeyed and committed in `session`, which locks the config
+        and reads it again first (see Session.begin), so changes made
+        elsewhere between batches are kept. After each batch, `apply` pushes
+        the new keys to the running interface.
+        """
+        pool: ThreadPoolExecutor | None = None
+        resumed = True
+        try:
+            while True:
+                session.begin()
+                try:
+                    iface = session.interface(name)
+                    state = iface.rollout
+                    # also stops a rollout that was cancelled in the meantime
+                    if state is None:
+                        return
+                    if resumed:
+                        resumed = False
+                        if apply is not None and len(state["pending"]) < state["total"]:
+                            # a previous run may have stopped between saving
+                            # and applying
+                            session.rollback()
+                            apply()
+                            continue
+                    if pool is None:
+                        pool = ThreadPoolExecutor(state["concurrency"])
+                    batch = state["pending"][: state["batch_size"]]
+                    Rollout._rekey(iface, batch, pool)
+                    state["pending"] = state["pending"][len(batch) :]
+                    if not state["pending"]:
+                        iface.rollout = None
+                    session.dirty = True
+                    session.commit()
+                finally:
+                    # only releases the lock once committed
+                    session.rollback()
+                if apply is not None:
+                    apply()
+                done = state["total"] - len(state["pending"])
+                _logger.info(f'Rekeyed {done}/{state["total"]} peers on "{name}".')
+                if not state["pending"]:
+                    return
+                sleep(state["interval"])
+        finally:
+            if pool is not None:
+                pool.shutdown()
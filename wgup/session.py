@@ -0,0 +1,483 @@
+from wgup.config import Config
+from wgup.group import Group
+from wgup.keepalive import Keepalive
+from wgup.mesh import Mesh
+from wgup.perf import Profile
+from wgup.shaping import Shaping
+from wgup.tuning import Tuning
+from wgup.util import (
+    IP,
+    ArgsException,
+    Input,
+    InterfaceExistsException,
+    InterfaceNotFoundException,
+    PeerExistsException,
+    PeerNotFoundException,
+)
+from wgup.wireguard import Interface, Peer
+
+
+def _check(result: tuple[bool, str], what: str):
+    valid, reason = result
+    if not valid:
+        raise ArgsException(f"[!] {what} is invalid:\n{reason}")
+
+
+class Session:
+    """
+    The operations behind `wgup iface` and `wgup peer`, for use as a library:
+
+        with wgup.Session() as s:
+            s.create_interface("wg0", host="vpn.example.com", port=51820)
+            s.create_peer("wg0", "laptop")
+            conf = s.peer_config("wg0", "laptop")
+
+    All changes made within the `with` block are saved at once when it ends.
+    If it raises, nothing is saved and the loaded config is read again. A
+    session can also be used without `with` by calling `begin`, and then
+    `commit` (or `rollback`).
+
+    Each session reads a config of its own (unless one is given), so a
+    long-lived session can be entered many times. Entering it takes the
+    config's lock, which other sessions and wgup commands also take before
+    changing the config, and reads the config again if it was saved since.
+    The lock is held until the changes are committed or rolled back.
+
+    Errors raise subclasses of ExitException, such as ArgsException for
+    invalid values and InterfaceNotFoundException or PeerNotFoundException
+    for unknown names. Their messages are what the CLI prints.
+    """
+
+    INTERFACE_ATTRIBUTES = (
+        "host",
+        "port",
+        "nat_iface",
+        "addr_mode",
+        "key_mode",
+    ) + Tuning.KEYS
+    PEER_ATTRIBUTES = (
+        "cidr4",
+        "cidr6",
+        "endpoint",
+        "mesh",
+        "keepalive",
+        "class",
+        "rate",
+        "enabled",
+    )
+
+    def __init__(self, config: Config | None = None):
+        if config is None:
+            config = Config.fresh()
+        self.config = config
+        self.dirty = False
+        self._lock = None
+
+    def __enter__(self):
+        self.begin()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def begin(self):
+        """
+        Takes the config's lock, reading the config again if it was saved
+        elsewhere since it was loaded.
+        """
+        if self._lock is None:
+            self._lock = self.config.lock()
+        if not self.dirty and self.config.changed():
+            self.config.reload()
+
+    def _release(self):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def commit(self):
+        """
+        Saves all changes made since the last commit, and releases the lock.
+        """
+        try:
+            if self.dirty:
+                self.config.save()
+                self.dirty = False
+        finally:
+            self._release()
+
+    def rollback(self):
+        """
+        Discards all changes made since the last commit, and releases the
+        lock.
+        """
+        try:
+            if self.dirty:
+                self.config.reload()
+                self.dirty = False
+        finally:
+            self._release()
+
+    # interfaces
+
+    @property
+    def interfaces(self) -> dict[str, Interface]:
+        return self.config.interfaces
+
+    def interface(self, name: str) -> Interface:
+        iface = self.config.interfaces.get(name)
+        if iface is None:
+            raise InterfaceNotFoundException(f'[!] Interface "{name}" does not exist.')
+        return iface
+
+    def create_interface(
+        self,
+        name: str,
+        *,
+        host: str,
+        port: int,
+        cidr4: str = "",
+        cidr6: str = "",
+        nat_iface: str = "",
+        addr_mode: str = "independent",
+        key_mode: str = "stored",
+    ) -> Interface:
+        """
+        Creates an interface. Its address pools are chosen at random if not
+        given.
+        """
+        _check(Input.check_iface(name), "Interface name")
+        if name in self.config.interfaces:
+            raise InterfaceExistsException(
+                "[!] An interface with this name already exists! Please choose a different name."
+            )
+        if cidr4:
+            _check(Input.check_cidr4(cidr4), "IPv4 CIDR block")
+        else:
+            cidr4 = IP.auto_cidr4()
+        if cidr6:
+            _check(Input.check_cidr6(cidr6), "IPv6 CIDR block")
+        else:
+            cidr6 = IP.auto_cidr6()
+        _check(Input.check_int(port, min_value=1, max_value=65535), "Port")
+        if not host:
+            raise ArgsException("[!] Host is required.")
+        if nat_iface:
+            _check(Input.check_iface(nat_iface), "NAT interface")
+        if addr_mode not in Interface.ADDR_MODES:
+            raise ArgsException(
+                f"[!] Address mode must be one of: {", ".join(Interface.ADDR_MODES)}"
+            )
+        self._check_key_mode(key_mode)
+        iface = Interface.create(
+            vpn_iface=name,
+            vpn_cidr4=cidr4,
+            vpn_cidr6=cidr6,
+            host=host,
+            port=int(port),
+        )
+        iface.nat_iface = nat_iface
+        iface.addr_mode = addr_mode
+        iface.set_key_mode(key_mode)
+        self.config.interfaces[name] = iface
+        self.dirty = True
+        return iface
+
+    @staticmethod
+    def _check_key_mode(value: str):
+        if value not in Interface.KEY_MODES:
+            raise ArgsException(
+                f"[!] Key mode must be one of: {", ".join(Interface.KEY_MODES)}"
+            )
+
+    def remove_interface(self, name: str):
+        self.interface(name)
+        del self.config.interfaces[name]
+        self.config.keystore.invalidate()
+        self.dirty = True
+
+    def set_interface(self, name: str, attribute: str, value: str):
+        """
+        Sets one of INTERFACE_ATTRIBUTES from its string form.
+        """
+        iface = self.interface(name)
+        match attribute:
+            case "name":
+                raise ArgsException("[!] Interfaces cannot be renamed.")
+            case "host":
+                iface.host = value
+            case "port":
+                _check(Input.check_int(value, min_value=1, max_value=65535), "Port")
+                iface.port = int(value)
+            case "nat_iface":
+                _check(Input.check_iface(value), "NAT interface")
+                iface.nat_iface = value
+            case "addr_mode":
+                if value not in Interface.ADDR_MODES:
+                    raise ArgsException(
+                        f"[!] Address mode must be one of: {", ".join(Interface.ADDR_MODES)}"
+                    )
+                iface.addr_mode = value
+            case "key_mode":
+                self._check_key_mode(value)
+                iface.set_key_mode(value)
+            case _ if attribute in Tuning.KEYS:
+                parsed = Tuning.parse(attribute, value)
+                if parsed is None:
+                    iface.tuning.pop(attribute, None)
+                else:
+                    iface.tuning[attribute] = parsed
+            case _:
+                raise ArgsException(
+                    f"[!] Please specify one of the following attributes: {", ".join(self.INTERFACE_ATTRIBUTES)}"
+                )
+        self.dirty = True
+
+    def add_nat(self, name: str, cidr4: str = "", cidr6: str = ""):
+        if not (cidr4 or cidr6):
+            raise ArgsException(
+                "[!] Please specify an IPv4 or IPv6 destination (or both)."
+            )
+        iface = self.interface(name)
+        if cidr4:
+            _check(Input.check_cidr4(cidr4), "IPv4 CIDR")
+        if cidr6:
+            _check(Input.check_cidr6(cidr6), "IPv6 CIDR")
+        if cidr4 and cidr4 not in iface.nat_cidr4:
+            iface.nat_cidr4.append(cidr4)
+        if cidr6 and cidr6 not in iface.nat_cidr6:
+            iface.nat_cidr6.append(cidr6)
+        self.dirty = True
+
+    def remove_nat(self, name: str, cidr4: str = "", cidr6: str = ""):
+        if not (cidr4 or cidr6):
+            raise ArgsException(
+                "[!] Please specify an IPv4 or IPv6 destination (or both)."
+            )
+        iface = self.interface(name)
+        if cidr4:
+            _check(Input.check_cidr4(cidr4), "IPv4 CIDR")
+        if cidr6:
+            _check(Input.check_cidr6(cidr6), "IPv6 CIDR")
+        for cidr, dests in ((cidr4, iface.nat_cidr4), (cidr6, iface.nat_cidr6)):
+            if cidr and cidr not in dests:
+                raise ArgsException(
+                    f'[!] NAT to {cidr} does not exist on interface "{name}".'
+                )
+        if cidr4:
+            iface.nat_cidr4.remove(cidr4)
+        if cidr6:
+            iface.nat_cidr6.remove(cidr6)
+        self.dirty = True
+
+    def set_keepalive(self, name: str, policy: str, peer_class: str = ""):
+        """
+        Sets the keepalive policy of a class of peers, or of the whole
+        interface if no class is given. "default" removes the policy.
+        """
+        iface = self.interface(name)
+        policy = "" if policy == "default" else Keepalive.parse(policy)
+        key = peer_class or Keepalive.DEFAULT_CLASS
+        if policy:
+            iface.keepalive[key] = policy
+        else:
+            iface.keepalive.pop(key, None)
+        self.dirty = True
+
+    def set_rate(self, name: str, rate: str, peer_class: str = ""):
+        """
+        Sets the rate limit of a class of peers, or the total of the
+        interface if no class is given. "off" removes the limit.
+        """
+        iface = self.interface(name)
+        rate = "" if rate == "off" else Shaping.parse_rate(rate)
+        if peer_class:
+            classes = iface.shaping.setdefault("classes", {})
+            if rate:
+                classes[peer_class] = rate
+            else:
+                classes.pop(peer_class, None)
+                if not classes:
+                    del iface.shaping["classes"]
+        elif rate:
+            iface.shaping["total"] = rate
+        else:
+            iface.shaping.pop("total", None)
+        self.dirty = True
+
+    def rekey_interface(self, name: str):
+        """
+        Generates new keys for an interface and all of its peers.
+        """
+        self.interface(name).rekey()
+        self.dirty = True
+
+    def interface_config(self, name: str) -> str:
+        iface = self.interface(name)
+        with Profile.phase("render"):
+            return iface.get_config()
+
+    # peers
+
+    def peer(self, interface: str, name: str) -> Peer:
+        peer = self.interface(interface).peers.get(name)
+        if peer is None:
+            raise PeerNotFoundException(f'[!] Peer "{name}" does not exist.')
+        return peer
+
+    def _peer_scope(self, iface: Interface) -> list[Interface]:
+        # peers move between group members, so names are unique across them
+        if iface.group:
+            return Group.members(self.config.interfaces, iface.group)
+        return [iface]
+
+    def _check_new_peers(self, ifaces: list[Interface], names: list[str]):
+        for name in names:
+            _check(Input.check_peer_name(name), f'Peer name "{name}"')
+            if any(name in iface.peers for iface in ifaces):
+                raise PeerExistsException(
+                    f'[!] A peer named "{name}" already exists! Please choose a different name.'
+                )
+
+    def create_peer(
+        self, interface: str, name: str, cidr4: str = "", cidr6: str = ""
+    ) -> Peer:
+        """
+        Creates a peer with the next free addresses, unless they are given.
+        """
+        iface = self.interface(interface)
+        self._check_new_peers(self._peer_scope(iface), [name])
+        if cidr4:
+            _check(Input.check_cidr4(cidr4), "IPv4 CIDR block")
+        if cidr6:
+            _check(Input.check_cidr6(cidr6), "IPv6 CIDR block")
+        with Profile.phase("allocate"):
+            if not cidr4:
+                used4 = list(peer.cidr4 for peer in iface.peers.values())
+                cidr4 = IP.next_addr4(iface.vpn_cidr4, used4)
+            if not cidr6:
+                used6 = list(peer.cidr6 for peer in iface.peers.values())
+                cidr6 = iface.pair_addr6(name, cidr4, set(used6)) or IP.next_addr6(
+                    iface.vpn_cidr6, used6
+                )
+        peer = iface.create_peer(name, cidr4, cidr6)
+        iface.peers[name] = peer
+        self.dirty = True
+        return peer
+
+    def create_peers(self, interface: str, names: list[str]) -> list[Peer]:
+        """
+        Creates peers with addresses allocated in a single pass, generating
+        their keys concurrently.
+        """
+        iface = self.interface(interface)
+        self._check_new_peers(self._peer_scope(iface), names)
+        with Profile.phase("allocate"):
+            addrs = iface.allocate(names)
+        peers = iface.create_peers(
+            list((name, cidr4, cidr6) for name, (cidr4, cidr6) in zip(names, addrs))
+        )
+        for peer in peers:
+            iface.peers[peer.name] = peer
+        self.dirty = True
+        return peers
+
+    def create_peers_in_group(
+        self, group: str, names: list[str]
+    ) -> dict[str, list[Peer]]:
+        """
+        Creates peers on the least loaded members of an interface group.
+        Returns the new peers by member interface.
+        """
+        members = Group.members(self.config.interfaces, group)
+        if not members:
+            raise InterfaceNotFoundException(
+                f'[!] Interface group "{group}" does not exist.'
+            )
+        self._check_new_peers(members, names)
+        placed: dict[str, list[str]] = {}
+        for name, member in zip(names, Group.place(members, len(names))):
+            placed.setdefault(member.vpn_iface, []).append(name)
+        targets: list[tuple[Interface, tuple[str, str, str]]] = []
+        for member in members:
+            member_names = placed.get(member.vpn_iface)
+            if not member_names:
+                continue
+            with Profile.phase("allocate"):
+                addrs = member.allocate(member_names)
+            for name, (cidr4, cidr6) in zip(member_names, addrs):
+                targets.append((member, (name, cidr4, cidr6)))
+        # generate the random keys for all members in one go
+        stored = list(addr for member, addr in targets if not member.key_seed)
+        generated = iter(Peer.create_many(stored) if stored else [])
+        created: dict[str, list[Peer]] = {}
+        for member, addr in targets:
+            if member.key_seed:
+                peer = member.create_peer(*addr)
+            else:
+                peer = next(generated)
+            member.peers[peer.name] = peer
+            created.setdefault(member.vpn_iface, []).append(peer)
+        self.dirty = True
+        return created
+
+    def remove_peer(self, interface: str, name: str):
+        peer = self.peer(interface, name)
+        del self.interface(interface).peers[name]
+        if peer.key_epoch is None:
+            # derived keys are not in the keystore
+            self.config.keystore.invalidate()
+        self.dirty = True
+
+    def set_peer(self, interface: str, name: str, attribute: str, value: str):
+        """
+        Sets one of PEER_ATTRIBUTES from its string form.
+        """
+        peer = self.peer(interface, name)
+        match attribute:
+            case "name":
+                raise ArgsException("[!] Peers cannot be renamed.")
+            case "cidr4":
+                # TODO ensure CIDRs are in network and unused
+                _check(Input.check_cidr4(value), "IPv4 CIDR block")
+                peer.cidr4 = value
+            case "cidr6":
+                _check(Input.check_cidr6(value), "IPv6 CIDR block")
+                peer.cidr6 = value
+            case "endpoint":
+                _check(Input.check_endpoint(value, optional=True), "Endpoint")
+                peer.endpoint = value
+            case "mesh":
+                if value not in ("on", "off"):
+                    raise ArgsException('[!] Mesh must be "on" or "off".')
+                peer.mesh = value == "on"
+            case "keepalive":
+                peer.keepalive = "" if value == "default" else Keepalive.parse(value)
+            case "class":
+                _check(Input.check_peer_name(value, optional=True), "Class name")
+                peer.peer_class = value
+            case "rate":
+                peer.rate = "" if value == "off" else Shaping.parse_rate(value)
+            case "enabled":
+                if value not in ("on", "off"):
+                    raise ArgsException('[!] Enabled must be "on" or "off".')
+                peer.enabled = value == "on"
+            case _:
+                raise ArgsException(
+                    f"[!] Please specify one of the following attributes: {", ".join(self.PEER_ATTRIBUTES)}"
+                )
+        self.dirty = True
+
+    def rekey_peer(self, interface: str, name: str):
+        self.interface(interface).rekey_peer(self.peer(interface, name))
+        self.dirty = True
+
+    def peer_config(self, interface: str, name: str) -> str:
+        iface = self.interface(interface)
+        peer = self.peer(interface, name)
+        with Profile.phase("render"):
+            return Mesh(iface).peer_config(peer)
@@ -0,0 +1,213 @@
+import ipaddress
+import re
+from typing import Any, Iterable
+
+from wgup.util import ArgsException
+
+# Rate of the root class when no total is set
+DEFAULT_TOTAL = "10gbit"
+
+# Lower bound for a peer's share of its class
+MIN_RATE = 8000
+
+_REGEX_RATE = re.compile(r"(\d+(?:\.\d+)?)(bit|kbit|mbit|gbit|tbit)", re.IGNORECASE)
+_UNITS = {"bit": 1, "kbit": 10**3, "mbit": 10**6, "gbit": 10**9, "tbit": 10**12}
+
+# HTB class minors are 16 bit; ffff is the default (unshaped) class
+_DEFAULT_MINOR = 0xFFFF
+_FIRST_MINOR = 2
+
+# u32 hash table for IPv4 filters, keyed on the last octet of the destination
+_HASH_TABLE = "2:"
+
+# The batch is kept in the config itself as comments, so that it is installed
+# and synced along with it. wg-quick ignores comments.
+BATCH_PREFIX = "#tc "
+
+# wg-quick cuts every line at the first "#", PostUp included, so the command
+# that extracts the batch must match the prefix without spelling out "#"
+_BATCH_PATTERN = BATCH_PREFIX.replace("#", r"\x23")
+
+SHAPING_POST_UP = (
+    f"sed -n 's/^{_BATCH_PATTERN}//p' /etc/wireguard/%i.conf | tc -batch -"
+)
+SHAPING_PRE_DOWN = "tc qdisc del dev %i root || true"
+
+CONFIG_SHAPING = f"""
+# Shaping: rate limits for traffic to peers (see the {BATCH_PREFIX!r} lines below)
+PostUp = {SHAPING_POST_UP}
+PreDown = {SHAPING_PRE_DOWN}
+"""
+
+
+class Shaping:
+    """
+    Renders per-peer and per-class rate limits for traffic sent to peers as
+    an HTB hierarchy with an fq_codel queue for each shaped peer. The limits
+    are kept in Peer.rate and Interface.shaping:
+
+        {
+            "total": "1gbit",  # the whole interface, DEFAULT_TOTAL if unset
+            "classes": {"mobile": "100mbit", ...},  # by Peer.peer_class
+        }
+
+    and become:
+
+        1:      htb root, unshaped traffic goes to 1:ffff
+        1:1     the total
+        1:N     one class per limited class that has peers
+        1:M     one leaf per shaped peer, under its class or under 1:1
+
+    A peer with its own rate (Peer.rate) is limited to it. A peer in a class
+    with a limit shares that limit with the other peers of the class.
+
+    Packets are classified by destination address. IPv4 uses a u32 hash
+    table with 256 buckets keyed on the last octet of the address, and IPv6
+    uses flower, which hashes on the masked key itself, so the cost of
+    classification does not grow with the number of peers. All commands are
+    emitted as one `tc -batch` script.
+    """
+
+    @staticmethod
+    def parse_rate(value: str) -> str:
+        """
+        Returns `value` as a tc rate, raising ArgsException if it is invalid.
+        """
+        match = _REGEX_RATE.fullmatch(value)
+        if not match or float(match.group(1)) <= 0:
+            raise ArgsException(
+                f'[!] "{value}" is not a rate (e.g. 500kbit, 20mbit, 1gbit).'
+            )
+        return value.lower()
+
+    @staticmethod
+    def bits(rate: str) -> int:
+        match = _REGEX_RATE.fullmatch(rate)
+        if not match:
+            raise ArgsException(f'[!] "{rate}" is not a rate.')
+        return int(float(match.group(1)) * _UNITS[match.group(2).lower()])
+
+    @staticmethod
+    def format_rate(bits: int) -> str:
+        """
+        Returns `bits` (bit/s) as a rate in the largest unit that divides it.
+        """
+        for unit in ("tbit", "gbit", "mbit", "kbit"):
+            if bits and bits % _UNITS[unit] == 0:
+                return f"{bits // _UNITS[unit]}{unit}"
+        return f"{bits}bit"
+
+    @staticmethod
+    def _leaves(shaping: dict, peers: Iterable[Any]) -> list[tuple[Any, str, int, int]]:
+        """
+        Returns (peer, class, rate, ceil) in bit/s for every shaped peer.
+        """
+        classes = shaping.get("classes", {})
+        members: dict[str, int] = {}
+        shaped: list[Any] = []
+        for peer in sorted(peers, key=lambda p: p.name):
+            if peer.peer_class in classes:
+                members[peer.peer_class] = members.get(peer.peer_class, 0) + 1
+                shaped.append(peer)
+            elif peer.rate:
+                shaped.append(peer)
+        leaves: list[tuple[Any, str, int, int]] = []
+        for peer in shaped:
+            if peer.peer_class in classes:
+                limit = Shaping.bits(classes[peer.peer_class])
+                share = max(limit // members[peer.peer_class], MIN_RATE)
+                ceil = limit
+                if peer.rate:
+                    ceil = min(ceil, Shaping.bits(peer.rate))
+                leaves.append((peer, peer.peer_class, min(share, ceil), ceil))
+            else:
+                rate = Shaping.bits(peer.rate)
+                leaves.append((peer, "", rate, rate))
+        return leaves
+
+    @staticmethod
+    def batch(dev: str, pool4: str, shaping: dict, peers: Iterable[Any]) -> str:
+        """
+        Returns the `tc -batch` script for the interface `dev` whose IPv4 pool
+        is `pool4`, or nothing if none of its peers are shaped.
+        """
+        leaves = Shaping._leaves(shaping, peers)
+        if not leaves:
+            return ""
+        total = Shaping.bits(shaping.get("total", DEFAULT_TOTAL))
+        classes = shaping.get("classes", {})
+        used = sorted(set(parent for _, parent, _, _ in leaves if parent))
+        if _FIRST_MINOR + len(used) + len(leaves) >= _DEFAULT_MINOR:
+            raise ArgsException("[!] Too many shaped peers for one interface.")
+        lines = [
+            f"qdisc add dev {dev} root handle 1: htb default {_DEFAULT_MINOR:x}",
+            f"class add dev {dev} parent 1: classid 1:1 htb rate {total}bit",
+            f"class add dev {dev} parent 1:1 classid 1:{_DEFAULT_MINOR:x} htb rate {total}bit",
+            f"qdisc add dev {dev} parent 1:{_DEFAULT_MINOR:x} fq_codel",
+        ]
+        minor = _FIRST_MINOR
+        parents: dict[str, str] = {"": "1:1"}
+        for name in used:
+            limit = Shaping.bits(classes[name])
+            lines.append(
+                f"class add dev {dev} parent 1:1 classid 1:{minor:x} htb rate {limit}bit ceil {limit}bit"
+            )
+            parents[name] = f"1:{minor:x}"
+            minor += 1
+        flows: list[tuple[Any, str]] = []
+        for peer, parent, rate, ceil in leaves:
+            flow = f"1:{minor:x}"
+            lines.append(
+                f"class add dev {dev} parent {parents[parent]} classid {flow} htb rate {rate}bit ceil {ceil}bit"
+            )
+            lines.append(f"qdisc add dev {dev} parent {flow} fq_codel")
+            flows.append((peer, flow))
+            minor += 1
+        lines.extend(Shaping._filters4(dev, pool4, flows))
+        lines.extend(
+            f"filter add dev {dev} parent 1: prio 2 protocol ipv6 flower dst_ip {peer.cidr6} classid {flow}"
+            for peer, flow in flows
+        )
+        return "".join(f"{line}\n" for line in lines)
+
+    @staticmethod
+    def _filters4(dev: str, pool4: str, flows: list[tuple[Any, str]]) -> list[str]:
+        network = ipaddress.IPv4Network(pool4)
+        hashed: list[tuple[int, Any, str]] = []
+        direct: list[tuple[Any, str]] = []
+        for peer, flow in flows:
+            addr = ipaddress.IPv4Network(peer.cidr4, strict=False)
+            if addr.prefixlen == 32 and addr.subnet_of(network):
+                hashed.append((int(addr.network_address) & 0xFF, peer, flow))
+            else:
+                direct.append((peer, flow))
+        base = f"filter add dev {dev} parent 1: prio 1 protocol ip u32"
+        lines = [
+            f"filter add dev {dev} parent 1: prio 1 handle {_HASH_TABLE} protocol ip u32 divisor 256"
+        ]
+        # blocks that cannot be hashed by their last octet are matched first
+        lines.extend(
+            f"{base} ht 800:: match ip dst {peer.cidr4} flowid {flow}"
+            for peer, flow in direct
+        )
+        lines.append(
+            f"{base} ht 800:: match ip dst {network} hashkey mask 0x000000ff at 16 link {_HASH_TABLE}"
+        )
+        lines.extend(
+            f"{base} ht {_HASH_TABLE}{bucket:x}: match ip dst {peer.cidr4} flowid {flow}"
+            for bucket, peer, flow in sorted(hashed, key=lambda h: h[0])
+        )
+        return lines
+
+    @staticmethod
+    def config(dev: str, pool4: str, shaping: dict, peers: Iterable[Any]) -> str:
+        """
+        Returns the PostUp/PreDown steps that apply the batch, followed by the
+        batch itself.
+        """
+        batch = Shaping.batch(dev, pool4, shaping, peers)
+        if not batch:
+            return ""
+        return CONFIG_SHAPING + "".join(
+            f"{BATCH_PREFIX}{line}\n" for line in batch.splitlines()
+        )
@@ -0,0 +1,243 @@
+"""
+Binary snapshot of interfaces.json.
+
+Parsing JSON dominates the startup of commands on large configs. The snapshot
+holds the same data encoded with marshal, which Python decodes several times
+faster, and is only used while it matches interfaces.json exactly (same mtime,
+size and SHA-256). It is written whenever the config is saved, and rebuilt
+while interfaces.json is read if it is missing or stale. Layout:
+
+    header   magic, format, marshal version, key of interfaces.json, and the
+             offset and length of the index
+    chunks   each interface's peers, _CHUNK at a time and stored a key at a
+             time (see Peer.from_columns), then the interface itself
+             without its peers
+    index    the config version, and for each interface its name and the
+             offsets of its chunks
+
+Interfaces that were not asked for are never decoded, and peers are decoded a
+chunk at a time, so loading does not hold all raw peers at once. Like
+interfaces.json, the snapshot has no keys unless the config is from version 1.
+"""
+
+import hashlib
+import logging
+import marshal
+import mmap
+import os
+import struct
+from typing import Iterable
+
+from wgup import defaults
+from wgup.keystore import InterfaceKeys, Keystore
+from wgup.wireguard import Interface, Peer
+
+SNAPSHOT_FILE = "interfaces.snapshot"
+
+_MAGIC = b"WGUPSNAP"
+_HEADER = struct.Struct("<8sIIqQ32sQQ")
+_CHUNK = 4096
+# what decoding a damaged snapshot can raise
+_DAMAGED = (EOFError, ValueError, TypeError, KeyError, IndexError, AttributeError)
+
+_logger = logging.getLogger(defaults.PROG)
+
+# (mtime in ns, size, SHA-256) of interfaces.json
+Key = tuple[int, int, bytes]
+
+
+class Snapshot:
+    FORMAT = 1
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    @staticmethod
+    def key(source: str, raw: bytes | None = None) -> Key:
+        """
+        Returns the key of `source`. Pass `raw` if its content is already at
+        hand, to avoid reading it again.
+        """
+        with open(source, "rb") as f:
+            st = os.fstat(f.fileno())
+            if raw is None:
+                digest = hashlib.sha256()
+                if st.st_size:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        digest.update(mm)
+            else:
+                digest = hashlib.sha256(raw)
+        return st.st_mtime_ns, st.st_size, digest.digest()
+
+    def load(
+        self, source: str, only: set[str] | None, keystore: Keystore
+    ) -> list[Interface] | None:
+        """
+        Returns the interfaces in the snapshot, skipping any whose name is not
+        in `only` (if given), or None if it does not match `source`.
+        """
+        try:
+            f = open(self.filename, "rb")
+        except OSError:
+            return None
+        with f:
+            header = f.read(_HEADER.size)
+            if len(header) != _HEADER.size:
+                return None
+            magic, fmt, marshal_version, *key, offset, length = _HEADER.unpack(header)
+            if (magic, fmt, marshal_version) != (_MAGIC, self.FORMAT, marshal.version):
+                return None
+            st = os.stat(source)
+            if (st.st_mtime_ns, st.st_size) != tuple(key[:2]):
+                return None
+            if self.key(source) != tuple(key):
+                return None
+            try:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    return self._read(mm, offset, length, only, keystore)
+            except _DAMAGED as e:
+                _logger.debug(f"Ignoring damaged snapshot: {e}")
+                return None
+
+    @staticmethod
+    def _read(
+        mm: mmap.mmap,
+        offset: int,
+        length: int,
+        only: set[str] | None,
+        keystore: Keystore,
+    ) -> list[Interface] | None:
+        index = marshal.loads(mm[offset : offset + length])
+        version = index["version"]
+        if version not in defaults.CONFIG_VERSIONS_READ:
+            return None
+        interfaces: list[Interface] = []
+        for name, (start, size), chunks in index["interfaces"]:
+            if only is not None and name not in only:
+                continue
+            data = marshal.loads(mm[start : start + size])
+            data["peers"] = []
+            secrets = InterfaceKeys(keystore, name) if version >= 2 else None
+            iface = Interface.from_json(data, secrets)
+            for s, n in chunks:
+                # a seed that is not in the snapshot is read from the keystore
+                for peer in Peer.from_columns(
+                    marshal.loads(mm[s : s + n]), None if secrets else "", secrets
+                ):
+                    if secrets is None and peer.key_epoch is not None:
+                        peer.key_seed = iface.key_seed
+                    iface.peers[peer.name] = peer
+            interfaces.append(iface)
+        return interfaces
+
+    def writer(self, key: Key) -> "SnapshotWriter | None":
+        """
+        Returns a writer for a new snapshot of the config with `key`, or None
+        if it cannot be written (the config is used without one).
+        """
+        try:
+            return SnapshotWriter(self.filename, key)
+        except OSError as e:
+            _logger.debug(f"Not writing snapshot: {e}")
+            return None
+
+    def save(self, key: Key, version: int, interfaces: Iterable[dict]):
+        """
+        Writes a snapshot of `interfaces`, as stored in interfaces.json.
+        """
+        writer = self.writer(key)
+        if writer is None:
+            return
+        for data in interfaces:
+            for peer in data["peers"]:
+                writer.peer(peer)
+            writer.interface(data)
+        writer.close(version)
+
+
+class SnapshotWriter:
+    """
+    Writes a snapshot an interface at a time: first each of its peers with
+    `peer`, then the interface with `interface`. Nothing replaces the current
+    snapshot until `close`. Write errors are logged and leave the current
+    snapshot alone, since the config can always be read without one.
+    """
+
+    def __init__(self, filename: str, key: Key):
+        self.filename = filename
+        self.key = key
+        self._temp_filename = f"{filename}.tmp"
+        fd = os.open(self._temp_filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        self._file = os.fdopen(fd, "wb")
+        self._file.write(bytes(_HEADER.size))
+        self._offset = _HEADER.size
+        self._index: list = []
+        self._chunks: list[tuple[int, int]] = []
+        self._peers: list[dict] = []
+
+    def _write(self, data) -> tuple[int, int]:
+        raw = marshal.dumps(data)
+        offset = self._offset
+        if not self._file.closed:
+            try:
+                self._file.write(raw)
+            except OSError as e:
+                _logger.debug(f"Not writing snapshot: {e}")
+                self.abort()
+        self._offset += len(raw)
+        return offset, len(raw)
+
+    def _flush(self):
+        keys = dict.fromkeys(k for p in self._peers for k in p)
+        columns = dict((k, list(p.get(k) for p in self._peers)) for k in keys)
+        self._chunks.append(self._write(columns))
+        self._peers = []
+
+    def peer(self, data: dict):
+        self._peers.append(data)
+        if len(self._peers) >= _CHUNK:
+            self._flush()
+
+    def interface(self, data: dict):
+        """
+        Ends the current interface. `data` is the interface as stored in
+        interfaces.json, and its peers are ignored.
+        """
+        if self._peers:
+            self._flush()
+        data = dict((k, v) for k, v in data.items() if k != "peers")
+        self._index.append((data["vpn_iface"], self._write(data), self._chunks))
+        self._chunks = []
+
+    def close(self, version: int):
+        """
+        Writes the index and replaces the current snapshot.
+        """
+        offset, length = self._write({"version": version, "interfaces": self._index})
+        if self._file.closed:
+            return
+        try:
+            self._file.seek(0)
+            self._file.write(
+                _HEADER.pack(
+                    _MAGIC, Snapshot.FORMAT, marshal.version, *self.key, offset, length
+                )
+            )
+            self._file.close()
+            os.replace(self._temp_filename, self.filename)
+        except OSError as e:
+            _logger.debug(f"Not writing snapshot: {e}")
+            self.abort()
+            return
+        _logger.debug("Saved snapshot.")
+
+    def abort(self):
+        """
+        Discards the new snapshot.
+        """
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self._temp_filename)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,187 @@
+import os
+import re
+
+from wgup.util import ArgsException, Input
+
+SYSFS_NET = "/sys/class/net"
+
+# Outer IPv6 header (40) + UDP (8) + WireGuard header and auth tag (32). Using
+# the IPv6 overhead keeps the tunnel unfragmented over either address family.
+WIREGUARD_OVERHEAD = 80
+
+# Used when the uplink's MTU cannot be read
+DEFAULT_LINK_MTU = 1500
+
+CONFIG_TUNING_TXQUEUELEN = """PostUp = ip link set dev %i txqueuelen {txqueuelen}
+"""
+
+# UDP GRO forwarding lets the uplink hand batches of WireGuard packets to the
+# kernel at once, and GSO lets it send them the same way.
+# Not every driver supports these, which should not keep the tunnel down.
+CONFIG_TUNING_OFFLOAD = """PostUp = ethtool -K {link} rx-udp-gro-forwarding {state} rx-gro-list off || true
+PostUp = ethtool -K {link} gso {state} gro {state} || true
+"""
+
+# hex CPU masks, optionally in comma-separated groups as sysfs shows them
+_REGEX_MASK = re.compile(r"[0-9a-fA-F]+(,[0-9a-fA-F]+)*")
+
+CONFIG_TUNING_RPS = """PostUp = for q in /sys/class/net/{link}/queues/rx-*; do echo {mask} > $q/rps_cpus; done || true
+"""
+
+
+class Tuning:
+    """
+    Per-interface performance settings, kept in Interface.tuning:
+
+        {
+            "mtu": "auto" or 1420,  # "auto": uplink MTU - WIREGUARD_OVERHEAD
+            "fwmark": "0xca6c",
+            "table": "off" or "auto" or "1234",
+            "txqueuelen": 1000,
+            "offload": "on" or "off",  # UDP GRO/GSO on the uplink
+            "rps": "all" or "f",  # CPU mask for receive packet steering
+        }
+
+    Missing keys keep wg-quick's and the kernel's defaults. MTU, FwMark and
+    Table are rendered as [Interface] directives, everything else as PostUp
+    steps. Offloads and RPS apply to the uplink (nat_iface), since that is
+    where encrypted packets are received.
+    """
+
+    KEYS = ("mtu", "fwmark", "table", "txqueuelen", "offload", "rps")
+
+    @staticmethod
+    def parse(key: str, value: str) -> str | int | None:
+        """
+        Returns the value to store for `key`, or None to remove the setting
+        ("off" or "default", except for offload and table where "off" is a
+        setting of its own). Raises ArgsException if the value is invalid.
+        """
+        if value == "default" or (value == "off" and key not in ("offload", "table")):
+            return None
+        match key:
+            case "mtu":
+                if value == "auto":
+                    return value
+                valid, reason = Input.check_int(value, min_value=1280, max_value=9000)
+                if not valid:
+                    raise ArgsException(f"[!] MTU is invalid: {reason}")
+                return int(value)
+            case "txqueuelen":
+                valid, reason = Input.check_int(value, min_value=1)
+                if not valid:
+                    raise ArgsException(f"[!] txqueuelen is invalid: {reason}")
+                return int(value)
+            case "fwmark":
+                try:
+                    int(value, 0)
+                except ValueError:
+                    raise ArgsException("[!] FwMark must be a number (e.g. 0xca6c).")
+                return value
+            case "table":
+                if value in ("off", "auto"):
+                    return value
+                valid, reason = Input.check_int(value, min_value=1)
+                if not valid:
+                    raise ArgsException('[!] Table must be "off", "auto" or a number.')
+                return value
+            case "offload":
+                if value not in ("on", "off"):
+                    raise ArgsException('[!] Offload must be "on" or "off".')
+                return value
+            case "rps":
+                if value == "all":
+                    return value
+                mask = Tuning.parse_mask(value)
+                if mask is None:
+                    raise ArgsException('[!] RPS must be "all" or a hex CPU mask.')
+                return Tuning.format_mask(mask)
+        raise ArgsException(f'[!] Unknown tuning setting "{key}".')
+
+    @staticmethod
+    def parse_mask(value: str) -> int | None:
+        """
+        Returns a hex CPU mask, which may be split into comma-separated groups
+        of 32 CPUs, or None if it is invalid.
+        """
+        if not _REGEX_MASK.fullmatch(value):
+            return None
+        groups = value.split(",")
+        if len(groups) > 1 and any(len(g) > 8 for g in groups[1:]):
+            return None
+        mask = 0
+        for group in groups:
+            mask = (mask << 32) | int(group, 16)
+        return mask
+
+    @staticmethod
+    def format_mask(mask: int) -> str:
+        """
+        Returns a CPU mask as the kernel reads it from sysfs: in hex, with a
+        comma between each group of 32 CPUs.
+        """
+        digits = format(mask, "x")
+        groups = list(digits[max(i - 8, 0) : i] for i in range(len(digits), 0, -8))
+        return ",".join(reversed(groups))
+
+    @staticmethod
+    def link_mtu(link: str, sysfs: str | None = None) -> int | None:
+        if sysfs is None:
+            sysfs = SYSFS_NET
+        try:
+            with open(f"{sysfs}/{link}/mtu", "r") as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def mtu(tuning: dict, link: str, sysfs: str | None = None) -> int | None:
+        """
+        Returns the MTU to configure, reading the uplink's MTU for "auto".
+        """
+        mtu = tuning.get("mtu")
+        if mtu != "auto":
+            return mtu
+        link_mtu = Tuning.link_mtu(link, sysfs) if link else None
+        return (link_mtu or DEFAULT_LINK_MTU) - WIREGUARD_OVERHEAD
+
+    @staticmethod
+    def directives(tuning: dict, link: str, sysfs: str | None = None) -> str:
+        """
+        Returns the [Interface] directives for `tuning`.
+        """
+        lines: list[str] = []
+        mtu = Tuning.mtu(tuning, link, sysfs)
+        if mtu is not None:
+            lines.append(f"MTU = {mtu}\n")
+        if tuning.get("fwmark") is not None:
+            lines.append(f"FwMark = {tuning['fwmark']}\n")
+        if tuning.get("table") is not None:
+            lines.append(f"Table = {tuning['table']}\n")
+        return "".join(lines)
+
+    @staticmethod
+    def post_up(tuning: dict, link: str) -> str:
+        """
+        Returns the PostUp steps for `tuning`.
+        """
+        steps: list[str] = []
+        if tuning.get("txqueuelen") is not None:
+            steps.append(
+                CONFIG_TUNING_TXQUEUELEN.format(txqueuelen=tuning["txqueuelen"])
+            )
+        if link and tuning.get("offload") is not None:
+            steps.append(
+                CONFIG_TUNING_OFFLOAD.format(link=link, state=tuning["offload"])
+            )
+        if link and tuning.get("rps") is not None:
+            if tuning["rps"] == "all":
+                mask = (1 << (os.cpu_count() or 1)) - 1
+            else:
+                mask = Tuning.parse_mask(tuning["rps"]) or 0
+            steps.append(
+                CONFIG_TUNING_RPS.format(link=link, mask=Tuning.format_mask(mask))
+            )
+        if not steps:
+            return ""
+        return "\n# Tuning\n" + "".join(steps)
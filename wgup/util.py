@@ -1,9 +1,14 @@
+import hashlib
 import ipaddress
+import math
+import os
 import random
 import re
+import socket
 import string
+from typing import Iterable
 
-_REGEX_IFNAME = r"[a-zA-Z][a-zA-Z0-9_]{1,14}"
+_REGEX_IFNAME = r"[a-zA-Z][a-zA-Z0-9_-]{1,14}"
 _REGEX_NICKNAME = r"[a-zA-Z][a-zA-Z0-9_]{1,20}"
 
 
@@ -27,6 +32,47 @@ class PeerNotFoundException(ExitException):
     pass
 
 
+class InterfaceExistsException(ExitException):
+    pass
+
+
+class PeerExistsException(ExitException):
+    pass
+
+
+class HelperException(ExitException):
+    pass
+
+
+class ImportException(ExitException):
+    pass
+
+
+class PoolExhaustedException(ExitException):
+    pass
+
+
+class ClusterException(ExitException):
+    pass
+
+
+class KeystoreException(ExitException):
+    pass
+
+
+class CommandException(ExitException):
+    """
+    Raised after a batch of concurrent commands has finished, listing every
+    command that failed as (args, reason).
+    """
+
+    def __init__(self, failures: list[tuple[list[str], str]], total: int):
+        self.failures = failures
+        lines = [f"[!] {len(failures)} of {total} commands failed:"]
+        lines.extend(f"    {' '.join(args)}: {reason}" for args, reason in failures)
+        super().__init__("\n".join(lines))
+
+
 class Input:
     @staticmethod
     def check_int(
@@ -76,6 +122,20 @@ class Input:
                 return False, "Value is required."
         return True, ""
 
+    @staticmethod
+    def check_endpoint(value: str, optional: bool = False):
+        if value:
+            host, _, port = value.rpartition(":")
+            if not host or host == "[]":
+                return False, "Not in host:port ([addr]:port for IPv6)."
+            valid, reason = Input.check_int(port, min_value=1, max_value=65535)
+            if not valid:
+                return False, f"Port is invalid: {reason}"
+        else:
+            if not optional:
+                return False, "Value is required."
+        return True, ""
+
     @staticmethod
     def check_peer_name(value: str, optional: bool = False):
         if value:
@@ -91,33 +151,129 @@ class Input:
 
 
 class IP:
+    @staticmethod
+    def split(cidr: str, count: int) -> list[str]:
+        """
+        Splits `cidr` into the smallest power of two of equal subnets that is
+        at least `count`, and returns the first `count` of them.
+        """
+        network = ipaddress.ip_network(cidr)
+        diff = math.ceil(math.log2(count)) if count > 1 else 0
+        # each subnet needs room for the server address and at least 1 peer
+        if network.prefixlen + diff > network.max_prefixlen - 2:
+            raise ArgsException(f"[!] {cidr} is too small to be split {count} ways.")
+        subnets = network.subnets(prefixlen_diff=diff)
+        return list(str(next(subnets)) for _ in range(count))
+
     @staticmethod
     def server_addr4(cidr4: str):
         mask = cidr4.split("/", 2)[1]
         return str(ipaddress.IPv4Network(cidr4)[1]) + f"/{mask}"
 
     @staticmethod
-    def next_addr4(interface_cidr4: str, peers_cidr4: list[str]):
-        network = ipaddress.IPv4Network(interface_cidr4)
-        pools = [network]
-        exclusions: list[ipaddress.IPv4Network] = [
-            ipaddress.IPv4Network(network[0]),
-            ipaddress.IPv4Network(network[1]),
-        ]
-        exclusions.extend(
-            ipaddress.IPv4Network(peer_cidr4) for peer_cidr4 in peers_cidr4
+    def block_range(cidr: str, version: int) -> tuple[int, int] | None:
+        """
+        Returns the first and last address of `cidr` as integers, or None if
+        it is not an address of the given IP version. Much cheaper than
+        building an ipaddress network.
+        """
+        family, bits = (socket.AF_INET, 32) if version == 4 else (socket.AF_INET6, 128)
+        addr, _, prefix = cidr.partition("/")
+        try:
+            start = int.from_bytes(socket.inet_pton(family, addr))
+        except OSError:
+            return None
+        host_bits = bits - int(prefix or bits)
+        start = start >> host_bits << host_bits
+        return start, start | ((1 << host_bits) - 1)
+
+    @staticmethod
+    def used_ranges(
+        network: ipaddress.IPv4Network | ipaddress.IPv6Network,
+        existing: Iterable[str],
+    ) -> list[tuple[int, int]]:
+        """
+        Returns the addresses in `network` that are not free for new peers:
+        the network address, the server address (the first host) and every
+        CIDR in `existing`, as sorted, non-overlapping (first, last) ranges.
+        """
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        used = [(first, min(first + 1, last))]
+        for cidr in existing:
+            block = IP.block_range(cidr, network.version)
+            if block is None or block[1] < first or block[0] > last:
+                # peer pool not in interface pool, skip it
+                continue
+            used.append((max(block[0], first), min(block[1], last)))
+        used.sort()
+        merged = [used[0]]
+        for start, end in used[1:]:
+            if start <= merged[-1][1] + 1:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    @staticmethod
+    def _allocate(
+        network: ipaddress.IPv4Network | ipaddress.IPv6Network,
+        existing: list[str],
+        n: int,
+    ) -> list[str]:
+        """
+        Returns the first `n` free host addresses in `network`, skipping the
+        ranges in `used_ranges`. Works in a single sweep over them, so the
+        cost is one sort no matter how many addresses are requested.
+        """
+        first = int(network.network_address)
+        last = int(network.broadcast_address)
+        used = IP.used_ranges(network, existing)
+        free: list[int] = []
+        cursor = first
+        for start, end in used:
+            if len(free) >= n:
+                break
+            free.extend(range(cursor, min(start, cursor + n - len(free))))
+            cursor = max(cursor, end + 1)
+        free.extend(range(cursor, min(last + 1, cursor + n - len(free))))
+        if len(free) < n:
+            raise PoolExhaustedException(
+                f"[!] Not enough free addresses in {network} ({len(free)} left)."
+            )
+        family = socket.AF_INET if network.version == 4 else socket.AF_INET6
+        bits = network.max_prefixlen
+        size = bits // 8
+        return list(
+            f"{socket.inet_ntop(family, a.to_bytes(size))}/{bits}" for a in free
         )
-        for exclusion in exclusions:
-            next_pools: list[ipaddress.IPv4Network] = []
-            for pool in pools:
-                try:
-                    next_pools.extend(pool.address_exclude(exclusion))
-                except ValueError:
-                    # peer pool not in interface pool, skip it
-                    next_pools.append(pool)
-            pools = next_pools
-        assert pools
-        return f"{str(sorted(pools)[0][0])}/32"
+
+    @staticmethod
+    def allocate_many(cidr: str, existing: list[str], n: int) -> list[str]:
+        """
+        Returns `n` free host addresses (/32 or /128) in `cidr`, an IPv4 or
+        IPv6 network, that do not overlap `existing`.
+        """
+        return IP._allocate(ipaddress.ip_network(cidr), existing, n)
+
+    @staticmethod
+    def allocate_many_dual(
+        cidr4: str, existing4: list[str], cidr6: str, existing6: list[str], n: int
+    ) -> list[tuple[str, str]]:
+        """
+        Returns `n` (IPv4, IPv6) pairs of free host addresses.
+        """
+        return list(
+            zip(
+                IP.allocate_many(cidr4, existing4, n),
+                IP.allocate_many(cidr6, existing6, n),
+            )
+        )
+
+    @staticmethod
+    def next_addr4(interface_cidr4: str, peers_cidr4: list[str]):
+        return IP._allocate(ipaddress.IPv4Network(interface_cidr4), peers_cidr4, 1)[0]
 
     @staticmethod
     def auto_cidr4():
@@ -136,26 +292,37 @@ class IP:
 
     @staticmethod
     def next_addr6(interface_cidr6: str, peers_cidr6: list[str]):
-        network = ipaddress.IPv6Network(interface_cidr6)
-        pools = [network]
-        exclusions: list[ipaddress.IPv6Network] = [
-            ipaddress.IPv6Network(network[0]),
-            ipaddress.IPv6Network(network[1]),
-        ]
-        exclusions.extend(
-            ipaddress.IPv6Network(peer_cidr6) for peer_cidr6 in peers_cidr6
-        )
-        for exclusion in exclusions:
-            next_pools: list[ipaddress.IPv6Network] = []
-            for pool in pools:
-                try:
-                    next_pools.extend(pool.address_exclude(exclusion))
-                except ValueError:
-                    # peer pool not in interface pool, skip it
-                    next_pools.append(pool)
-            pools = next_pools
-        assert pools
-        return f"{str(sorted(pools)[0][0])}/128"
+        return IP._allocate(ipaddress.IPv6Network(interface_cidr6), peers_cidr6, 1)[0]
+
+    @staticmethod
+    def paired_addr6(cidr4: str, addr4: str, cidr6: str) -> str | None:
+        """
+        Returns the IPv6 host address at the same offset in `cidr6` as `addr4`
+        has in `cidr4`, or None if `addr4` is not a host address in `cidr4`.
+        """
+        network4 = ipaddress.IPv4Network(cidr4)
+        block = ipaddress.IPv4Network(addr4, strict=False)
+        if block.prefixlen != 32 or block.network_address not in network4:
+            return None
+        network6 = ipaddress.IPv6Network(cidr6)
+        offset = int(block.network_address) - int(network4.network_address)
+        if offset >= network6.num_addresses:
+            return None
+        return f"{network6[offset]}/128"
+
+    @staticmethod
+    def hashed_addr6(cidr6: str, name: str, attempt: int = 0) -> str:
+        """
+        Returns an IPv6 host address in `cidr6` derived from a hash of `name`.
+        The network and server addresses are never returned. Pass a higher
+        `attempt` to get a different address after a collision.
+        """
+        network6 = ipaddress.IPv6Network(cidr6)
+        if network6.num_addresses <= 2:
+            raise PoolExhaustedException(f"[!] No host addresses in {network6}.")
+        digest = hashlib.sha256(f"{name}/{attempt}".encode("utf-8")).digest()
+        offset = 2 + int.from_bytes(digest) % (network6.num_addresses - 2)
+        return f"{network6[offset]}/128"
 
     @staticmethod
     def auto_cidr6():
@@ -166,3 +333,14 @@ class IP:
             random.choice(string.hexdigits) for i in range(x)
         ).lower()
         return f"fd{rh(2)}:{rh(4)}:{rh(4)}::/64"
+
+
+def write_private(filename: str, content: str) -> str:
+    """
+    Writes a file that only its owner can read (e.g. a config containing a
+    private key). Returns the filename.
+    """
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(content)
+    return filename
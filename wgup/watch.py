@@ -0,0 +1,183 @@
+import ctypes
+import ctypes.util
+import hashlib
+import json
+import os
+import select
+import struct
+import time
+
+from wgup.wireguard import Interface
+
+# inotify(7) constants
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")
+
+# How long changes must stop before they are applied, and the longest a
+# change waits while they keep coming
+DEBOUNCE = 0.5
+MAX_DELAY = 5.0
+
+# How often the file is checked when inotify is not available
+POLL_INTERVAL = 1.0
+
+
+class _Inotify:
+    """
+    Reports the names of files written to a directory, using inotify through
+    libc.
+    """
+
+    def __init__(self, directory: str):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(_IN_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f'Cannot watch "{directory}"')
+        self.fd = fd
+
+    def read(self, timeout: float) -> list[str]:
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return []
+        data = os.read(self.fd, 64 * 1024)
+        names: list[str] = []
+        offset = 0
+        while offset < len(data):
+            _, _, _, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            names.append(os.fsdecode(data[offset : offset + length].rstrip(b"\0")))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+class _Poll:
+    """
+    Reports a file as written when its size, mtime or inode changes.
+    """
+
+    def __init__(self, directory: str, filename: str, interval: float):
+        self.path = f"{directory}/{filename}"
+        self.filename = filename
+        self.interval = interval
+        self.stat = self._stat()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_size, st.st_mtime_ns
+
+    def read(self, timeout: float) -> list[str]:
+        deadline = time.monotonic() + max(timeout, 0)
+        while True:
+            stat = self._stat()
+            if stat != self.stat:
+                self.stat = stat
+                return [self.filename]
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+
+class Watcher:
+    """
+    Waits for writes to a file (the config's interfaces.json) and tells which
+    interfaces changed since the last time.
+
+    Bulk edits write the file many times in a row, so `wait` only returns
+    once writes have stopped for `debounce` seconds (or `max_delay` seconds
+    after the first one, so that a steady stream of edits is still applied).
+    All writes in between are applied together.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        filename: str,
+        *,
+        debounce: float = DEBOUNCE,
+        max_delay: float = MAX_DELAY,
+        poll: bool = False,
+        poll_interval: float = POLL_INTERVAL,
+    ):
+        self.filename = filename
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.source: _Inotify | _Poll
+        if not poll:
+            try:
+                self.source = _Inotify(directory)
+            except (OSError, AttributeError, TypeError):
+                poll = True
+        if poll:
+            self.source = _Poll(directory, filename, poll_interval)
+        self.polling = poll
+        self.digests: dict[str, str] = {}
+
+    def _changes(self, timeout: float | None) -> int:
+        if timeout is None:
+            while True:
+                count = self._changes(3600)
+                if count:
+                    return count
+        return sum(1 for name in self.source.read(timeout) if name == self.filename)
+
+    def wait(self, timeout: float | None = None) -> tuple[float, int] | None:
+        """
+        Blocks until the file has been written and writes have settled.
+        Returns when the first write was seen (time.monotonic()) and how many
+        writes were merged, or None if nothing was written within `timeout`.
+        """
+        count = self._changes(timeout)
+        if not count:
+            return None
+        first = time.monotonic()
+        while True:
+            remaining = first + self.max_delay - time.monotonic()
+            if remaining <= 0:
+                break
+            more = self._changes(min(self.debounce, remaining))
+            if not more:
+                break
+            count += more
+        return first, count
+
+    @staticmethod
+    def digest(iface: Interface) -> str:
+        # key changes also change public keys or epochs, so the keystore need
+        # not be read
+        data = json.dumps(iface.to_json(secrets=False), sort_keys=True)
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def changed(self, ifaces: list[Interface]) -> list[Interface]:
+        """
+        Returns the interfaces that were added or modified since the last
+        call (all of them on the first call).
+        """
+        changed: list[Interface] = []
+        digests: dict[str, str] = {}
+        for iface in ifaces:
+            digest = self.digest(iface)
+            digests[iface.vpn_iface] = digest
+            if self.digests.get(iface.vpn_iface) != digest:
+                changed.append(iface)
+        self.digests = digests
+        return changed
+
+    def close(self):
+        self.source.close()
@@ -1,8 +1,21 @@
+import asyncio
+import itertools
 import json
+import os
+import signal
 import subprocess
+import sys
+import time
+from typing import Any, Coroutine, Iterable
 
 from wgup import defaults
-from wgup.util import IP
+from wgup.keyderive import KeyDerivation
+from wgup.keypool import KeyPool
+from wgup.keystore import InterfaceKeys
+from wgup.perf import Profile
+from wgup.shaping import Shaping
+from wgup.tuning import Tuning
+from wgup.util import IP, CommandException, HelperException
 
 CONFIG_FW_VPN_FWD = """
 # Firewall: Allow traffic flow within VPN interface
@@ -13,6 +26,19 @@ PreDown = iptables -D FORWARD -i {vpn_iface} -o {vpn_iface} -j ACCEPT
 PreDown = ip6tables -D FORWARD -i {vpn_iface} -o {vpn_iface} -j ACCEPT
 """
 
+CONFIG_FW_VPN_FWD_GROUP = """
+# Firewall: Allow traffic flow within the VPN interface group
+{post_up}
+{pre_down}"""
+
+CONFIG_FW_VPN_FWD_MEMBER_UP = """PostUp = iptables -I FORWARD -i {vpn_iface} -o {member} -j ACCEPT
+PostUp = ip6tables -I FORWARD -i {vpn_iface} -o {member} -j ACCEPT
+"""
+
+CONFIG_FW_VPN_FWD_MEMBER_DOWN = """PreDown = iptables -D FORWARD -i {vpn_iface} -o {member} -j ACCEPT
+PreDown = ip6tables -D FORWARD -i {vpn_iface} -o {member} -j ACCEPT
+"""
+
 CONFIG_FW_NAT_FLOW = """
 # Firewall: Allow traffic flow between VPN interface and NAT interface
 PostUp = iptables -I FORWARD -i {vpn_iface} -o {nat_iface} -j ACCEPT
@@ -46,6 +72,10 @@ Address = {cidr4}
 Address = {cidr6}
 """
 
+# Mesh peers with an endpoint listen on its port for the other mesh peers
+CONFIG_PEER_LISTEN_PORT = """ListenPort = {port}
+"""
+
 CONFIG_PEER_ENDPOINT = """
 [Peer]
 PublicKey = {public_key}
@@ -53,7 +83,9 @@ PresharedKey = {preshared_key}
 AllowedIPs = {cidr4}
 AllowedIPs = {cidr6}
 Endpoint = {endpoint}
-PersistentKeepalive = 10  # Keeps peers behind NATs accessible
+"""
+
+CONFIG_PEER_KEEPALIVE = """PersistentKeepalive = {keepalive}  # Keeps peers behind NATs accessible
 """
 
 CONFIG_INTERFACE_HEADER = """
@@ -73,58 +105,240 @@ AllowedIPs = {cidr4}
 AllowedIPs = {cidr6}
 """
 
+# Peers imported from configs without a preshared key
+CONFIG_INTERFACE_PEER_NO_PSK = CONFIG_INTERFACE_PEER.replace(
+    "PresharedKey = {preshared_key}\n", ""
+)
+
 
 class CommandLine:
+    @staticmethod
+    def _run(
+        args: list[str],
+        stdin: str | None = None,
+        capture: bool = False,
+        check: bool = True,
+    ):
+        """
+        Runs a command and raises CalledProcessError if it fails (unless
+        `check` is unset). Returns its stdout if `capture` is set.
+        """
+        start = time.perf_counter()
+        result = subprocess.run(
+            args,
+            stdout=subprocess.PIPE if capture else None,
+            input=stdin.encode("utf-8") if stdin is not None else None,
+        )
+        Profile.record_command(args, time.perf_counter() - start)
+        if check:
+            result.check_returncode()
+        if capture:
+            return result.stdout.decode("utf-8").strip()
+        return ""
+
     @staticmethod
     def generate_private_key() -> str:
-        result = subprocess.run(["wg", "genkey"], stdout=subprocess.PIPE)
-        result.check_returncode()
-        return result.stdout.decode("utf-8").strip()
+        return CommandLine._run(["wg", "genkey"], capture=True)
 
     @staticmethod
     def generate_public_key(private_key: str) -> str:
-        result = subprocess.run(
-            ["wg", "pubkey"], stdout=subprocess.PIPE, input=private_key.encode("utf-8")
-        )
-        result.check_returncode()
-        return result.stdout.decode("utf-8").strip()
+        return CommandLine._run(["wg", "pubkey"], stdin=private_key, capture=True)
 
     @staticmethod
     def generate_preshared_key() -> str:
-        result = subprocess.run(["wg", "genpsk"], stdout=subprocess.PIPE)
-        result.check_returncode()
-        return result.stdout.decode("utf-8").strip()
+        return CommandLine._run(["wg", "genpsk"], capture=True)
+
+    @staticmethod
+    def generate_keys() -> tuple[str, str, str]:
+        """
+        Returns a (private, public, preshared) key triple, taken from the key
+        pool if it has any left and generated with wg otherwise.
+        """
+        keys = KeyPool.take()
+        if keys is not None:
+            return keys
+        private_key = CommandLine.generate_private_key()
+        public_key = CommandLine.generate_public_key(private_key)
+        preshared_key = CommandLine.generate_preshared_key()
+        return private_key, public_key, preshared_key
 
     @staticmethod
     def service_up(if_name: str):
-        subprocess.run(
-            ["sudo", "systemctl", "enable", f"wg-quick@{if_name}"],
-        ).check_returncode()
-        subprocess.run(
-            ["sudo", "systemctl", "restart", f"wg-quick@{if_name}"],
-        ).check_returncode()
+        CommandLine._run(["sudo", "systemctl", "enable", f"wg-quick@{if_name}"])
+        CommandLine._run(["sudo", "systemctl", "restart", f"wg-quick@{if_name}"])
 
     @staticmethod
     def service_down(if_name: str):
-        subprocess.run(
-            ["sudo", "systemctl", "disable", f"wg-quick@{if_name}"],
-        ).check_returncode()
-        subprocess.run(
-            ["sudo", "systemctl", "stop", f"wg-quick@{if_name}"],
-        ).check_returncode()
+        CommandLine._run(["sudo", "systemctl", "disable", f"wg-quick@{if_name}"])
+        CommandLine._run(["sudo", "systemctl", "stop", f"wg-quick@{if_name}"])
 
     @staticmethod
     def service_reload(if_name: str):
-        subprocess.run(
-            ["sudo", "systemctl", "reload", f"wg-quick@{if_name}"],
-        ).check_returncode()
+        CommandLine._run(["sudo", "systemctl", "reload", f"wg-quick@{if_name}"])
+
+    @staticmethod
+    def service_apply(if_name: str):
+        """
+        Applies the installed config to the running interface in place, so
+        that existing sessions are not interrupted.
+        """
+        CommandLine._run(
+            [
+                "sudo",
+                "bash",
+                "-c",
+                'wg syncconf "$1" <(wg-quick strip "$1")',
+                "_",
+                if_name,
+            ]
+        )
+
+    @staticmethod
+    def show_dump(if_name: str) -> str:
+        return CommandLine._run(["sudo", "wg", "show", if_name, "dump"], capture=True)
 
     @staticmethod
     def copy_config(if_name: str, source_file: str):
-        result = subprocess.run(
-            ["sudo", "mv", source_file, f"/etc/wireguard/{if_name}.conf"],
+        CommandLine._run(["sudo", "mv", source_file, f"/etc/wireguard/{if_name}.conf"])
+
+    @staticmethod
+    def run_helper(plan: dict) -> list[dict]:
+        """
+        Runs a whole plan of installs and service actions with a single sudo
+        invocation of wgup.helper. Returns one result per step.
+        """
+        plan_file = f"{defaults.CONFIG_DIR}/helper_plan.json"
+        with open(plan_file, "w") as f:
+            f.write(json.dumps(plan))
+        try:
+            # -I keeps the working directory (and PYTHONPATH, user site
+            # packages) off sys.path, so that nothing but the installed wgup
+            # can run as root
+            output = CommandLine._run(
+                ["sudo", sys.executable, "-I", "-m", "wgup.helper", plan_file],
+                capture=True,
+                check=False,
+            )
+        finally:
+            os.remove(plan_file)
+        if not output:
+            raise HelperException("[!] Privileged helper did not run the plan.")
+        return json.loads(output)
+
+
+class AsyncCommandLine:
+    """
+    Runs commands as concurrent asyncio subprocesses, at most `concurrency`
+    at a time, killing any that take longer than `timeout` seconds.
+
+    `gather` runs a batch of coroutines that use `run` to completion, even if
+    some of their commands fail, and then raises a single CommandException
+    that lists every failure. A failed command raises CalledProcessError,
+    TimeoutExpired or OSError within its coroutine, like CommandLine does.
+    """
+
+    CONCURRENCY = 16
+    TIMEOUT = 30.0
+
+    def __init__(self, concurrency: int = CONCURRENCY, timeout: float = TIMEOUT):
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self._semaphore: asyncio.Semaphore | None = None
+
+    async def run(self, args: list[str], stdin: str | None = None) -> str:
+        """
+        Runs a command and returns its stdout.
+        """
+        assert self._semaphore is not None, "run() must be awaited within gather()"
+        async with self._semaphore:
+            start = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                # so that a timeout can kill everything the command started
+                start_new_session=True,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(
+                    process.communicate(
+                        stdin.encode("utf-8") if stdin is not None else None
+                    ),
+                    self.timeout,
+                )
+            except asyncio.TimeoutError:
+                try:
+                    os.killpg(process.pid, signal.SIGKILL)
+                except PermissionError:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+                raise subprocess.TimeoutExpired(args, self.timeout)
+            finally:
+                Profile.record_command(args, time.perf_counter() - start)
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(
+                process.returncode, args, stdout, stderr
+            )
+        return stdout.decode("utf-8").strip()
+
+    @staticmethod
+    def reason(e: BaseException) -> str:
+        """
+        Describes why a command failed.
+        """
+        if isinstance(e, subprocess.CalledProcessError):
+            stderr = e.stderr.decode("utf-8").strip() if e.stderr else ""
+            return f"exit status {e.returncode}" + (f": {stderr}" if stderr else "")
+        if isinstance(e, subprocess.TimeoutExpired):
+            return f"timed out after {e.timeout:g}s"
+        if isinstance(e, OSError) and e.strerror:
+            return e.strerror
+        return str(e)
+
+    async def _gather(self, coroutines: list[Coroutine]) -> list:
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return await asyncio.gather(*coroutines, return_exceptions=True)
+
+    def gather(self, coroutines: Iterable[Coroutine]) -> list[Any]:
+        """
+        Runs the coroutines concurrently and returns their results in order.
+        Raises CommandException if any of them failed.
+        """
+        coroutines = list(coroutines)
+        results = asyncio.run(self._gather(coroutines))
+        failures: list[tuple[list[str], str]] = []
+        for result in results:
+            if isinstance(
+                result, (subprocess.CalledProcessError, subprocess.TimeoutExpired)
+            ):
+                failures.append((list(result.cmd), self.reason(result)))
+            elif isinstance(result, OSError):
+                failures.append(([str(result.filename or "")], self.reason(result)))
+            elif isinstance(result, BaseException):
+                raise result
+        if failures:
+            raise CommandException(failures, len(results))
+        return results
+
+    async def generate_key_pair(self) -> tuple[str, str]:
+        private_key = await self.run(["wg", "genkey"])
+        public_key = await self.run(["wg", "pubkey"], stdin=private_key)
+        return private_key, public_key
+
+    async def generate_keys(self) -> tuple[str, str, str]:
+        """
+        Like CommandLine.generate_keys.
+        """
+        keys = KeyPool.take()
+        if keys is not None:
+            return keys
+        (private_key, public_key), preshared_key = await asyncio.gather(
+            self.generate_key_pair(), self.run(["wg", "genpsk"])
         )
-        result.check_returncode()
+        return private_key, public_key, preshared_key
 
 
 class Peer:
@@ -132,24 +346,144 @@ class Peer:
         self,
         *,
         name: str,
-        private_key: str,
+        private_key: str | None,
         public_key: str,
-        preshared_key: str,
+        preshared_key: str | None,
         cidr4: str,
         cidr6: str,
+        endpoint: str = "",
+        mesh: bool = False,
+        keepalive: str = "",
+        peer_class: str = "",
+        observed: dict | None = None,
+        rate: str = "",
+        key_epoch: int | None = None,
+        key_seed: str | None = "",
+        secrets: InterfaceKeys | None = None,
+        enabled: bool = True,
+        created: int = 0,
+        last_seen: int = 0,
     ):
         self.name = name
-        self.private_key = private_key
+        # Keys that are None have not been read from the keystore yet (see
+        # wgup.keystore)
+        self._private_key = private_key
         self.public_key = public_key
-        self.preshared_key = preshared_key
+        self._preshared_key = preshared_key
+        # With a key epoch, the private and preshared keys are derived from
+        # the interface's seed instead of being stored (see wgup.keyderive)
+        self.key_epoch = key_epoch
+        self._key_seed = key_seed
+        self._secrets = secrets
         self.cidr4 = cidr4
         self.cidr6 = cidr6
+        # where other peers can reach this peer directly (host:port)
+        self.endpoint = endpoint
+        # whether this peer gets direct [Peer] entries for the other mesh
+        # peers (see wgup.mesh) instead of reaching them through the server
+        self.mesh = mesh
+        # keepalive policy for this peer, its class, and what `wg show dump`
+        # has shown about it (see wgup.keepalive)
+        self.keepalive = keepalive
+        self.peer_class = peer_class
+        self.observed = observed
+        # rate limit for traffic to this peer (see wgup.shaping)
+        self.rate = rate
+        # disabled peers are left out of the interface's config; when the
+        # peer was created and last completed a handshake, as Unix times (0
+        # if unknown), to find idle peers (see wgup.reap)
+        self.enabled = enabled
+        self.created = created
+        self.last_seen = last_seen
+
+    def _stored_keys(self) -> tuple[str, str]:
+        if self._private_key is None or self._preshared_key is None:
+            if self._secrets is None:
+                raise ValueError(f'Keys of peer "{self.name}" are not loaded.')
+            self._private_key, self._preshared_key = self._secrets.peer(self.name)
+        return self._private_key, self._preshared_key
+
+    @property
+    def keys_loaded(self) -> bool:
+        """
+        Whether the peer has stored keys that were read from the keystore or
+        changed since.
+        """
+        return self.key_epoch is None and self._private_key is not None
+
+    @property
+    def key_seed(self) -> str:
+        if self._key_seed is None:
+            if self._secrets is None:
+                raise ValueError(f'Key seed of peer "{self.name}" is not loaded.')
+            self._key_seed = self._secrets.key_seed()
+        return self._key_seed
+
+    @key_seed.setter
+    def key_seed(self, value: str):
+        self._key_seed = value
+
+    @property
+    def private_key(self) -> str:
+        if self.key_epoch is not None:
+            return KeyDerivation.keys(self.key_seed, self.name, self.key_epoch)[0]
+        return self._stored_keys()[0]
+
+    @private_key.setter
+    def private_key(self, value: str):
+        self.materialize()
+        self._stored_keys()
+        self._private_key = value
+
+    @property
+    def preshared_key(self) -> str:
+        if self.key_epoch is not None:
+            return KeyDerivation.keys(self.key_seed, self.name, self.key_epoch)[1]
+        return self._stored_keys()[1]
+
+    @preshared_key.setter
+    def preshared_key(self, value: str):
+        self.materialize()
+        self._stored_keys()
+        self._preshared_key = value
+
+    def materialize(self):
+        """
+        Stores the peer's derived keys, so that they no longer depend on the
+        interface's seed.
+        """
+        if self.key_epoch is None:
+            return
+        self._private_key, self._preshared_key = KeyDerivation.keys(
+            self.key_seed, self.name, self.key_epoch
+        )
+        self.key_epoch = None
+        self.key_seed = ""
+
+    @classmethod
+    def derived(cls, *, name: str, cidr4: str, cidr6: str, key_seed: str, epoch: int):
+        """
+        Creates a peer whose keys are derived from `key_seed` at `epoch`.
+        """
+        peer = cls(
+            name=name,
+            private_key=None,
+            public_key="",
+            preshared_key=None,
+            cidr4=cidr4,
+            cidr6=cidr6,
+            key_epoch=epoch,
+            key_seed=key_seed,
+            created=int(time.time()),
+        )
+        with Profile.phase("keygen"):
+            peer.public_key = KeyDerivation.public_key(peer.private_key)
+        return peer
 
     @classmethod
     def create(cls, *, name: str, cidr4: str, cidr6: str):
-        private_key = CommandLine.generate_private_key()
-        public_key = CommandLine.generate_public_key(private_key)
-        preshared_key = CommandLine.generate_preshared_key()
+        with Profile.phase("keygen"):
+            private_key, public_key, preshared_key = CommandLine.generate_keys()
         return cls(
             name=name,
             private_key=private_key,
@@ -157,20 +491,72 @@ class Peer:
             preshared_key=preshared_key,
             cidr4=cidr4,
             cidr6=cidr6,
+            created=int(time.time()),
+        )
+
+    @classmethod
+    def create_many(
+        cls,
+        addrs: list[tuple[str, str, str]],
+        concurrency: int = AsyncCommandLine.CONCURRENCY,
+    ):
+        """
+        Creates a peer for each (name, cidr4, cidr6), generating their keys
+        concurrently.
+        """
+        commands = AsyncCommandLine(concurrency)
+        with Profile.phase("keygen"):
+            keys = commands.gather(commands.generate_keys() for _ in addrs)
+        created = int(time.time())
+        return list(
+            cls(
+                name=name,
+                private_key=private_key,
+                public_key=public_key,
+                preshared_key=preshared_key,
+                cidr4=cidr4,
+                cidr6=cidr6,
+                created=created,
+            )
+            for (name, cidr4, cidr6), (private_key, public_key, preshared_key) in zip(
+                addrs, keys
+            )
         )
 
-    def rekey(self):
-        self.private_key = CommandLine.generate_private_key()
-        self.public_key = CommandLine.generate_public_key(self.private_key)
-        self.preshared_key = CommandLine.generate_preshared_key()
+    def set_keys(self, private_key: str, public_key: str, preshared_key: str):
+        """
+        Replaces the peer's keys with the given (stored) keys.
+        """
+        self._private_key, self.public_key = private_key, public_key
+        self._preshared_key = preshared_key
+        self.key_epoch = None
+        self.key_seed = ""
+
+    def rekey(self, key_seed: str = "", epoch: int = 0):
+        """
+        Replaces the peer's keys with new random ones or, given `key_seed`,
+        with the keys derived from it at `epoch` (see Interface.rekey_peer).
+        """
+        if not key_seed:
+            with Profile.phase("keygen"):
+                self.set_keys(*CommandLine.generate_keys())
+            return
+        self.key_seed, self.key_epoch = key_seed, epoch
+        self._private_key = self._preshared_key = None
+        with Profile.phase("keygen"):
+            self.public_key = KeyDerivation.public_key(self.private_key)
 
     def __get_peer_header(self) -> str:
-        return CONFIG_PEER_HEADER.format(
+        header = CONFIG_PEER_HEADER.format(
             name=self.name,
             private_key=self.private_key,
             cidr4=self.cidr4,
             cidr6=self.cidr6,
         )
+        if self.mesh and self.endpoint:
+            port = self.endpoint.rsplit(":", 1)[1]
+            header += CONFIG_PEER_LISTEN_PORT.format(port=port)
+        return header
 
     def __get_peer_endpoint(
         self,
@@ -180,14 +566,18 @@ class Peer:
         nat_cidr4: list[str],
         nat_cidr6: list[str],
         endpoint: str,
+        keepalive: int | None,
     ) -> str:
-        return CONFIG_PEER_ENDPOINT.format(
+        config = CONFIG_PEER_ENDPOINT.format(
             public_key=public_key,
             preshared_key=self.preshared_key,
             cidr4=",".join([vpn_cidr4, *nat_cidr4]),
             cidr6=",".join([vpn_cidr6, *nat_cidr6]),
             endpoint=endpoint,
         )
+        if keepalive is not None:
+            config += CONFIG_PEER_KEEPALIVE.format(keepalive=keepalive)
+        return config
 
     def get_config(
         self,
@@ -198,8 +588,10 @@ class Peer:
         endpoint_public_key: str,
         endpoint_host: str,
         endpoint_port: int,
+        mesh_peers: str = "",
+        keepalive: int | None = 10,
     ):
-        return "# Generated by {} v{}\n{}{}".format(
+        return "# Generated by {} v{}\n{}{}{}".format(
             defaults.PROG,
             defaults.VERSION,
             self.__get_peer_header(),
@@ -210,36 +602,184 @@ class Peer:
                 nat_cidr4,
                 nat_cidr6,
                 f"{endpoint_host}:{endpoint_port}",
+                keepalive,
             ),
+            mesh_peers,
         )
 
-    def to_json(self):
-        return {
-            "name": self.name,
-            "private_key": self.private_key,
-            "public_key": self.public_key,
-            "preshared_key": self.preshared_key,
-            "cidr4": self.cidr4,
-            "cidr6": self.cidr6,
-        }
+    def secrets(self) -> list[str] | None:
+        """
+        Returns the peer's stored (private, preshared) keys, as kept in the
+        keystore, or None if they are derived.
+        """
+        if self.key_epoch is not None:
+            return None
+        return list(self._stored_keys())
+
+    def to_json(self, secrets: bool = True):
+        """
+        Returns the peer as stored in interfaces.json, with its keys unless
+        `secrets` is unset (when they are kept in the keystore).
+        """
+        data: dict[str, Any] = {"name": self.name}
+        keys = self.secrets() if secrets else None
+        if keys is not None:
+            data["private_key"] = keys[0]
+        data["public_key"] = self.public_key
+        if keys is not None:
+            data["preshared_key"] = keys[1]
+        if self.key_epoch is not None:
+            data["key_epoch"] = self.key_epoch
+        data["cidr4"] = self.cidr4
+        data["cidr6"] = self.cidr6
+        if self.endpoint:
+            data["endpoint"] = self.endpoint
+        if self.mesh:
+            data["mesh"] = True
+        if self.keepalive:
+            data["keepalive"] = self.keepalive
+        if self.peer_class:
+            data["peer_class"] = self.peer_class
+        if self.observed:
+            data["observed"] = self.observed
+        if self.rate:
+            data["rate"] = self.rate
+        if not self.enabled:
+            data["enabled"] = False
+        if self.created:
+            data["created"] = self.created
+        if self.last_seen:
+            data["last_seen"] = self.last_seen
+        return data
 
     @classmethod
-    def from_json(cls, data: dict):
+    def from_json(
+        cls,
+        data: dict,
+        key_seed: str | None = "",
+        secrets: InterfaceKeys | None = None,
+    ):
+        """
+        Loads a peer. Keys missing from `data` are read from `secrets` when
+        first used, and so is `key_seed` if it is None.
+        """
+        key_epoch = data.get("key_epoch")
         return cls(
             name=data["name"],
-            private_key=data["private_key"],
+            private_key=data.get("private_key"),
             public_key=data["public_key"],
-            preshared_key=data["preshared_key"],
+            preshared_key=data.get("preshared_key"),
             cidr4=data["cidr4"],
             cidr6=data["cidr6"],
+            endpoint=data.get("endpoint", ""),
+            mesh=data.get("mesh", False),
+            keepalive=data.get("keepalive", ""),
+            peer_class=data.get("peer_class", ""),
+            observed=data.get("observed"),
+            rate=data.get("rate", ""),
+            key_epoch=key_epoch,
+            key_seed=key_seed if key_epoch is not None else "",
+            secrets=secrets,
+            enabled=data.get("enabled", True),
+            created=data.get("created", 0),
+            last_seen=data.get("last_seen", 0),
+        )
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: dict[str, list],
+        key_seed: str | None = "",
+        secrets: InterfaceKeys | None = None,
+    ) -> list["Peer"]:
+        """
+        Loads peers stored a key at a time (see wgup.snapshot): `columns` maps
+        keys of `from_json` data to the value of every peer, None where a
+        peer has none. Much cheaper than building a dict for each peer.
+        """
+        count = len(columns["name"])
+
+        def column(key: str, default: Any = None) -> Iterable:
+            values = columns.get(key)
+            if values is None:
+                return itertools.repeat(default, count)
+            if default is not None and None in values:
+                return list(default if v is None else v for v in values)
+            return values
+
+        return list(
+            cls(
+                name=name,
+                private_key=private_key,
+                public_key=public_key,
+                preshared_key=preshared_key,
+                cidr4=cidr4,
+                cidr6=cidr6,
+                endpoint=endpoint,
+                mesh=mesh,
+                keepalive=keepalive,
+                peer_class=peer_class,
+                observed=observed,
+                rate=rate,
+                key_epoch=key_epoch,
+                key_seed=key_seed if key_epoch is not None else "",
+                secrets=secrets,
+                enabled=enabled,
+                created=created,
+                last_seen=last_seen,
+            )
+            for (
+                name,
+                private_key,
+                public_key,
+                preshared_key,
+                cidr4,
+                cidr6,
+                endpoint,
+                mesh,
+                keepalive,
+                peer_class,
+                observed,
+                rate,
+                key_epoch,
+                enabled,
+                created,
+                last_seen,
+            ) in zip(
+                columns["name"],
+                column("private_key"),
+                columns["public_key"],
+                column("preshared_key"),
+                columns["cidr4"],
+                columns["cidr6"],
+                column("endpoint", ""),
+                column("mesh", False),
+                column("keepalive", ""),
+                column("peer_class", ""),
+                column("observed"),
+                column("rate", ""),
+                column("key_epoch"),
+                column("enabled", True),
+                column("created", 0),
+                column("last_seen", 0),
+            )
         )
 
 
 class Interface:
+    # How IPv6 addresses are chosen for new peers:
+    # - independent: the next free address, like IPv4
+    # - paired: the same host offset in vpn_cidr6 as the IPv4 address has
+    #   in vpn_cidr4
+    # - hashed: derived from a hash of the peer's name
+    ADDR_MODES = ("independent", "paired", "hashed")
+    # How peer keys are kept (see wgup.keyderive)
+    KEY_MODES = ("stored", "derived")
+
     def __init__(
         self,
         *,
-        private_key: str,
+        private_key: str | None,
         public_key: str,
         vpn_iface: str,
         vpn_cidr4: str,
@@ -253,8 +793,23 @@ class Interface:
         nat_cidr6: list[str] | None = None,
         dns: list[str] | None = None,
         peers: dict[str, Peer] | None = None,
+        rollout: dict | None = None,
+        addr_mode: str = "independent",
+        group: str = "",
+        group_size: int = 0,
+        net_cidr4: str = "",
+        net_cidr6: str = "",
+        tuning: dict | None = None,
+        keepalive: dict[str, str] | None = None,
+        shaping: dict | None = None,
+        key_seed: str | None = "",
+        key_epoch: int = 0,
+        secrets: InterfaceKeys | None = None,
     ):
-        self.private_key = private_key
+        # The private key and seed are read from the keystore when first used
+        # if they are None (see wgup.keystore)
+        self._private_key = private_key
+        self._secrets = secrets
         self.public_key = public_key
         self.vpn_iface = vpn_iface
         self.vpn_cidr4 = vpn_cidr4
@@ -278,6 +833,88 @@ class Interface:
         if peers is None:
             peers = {}
         self.peers = peers
+        self.rollout = rollout
+        self.addr_mode = addr_mode
+        # Members of an interface group (see wgup.group) or a cluster (see
+        # wgup.cluster) share one logical network, which is what their peers
+        # route over the tunnel.
+        self.group = group
+        self.group_size = group_size
+        self.net_cidr4 = net_cidr4
+        self.net_cidr6 = net_cidr6
+        if tuning is None:
+            tuning = {}
+        self.tuning = tuning
+        # keepalive policies by peer class (see wgup.keepalive)
+        if keepalive is None:
+            keepalive = {}
+        self.keepalive = keepalive
+        # total and per-class rate limits (see wgup.shaping)
+        if shaping is None:
+            shaping = {}
+        self.shaping = shaping
+        # seed that new peer keys are derived from ("" to store random keys),
+        # and the next key epoch, so that no epoch is ever used twice (see
+        # wgup.keyderive)
+        self._key_seed = key_seed
+        self.key_epoch = key_epoch
+
+    @property
+    def private_key(self) -> str:
+        if self._private_key is None:
+            if self._secrets is None:
+                raise ValueError(f'Key of interface "{self.vpn_iface}" is not loaded.')
+            self._private_key = self._secrets.private_key()
+        return self._private_key
+
+    @private_key.setter
+    def private_key(self, value: str):
+        self._private_key = value
+
+    @property
+    def key_seed(self) -> str:
+        if self._key_seed is None:
+            if self._secrets is None:
+                raise ValueError(f'Seed of interface "{self.vpn_iface}" is not loaded.')
+            self._key_seed = self._secrets.key_seed()
+        return self._key_seed
+
+    @key_seed.setter
+    def key_seed(self, value: str):
+        self._key_seed = value
+
+    @property
+    def key_mode(self) -> str:
+        # an unread seed is only left out for interfaces in derived mode
+        return "derived" if self._key_seed is None or self._key_seed else "stored"
+
+    @property
+    def secrets_loaded(self) -> bool:
+        """
+        Whether any of the interface's keys were read from the keystore or
+        changed since.
+        """
+        return (
+            self._private_key is not None
+            or bool(self._key_seed)
+            or any(peer.keys_loaded for peer in self.peers.values())
+        )
+
+    def secrets(self) -> dict:
+        """
+        Returns the key material of the interface and its peers, as kept in
+        the keystore.
+        """
+        data: dict[str, Any] = {"private_key": self.private_key}
+        if self.key_mode == "derived":
+            data["key_seed"] = self.key_seed
+        peers: dict[str, list[str]] = {}
+        for name, peer in sorted(self.peers.items()):
+            keys = peer.secrets()
+            if keys is not None:
+                peers[name] = keys
+        data["peers"] = peers
+        return data
 
     @classmethod
     def create(
@@ -289,8 +926,9 @@ class Interface:
         host: str,
         port: int,
     ):
-        private_key = CommandLine.generate_private_key()
-        public_key = CommandLine.generate_public_key(private_key)
+        with Profile.phase("keygen"):
+            private_key = CommandLine.generate_private_key()
+            public_key = CommandLine.generate_public_key(private_key)
         return cls(
             private_key=private_key,
             public_key=public_key,
@@ -303,7 +941,41 @@ class Interface:
             port=port,
         )
 
+    @property
+    def routed_cidr4(self) -> str:
+        """The IPv4 network that peers route over the tunnel."""
+        return self.net_cidr4 or self.vpn_cidr4
+
+    @property
+    def routed_cidr6(self) -> str:
+        """The IPv6 network that peers route over the tunnel."""
+        return self.net_cidr6 or self.vpn_cidr6
+
+    @staticmethod
+    def group_member(group: str, index: int) -> str:
+        return f"wg-{group}{index}"
+
     def __get_fw_vpn_fwd(self) -> str:
+        if self.group:
+            # let traffic flow to every member of the group, named one by one:
+            # a wildcard like wg-vpn+ would also match wg-vpn20 of group vpn2
+            members = list(
+                Interface.group_member(self.group, i) for i in range(self.group_size)
+            )
+            return CONFIG_FW_VPN_FWD_GROUP.format(
+                post_up="".join(
+                    CONFIG_FW_VPN_FWD_MEMBER_UP.format(
+                        vpn_iface=self.vpn_iface, member=m
+                    )
+                    for m in members
+                ),
+                pre_down="".join(
+                    CONFIG_FW_VPN_FWD_MEMBER_DOWN.format(
+                        vpn_iface=self.vpn_iface, member=m
+                    )
+                    for m in members
+                ),
+            )
         return CONFIG_FW_VPN_FWD.format(vpn_iface=self.vpn_iface)
 
     def __get_fw_nat_flow(self) -> str:
@@ -334,19 +1006,34 @@ class Interface:
             cidr4=self.addr4,
             cidr6=self.addr6,
             port=self.port,
+        ) + Tuning.directives(self.tuning, self.nat_iface)
+
+    @property
+    def active_peers(self) -> list[Peer]:
+        """
+        The peers that are not disabled, which are the only ones in the
+        interface's config.
+        """
+        return list(peer for peer in self.peers.values() if peer.enabled)
+
+    def peer_entry(self, peer: Peer) -> str:
+        """
+        Returns the [Peer] section of the interface's config for `peer`.
+        """
+        return (
+            CONFIG_INTERFACE_PEER
+            if peer.preshared_key
+            else CONFIG_INTERFACE_PEER_NO_PSK
+        ).format(
+            name=peer.name,
+            public_key=peer.public_key,
+            preshared_key=peer.preshared_key,
+            cidr4=peer.cidr4,
+            cidr6=peer.cidr6,
         )
 
     def __get_peers_config(self):
-        return "".join(
-            CONFIG_INTERFACE_PEER.format(
-                name=peer.name,
-                public_key=peer.public_key,
-                preshared_key=peer.preshared_key,
-                cidr4=peer.cidr4,
-                cidr6=peer.cidr6,
-            )
-            for peer in self.peers.values()
-        )
+        return "".join(self.peer_entry(peer) for peer in self.active_peers)
 
     def __get_nat_config(self) -> str:
         if self.nat_iface and (self.nat_cidr4 or self.nat_cidr6):
@@ -357,49 +1044,211 @@ class Interface:
         return ""
 
     def get_config(self) -> str:
-        return "# Generated by {} v{}\n{}{}{}{}".format(
+        return "# Generated by {} v{}\n{}{}{}{}{}{}".format(
             defaults.PROG,
             defaults.VERSION,
             self.__get_network_header(),
             self.__get_fw_vpn_fwd(),
             self.__get_nat_config(),
+            Tuning.post_up(self.tuning, self.nat_iface),
+            Shaping.config(
+                self.vpn_iface, self.vpn_cidr4, self.shaping, self.active_peers
+            ),
             self.__get_peers_config(),
         )
 
+    def pair_addr6(self, name: str, cidr4: str, used6: set[str]) -> str | None:
+        """
+        Returns the IPv6 address that addr_mode assigns to a peer with the
+        given name and IPv4 address, or None if the mode is "independent" or
+        the address cannot be used.
+        """
+        if self.addr_mode == "paired":
+            cidr6 = IP.paired_addr6(self.vpn_cidr4, cidr4, self.vpn_cidr6)
+            return cidr6 if cidr6 not in used6 else None
+        if self.addr_mode == "hashed":
+            for attempt in range(8):
+                cidr6 = IP.hashed_addr6(self.vpn_cidr6, name, attempt)
+                if cidr6 not in used6:
+                    return cidr6
+        return None
+
+    def allocate(self, names: list[str]) -> list[tuple[str, str]]:
+        """
+        Returns an (IPv4, IPv6) address pair for each new peer name.
+        """
+        used4 = list(peer.cidr4 for peer in self.peers.values())
+        used6 = list(peer.cidr6 for peer in self.peers.values())
+        if self.addr_mode == "independent":
+            return IP.allocate_many_dual(
+                self.vpn_cidr4, used4, self.vpn_cidr6, used6, len(names)
+            )
+        addrs4 = IP.allocate_many(self.vpn_cidr4, used4, len(names))
+        used6_set = set(used6)
+        addrs6: list[str | None] = []
+        for name, cidr4 in zip(names, addrs4):
+            cidr6 = self.pair_addr6(name, cidr4, used6_set)
+            if cidr6 is not None:
+                used6_set.add(cidr6)
+            addrs6.append(cidr6)
+        # anything that could not be paired falls back to the next free address
+        missing = list(i for i, a in enumerate(addrs6) if a is None)
+        if missing:
+            fallback = IP.allocate_many(self.vpn_cidr6, list(used6_set), len(missing))
+            for i, cidr6 in zip(missing, fallback):
+                addrs6[i] = cidr6
+        return list(zip(addrs4, addrs6))
+
     def sync(self, source_file: str):
         CommandLine.copy_config(self.vpn_iface, source_file)
 
-    def rekey(self):
-        self.private_key = CommandLine.generate_private_key()
-        self.public_key = CommandLine.generate_public_key(self.private_key)
-        for peer in self.peers.values():
+    def next_key_epoch(self) -> int:
+        epoch = self.key_epoch
+        self.key_epoch += 1
+        return epoch
+
+    def create_peer(self, name: str, cidr4: str, cidr6: str) -> Peer:
+        """
+        Creates a peer, with keys derived from the interface's seed if it has
+        one. The peer is not added to it.
+        """
+        if not self.key_seed:
+            return Peer.create(name=name, cidr4=cidr4, cidr6=cidr6)
+        return Peer.derived(
+            name=name,
+            cidr4=cidr4,
+            cidr6=cidr6,
+            key_seed=self.key_seed,
+            epoch=self.next_key_epoch(),
+        )
+
+    def create_peers(
+        self,
+        addrs: list[tuple[str, str, str]],
+        concurrency: int = AsyncCommandLine.CONCURRENCY,
+    ) -> list[Peer]:
+        """
+        Like create_peer for each (name, cidr4, cidr6), generating random keys
+        concurrently.
+        """
+        if not self.key_seed:
+            return Peer.create_many(addrs, concurrency)
+        return list(self.create_peer(*addr) for addr in addrs)
+
+    def rekey_peer(self, peer: Peer):
+        """
+        Gives `peer` new keys. With a seed, this moves the peer to a new key
+        epoch instead of running `wg`.
+        """
+        if self.key_seed:
+            peer.rekey(self.key_seed, self.next_key_epoch())
+        else:
             peer.rekey()
 
-    def to_json(self):
-        return {
-            "private_key": self.private_key,
-            "public_key": self.public_key,
-            "vpn_iface": self.vpn_iface,
-            "vpn_cidr4": self.vpn_cidr4,
-            "vpn_cidr6": self.vpn_cidr6,
-            "addr4": self.addr4,
-            "addr6": self.addr6,
-            "host": self.host,
-            "port": self.port,
-            "nat_iface": self.nat_iface,
-            "nat_cidr4": self.nat_cidr4,
-            "nat_cidr6": self.nat_cidr6,
-            "peers": list(p[1].to_json() for p in sorted(self.peers.items())),
-        }
+    def rekey(self, concurrency: int = AsyncCommandLine.CONCURRENCY):
+        """
+        Generates new keys for the interface and all of its peers, running
+        `wg` for up to `concurrency` peers at a time. Nothing is changed if
+        any key cannot be generated. Derived keys move to a new seed, since
+        anyone holding the old one could compute any epoch under it.
+        """
+        peers = list(self.peers.values())
+        commands = AsyncCommandLine(concurrency)
+        with Profile.phase("keygen"):
+            (private_key, public_key), *keys = commands.gather(
+                [commands.generate_key_pair()]
+                + list(commands.generate_keys() for _ in peers if not self.key_seed)
+            )
+        self.private_key, self.public_key = private_key, public_key
+        if self.key_seed:
+            self.key_seed = KeyDerivation.new_seed()
+            for peer in peers:
+                self.rekey_peer(peer)
+            return
+        for peer, peer_keys in zip(peers, keys):
+            peer.set_keys(*peer_keys)
+
+    def set_key_mode(self, mode: str):
+        """
+        Switches between "stored" (random) and "derived" keys for new and
+        rekeyed peers. Switching to stored keys stores the keys of derived
+        peers, so that no peer's keys change.
+        """
+        if mode not in self.KEY_MODES:
+            raise ValueError(f"Unknown key mode: {mode}")
+        if mode == "derived" and self.key_mode == "stored":
+            self.key_seed = KeyDerivation.new_seed()
+        elif mode == "stored":
+            for peer in self.peers.values():
+                peer.materialize()
+            self.key_seed = ""
+
+    def to_json(self, secrets: bool = True):
+        """
+        Returns the interface as stored in interfaces.json, with its keys and
+        those of its peers unless `secrets` is unset (when they are kept in
+        the keystore).
+        """
+        data: dict[str, Any] = {}
+        if secrets:
+            data["private_key"] = self.private_key
+        data.update(
+            {
+                "public_key": self.public_key,
+                "vpn_iface": self.vpn_iface,
+                "vpn_cidr4": self.vpn_cidr4,
+                "vpn_cidr6": self.vpn_cidr6,
+                "addr4": self.addr4,
+                "addr6": self.addr6,
+                "host": self.host,
+                "port": self.port,
+                "nat_iface": self.nat_iface,
+                "nat_cidr4": self.nat_cidr4,
+                "nat_cidr6": self.nat_cidr6,
+                "peers": list(
+                    p[1].to_json(secrets) for p in sorted(self.peers.items())
+                ),
+            }
+        )
+        if self.addr_mode != "independent":
+            data["addr_mode"] = self.addr_mode
+        if self.rollout is not None:
+            data["rollout"] = self.rollout
+        if self.group:
+            data["group"] = self.group
+            data["group_size"] = self.group_size
+        if self.net_cidr4 or self.net_cidr6:
+            data["net_cidr4"] = self.net_cidr4
+            data["net_cidr6"] = self.net_cidr6
+        if self.tuning:
+            data["tuning"] = self.tuning
+        if self.keepalive:
+            data["keepalive"] = self.keepalive
+        if self.shaping:
+            data["shaping"] = self.shaping
+        if self.key_mode == "derived":
+            data["key_mode"] = "derived"
+            if secrets:
+                data["key_seed"] = self.key_seed
+        if self.key_epoch:
+            data["key_epoch"] = self.key_epoch
+        return data
 
     @classmethod
-    def from_json(cls, data: dict):
+    def from_json(cls, data: dict, secrets: InterfaceKeys | None = None):
+        """
+        Loads an interface. Keys missing from `data` are read from `secrets`
+        when first used.
+        """
+        key_seed = data.get("key_seed", "")
+        if "key_seed" not in data and data.get("key_mode") == "derived":
+            key_seed = None
         peers: dict[str, Peer] = {}
         for p in data["peers"]:
-            peer = Peer.from_json(p)
+            peer = Peer.from_json(p, key_seed, secrets)
             peers[peer.name] = peer
         return cls(
-            private_key=data["private_key"],
+            private_key=data.get("private_key"),
             public_key=data["public_key"],
             vpn_iface=data["vpn_iface"],
             vpn_cidr4=data["vpn_cidr4"],
@@ -412,4 +1261,16 @@ class Interface:
             nat_cidr4=data["nat_cidr4"],
             nat_cidr6=data["nat_cidr6"],
             peers=peers,
+            rollout=data.get("rollout"),
+            addr_mode=data.get("addr_mode", "independent"),
+            group=data.get("group", ""),
+            group_size=data.get("group_size", 0),
+            net_cidr4=data.get("net_cidr4", ""),
+            net_cidr6=data.get("net_cidr6", ""),
+            tuning=data.get("tuning"),
+            keepalive=data.get("keepalive"),
+            shaping=data.get("shaping"),
+            key_seed=key_seed,
+            key_epoch=data.get("key_epoch", 0),
+            secrets=secrets,
         )